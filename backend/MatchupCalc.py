@@ -1,10 +1,12 @@
 from fastapi import FastAPI
 from fastapi.responses import JSONResponse
-import traceback
+import logging
 from datetime import datetime, date
 from dotenv import load_dotenv
 import os
 from datetime import timedelta
+import numpy as np
+import pandas as pd
 
 # Load environment variables early
 load_dotenv()
@@ -15,16 +17,19 @@ API_SECRET = os.getenv("ALPACA_API_SECRET")
 TIME_CHUNK_SIZE = os.getenv("TIME_CHUNK_SIZE")
 
 # Your other imports and constants
-from database import get_client, retrieve_stock, add_entries
-from stocks import fetch_price
+from database import client_pool
+from stocks import fetch_prices
+from standings import standings
 
 app = FastAPI()
 
+logger = logging.getLogger(__name__)
+
 def get_current_week(client):
     today = datetime.today()
     response = client.table("matchups").select("created_date").gte("created_date", today).order("created_date", desc = False).limit(1).execute()
     start_date = datetime.fromisoformat(response.data[0]['created_date'])
-    print(f"Start date for current week: {start_date}")
+    logger.debug("Start date for current week: %s", start_date)
     return ((today - start_date).days // 7) + 1
 
 def fetch_unprocessed_matchups(client, end_time):
@@ -32,7 +37,7 @@ def fetch_unprocessed_matchups(client, end_time):
     week = get_current_week(client)
     all_matchups = []
     response = client.table("matchups").select("*").order("week", desc=False).is_("winner_id", None).execute()
-    print(f"Fetched {len(response.data)} unprocessed matchups for week {week} ending on {today_str}.")
+    logger.info("Fetched %d unprocessed matchups for week %d ending on %s.", len(response.data), week, today_str)
 
     for matchup in response.data:
         start_date = datetime.fromisoformat(matchup["created_date"]).date()
@@ -43,70 +48,103 @@ def fetch_unprocessed_matchups(client, end_time):
     
     return all_matchups
 
+"""
+Loads every portfolio and holding touched by the given matchups with one query each.
+Returns (portfolios indexed by league_member_id, holdings with columns league_member_id, ticker, stock_amount)
+"""
+def load_matchup_members(client, matchups):
+    member_ids = list({m[key] for m in matchups for key in ("user1_id", "user2_id")})
+
+    portfolios = pd.DataFrame(
+        client.table("portfolios").select("league_member_id", "current_balance", "start_of_week_total").in_("league_member_id", member_ids).execute().data,
+        columns=["league_member_id", "current_balance", "start_of_week_total"]
+    )
+    holdings = pd.DataFrame(
+        client.table("holdings").select("league_member_id", "ticker", "stock_amount").in_("league_member_id", member_ids).execute().data,
+        columns=["league_member_id", "ticker", "stock_amount"]
+    )
+
+    missing = set(member_ids) - set(portfolios.get("league_member_id", []))
+    if missing:
+        raise ValueError(f"No portfolio found for league members {sorted(missing)}.")
+
+    return portfolios.set_index("league_member_id", drop=False), holdings
+
+"""
+Prices each member's holdings at the end of their matchup week and returns {league_member_id -> total value}
+(cash balance plus holdings). Tickers are priced once per distinct week end time, reusing client for any database access.
+"""
+def value_portfolios(matchups, portfolios: pd.DataFrame, holdings: pd.DataFrame, week_number: int, client=None) -> pd.Series:
+    price_times = pd.DataFrame([
+        {"league_member_id": m[key], "price_time": datetime.fromisoformat(m["created_date"]) + timedelta(days=7 * week_number)}
+        for m in matchups for key in ("user1_id", "user2_id")
+    ]).drop_duplicates("league_member_id")
+
+    holdings = holdings.merge(price_times, on="league_member_id")
+    holdings["price"] = np.nan
+    for price_time, group in holdings.groupby("price_time"):
+        prices = fetch_prices(group["ticker"].unique().tolist(), price_time.to_pydatetime(), client)
+        holdings.loc[group.index, "price"] = group["ticker"].map({ticker: row["vwap"] for ticker, row in prices.items()})
+
+    holdings_value = (holdings["price"] * holdings["stock_amount"]).groupby(holdings["league_member_id"]).sum()
+    return portfolios["current_balance"].add(holdings_value, fill_value=0)
+
+"""
+Scores the given matchups and writes the winners, scores and next start_of_week_total of every member.
+Returns the matchup rows as written; the standings are left to the caller
+"""
 def weekly_score_calc(client, matchups):
-    for matchup in matchups:
-        user1_portfolio = client.table("portfolios").select("current_balance", "start_of_week_total").eq("league_member_id", matchup['user1_id']).execute().data[0]
-        user2_portfolio = client.table("portfolios").select("current_balance", "start_of_week_total").eq("league_member_id", matchup['user2_id']).execute().data[0]
-
-        user1_score = user1_portfolio["current_balance"]
-        user2_score = user2_portfolio["current_balance"]
-
-        user1_start_amount = user1_portfolio["start_of_week_total"]
-        user2_start_amount = user2_portfolio["start_of_week_total"]
-
-        user1_stocks = client.table("holdings").select("ticker", "stock_amount").eq("league_member_id", matchup['user1_id']).execute().data
-        user2_stocks = client.table("holdings").select("ticker", "stock_amount").eq("league_member_id", matchup['user2_id']).execute().data
-
-        week_number = get_current_week(client)
-
-        for stock in user1_stocks:
-            price = (fetch_price(stock['ticker'], datetime.fromisoformat(matchup["created_date"]) + timedelta(days=7 * week_number)))["vwap"]
-            user1_score += price * stock['stock_amount']
-
-        for stock in user2_stocks:
-            price = (fetch_price(stock['ticker'], datetime.fromisoformat(matchup["created_date"])  + timedelta(days=7 * week_number)))["vwap"]
-            user2_score += price * stock['stock_amount']
-
-        user1_score /= user1_start_amount
-        user2_score /= user2_start_amount
-
-        winner = matchup['user1_id'] if user1_score > user2_score else matchup['user2_id']
-
-        response = client.table("matchups").update({
-            "winner_id": winner,
-            "u1_score": user1_score,
-            "u2_score": user2_score
-        }).eq("id", matchup['id']).execute()
-        print("Update response:", response)
-
-        user1_score *= user1_start_amount
-        user2_score *= user2_start_amount
-
-        client.table("portfolios").update({
-            "start_of_week_total": user1_score
-        }).eq("league_member_id", matchup['user1_id']).execute()
-
-        client.table("portfolios").update({
-            "start_of_week_total": user2_score
-        }).eq("league_member_id", matchup['user2_id']).execute()
-
-
-    print("All matchups processed successfully.")
-    return True
+    week_number = get_current_week(client)
+    portfolios, holdings = load_matchup_members(client, matchups)
+    totals = value_portfolios(matchups, portfolios, holdings, week_number, client)
+
+    # One row per (matchup, side) in processing order. A member appearing in several matchups starts
+    # each later one from the total recorded by the previous one, exactly like processing them in turn
+    sides = pd.DataFrame([
+        {"matchup": i, "side": side, "league_member_id": m[f"user{side}_id"]}
+        for i, m in enumerate(matchups) for side in (1, 2)
+    ])
+    sides["total"] = sides["league_member_id"].map(totals)
+    sides["start"] = sides.groupby("league_member_id")["total"].shift(1)
+    sides["start"] = sides["start"].fillna(sides["league_member_id"].map(portfolios["start_of_week_total"]))
+    sides["score"] = sides["total"] / sides["start"]
+
+    scores = sides.pivot(index="matchup", columns="side", values="score")
+    user1_ids = np.array([m["user1_id"] for m in matchups], dtype=object)
+    user2_ids = np.array([m["user2_id"] for m in matchups], dtype=object)
+    winners = np.where(scores[1].to_numpy() > scores[2].to_numpy(), user1_ids, user2_ids)
+
+    matchup_rows = [
+        {**m, "winner_id": winner, "u1_score": float(u1_score), "u2_score": float(u2_score)}
+        for m, winner, u1_score, u2_score in zip(matchups, winners, scores[1], scores[2])
+    ]
+    response = client.table("matchups").upsert(matchup_rows, on_conflict="id").execute()
+    logger.info("Updated %d matchups.", len(response.data))
+
+    # Only start_of_week_total is written: current_balance may have changed through trades while the week was priced
+    final_totals = sides.groupby("league_member_id")["total"].last()
+    client.rpc("set_start_of_week_totals", {"p_totals": [
+        {"league_member_id": member, "start_of_week_total": float(total)} for member, total in final_totals.items()
+    ]}).execute()
+
+    logger.info("All matchups processed successfully.")
+    return matchup_rows
 
 def run_weekly_matchups():
-    client = get_client()
-    matchups = fetch_unprocessed_matchups(client, datetime.now())
-    
-    if not matchups:
-        print("No unprocessed matchups found.")
-        return False
-    
-    success = weekly_score_calc(client, matchups)
+    with client_pool.acquire() as client:
+        matchups = fetch_unprocessed_matchups(client, datetime.now())
+        
+        if not matchups:
+            logger.info("No unprocessed matchups found.")
+            return False
+        
+        scored = weekly_score_calc(client, matchups)
+        standings.record_scored(client, scored)
+        success = bool(scored)
     
     if success:
-        print("Weekly matchups processed successfully.")
+        logger.info("Weekly matchups processed successfully.")
     else:
-        print("Failed to process weekly matchups.")
+        logger.error("Failed to process weekly matchups.")
     
     return success
\ No newline at end of file
@@ -0,0 +1,206 @@
+from datetime import datetime, timedelta, timezone as tz, date
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+import numpy as np
+import pandas as pd
+import threading
+import tempfile
+import fcntl
+import re
+import os
+
+load_dotenv()
+
+BAR_STORE_ENABLED = os.getenv("BAR_STORE_ENABLED", "true").lower() == "true"
+BAR_STORE_DIR = os.getenv("BAR_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "bar_store"))
+
+SYMBOL_PATTERN = re.compile(r"[A-Z0-9][A-Z0-9.\-]{0,19}") # symbols become directory names, so nothing else is accepted
+
+BAR_DTYPE = np.dtype([
+    ("timestamp", np.int64), # seconds since epoch, UTC
+    ("open", np.float64),
+    ("high", np.float64),
+    ("low", np.float64),
+    ("close", np.float64),
+    ("volume", np.float64),
+    ("trade_count", np.int64),
+    ("vwap", np.float64),
+])
+
+"""
+Local columnar copy of stock_prices chunk rows. Each symbol has one .npy file of BAR_DTYPE records per week
+(BAR_STORE_DIR/<symbol>/<monday>.npy), sorted by timestamp and opened memory-mapped, so range reads are zero-copy
+slices found with a binary search instead of re-parsing JSON. Supabase stays the system of record; this store is a
+read-through layer that can also be used offline, e.g. for rescoring past weeks.
+"""
+class BarStore:
+    def __init__(self, root: str = BAR_STORE_DIR):
+        self.root = root
+        self.lock = threading.Lock()
+        self.maps: Dict[str, Tuple[float, np.ndarray]] = {} # {path -> (mtime, memory-mapped records)}
+
+    @staticmethod
+    def to_seconds(time: datetime) -> int:
+        return int(pd.Timestamp(time).timestamp())
+
+    @staticmethod
+    def week_of(seconds: int) -> date:
+        day = datetime.fromtimestamp(seconds, tz.utc).date()
+        return day - timedelta(days=day.weekday())
+
+    @staticmethod
+    def valid_symbol(symbol: str) -> bool:
+        return isinstance(symbol, str) and SYMBOL_PATTERN.fullmatch(symbol) is not None
+
+    def path(self, symbol: str, week: date) -> str:
+        if not self.valid_symbol(symbol):
+            raise ValueError(f"Invalid symbol {symbol!r}.")
+        return os.path.join(self.root, symbol, f"{week.isoformat()}.npy")
+
+    def load(self, path: str) -> Optional[np.ndarray]:
+        try:
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError:
+            return None
+
+        with self.lock:
+            cached = self.maps.get(path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+
+        records = np.load(path, mmap_mode="r")
+        with self.lock:
+            self.maps[path] = (mtime, records)
+        return records
+
+    """
+    Stores chunk rows (BAR_COLUMNS, any number of symbols). Rows already stored for a timestamp are replaced
+    """
+    def write(self, data: pd.DataFrame):
+        if data.empty:
+            return
+
+        seconds = pd.to_datetime(data["timestamp"], utc=True).dt.tz_localize(None).to_numpy().astype("datetime64[s]").astype(np.int64)
+        records = np.empty(len(data), dtype=BAR_DTYPE)
+        records["timestamp"] = seconds
+        for name in BAR_DTYPE.names[1:]:
+            records[name] = data[name].to_numpy()
+
+        symbols = data["symbol"].to_numpy()
+        weeks = np.array([self.week_of(s) for s in seconds])
+        for symbol in np.unique(symbols):
+            for week in np.unique(weeks[symbols == symbol]):
+                self.merge(symbol, week, records[(symbols == symbol) & (weeks == week)])
+
+    """
+    Rewrites a week file with new merged into it. Other workers write the same files, so the read-modify-write holds
+    an exclusive flock on <week>.npy.lock and always re-reads the file from disk, and the new file is written to a
+    unique temporary name in the same directory before it replaces the old one. self.lock is only held to drop the
+    cached map, so readers never wait on another process's merge
+    """
+    def merge(self, symbol: str, week: date, new: np.ndarray):
+        path = self.path(symbol, week)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        with open(f"{path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                existing = np.load(path) if os.path.exists(path) else None
+
+                combined = new if existing is None else np.concatenate([new, existing])
+                # Keep the first occurrence of each timestamp, which is the new row
+                _, first = np.unique(combined["timestamp"], return_index=True)
+                combined = combined[first]
+
+                fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        np.save(f, combined)
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    os.unlink(tmp_path)
+                    raise
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        with self.lock:
+            self.maps.pop(path, None)
+
+    """
+    Stored records of symbol with start <= timestamp <= end. Zero-copy when the range falls in one week.
+    Invalid symbols, e.g. from user input, have nothing stored
+    """
+    def read_range(self, symbol: str, start: datetime, end: datetime) -> np.ndarray:
+        if not self.valid_symbol(symbol):
+            return np.empty(0, dtype=BAR_DTYPE)
+        start_s, end_s = self.to_seconds(start), self.to_seconds(end)
+        parts = []
+        week = self.week_of(start_s)
+        while week <= self.week_of(end_s):
+            records = self.load(self.path(symbol, week))
+            if records is not None:
+                lo = np.searchsorted(records["timestamp"], start_s, side="left")
+                hi = np.searchsorted(records["timestamp"], end_s, side="right")
+                if hi > lo:
+                    parts.append(records[lo:hi])
+            week += timedelta(days=7)
+
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=BAR_DTYPE)
+
+    """
+    Converts records of one symbol into a stock_prices shaped row dict. The timestamp value is a pd.Timestamp
+    """
+    @staticmethod
+    def to_row(symbol: str, record) -> Dict:
+        row = {"symbol": symbol, "timestamp": pd.Timestamp(int(record["timestamp"]), unit="s", tz="UTC")}
+        for name in BAR_DTYPE.names[1:]:
+            row[name] = record[name].item()
+        return row
+
+    def read_at(self, symbol: str, time: datetime) -> Optional[Dict]:
+        records = self.read_range(symbol, time, time)
+        if len(records) == 0:
+            return None
+        return self.to_row(symbol, records[0])
+
+    """
+    Given several tickers and a single time chunk point, returns {ticker -> row} for the ones stored locally
+    """
+    def read_many_at(self, symbols: List[str], time: datetime) -> Dict[str, Dict]:
+        rows = {}
+        for symbol in symbols:
+            row = self.read_at(symbol, time)
+            if row is not None:
+                rows[symbol] = row
+        return rows
+
+    """
+    Latest stored row of symbol with timestamp < before, looking back at most max_weeks weekly partitions
+    """
+    def latest_before(self, symbol: str, before: datetime, max_weeks: int = 2) -> Optional[Dict]:
+        if not self.valid_symbol(symbol):
+            return None
+        before_s = self.to_seconds(before)
+        week = self.week_of(before_s)
+        for _ in range(max_weeks):
+            records = self.load(self.path(symbol, week))
+            if records is not None:
+                i = np.searchsorted(records["timestamp"], before_s, side="left") - 1
+                if i >= 0:
+                    return self.to_row(symbol, records[i])
+            week -= timedelta(days=7)
+        return None
+
+    """
+    Range read as a stock_prices shaped DataFrame (timestamp column of type pd.Timestamp), for backtests
+    """
+    def read_frame(self, symbol: str, start: datetime, end: datetime) -> pd.DataFrame:
+        records = self.read_range(symbol, start, end)
+        data = pd.DataFrame({name: records[name] for name in BAR_DTYPE.names})
+        data["timestamp"] = pd.to_datetime(data["timestamp"], unit="s", utc=True)
+        data.insert(0, "symbol", symbol)
+        return data
+
+bar_store = BarStore() if BAR_STORE_ENABLED else None
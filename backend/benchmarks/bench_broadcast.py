@@ -0,0 +1,78 @@
+"""
+Compares ConnectionManager's queued broadcast against the previous gather of send_json calls in a 200 user room
+where one socket takes 200ms per message and messages arrive 1ms apart. Run from backend/: python benchmarks/bench_broadcast.py
+"""
+from typing import Dict, List
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TIME_CHUNK_SIZE", "15")
+
+from websocket import ConnectionManager
+from fakes import FakeWebSocket
+
+ROOM = "league"
+USERS = 200
+MESSAGES = 50
+SLOW_DELAY = 0.2
+MESSAGE_GAP = 0.001 # time between messages arriving
+
+"""
+The broadcast ConnectionManager used before sockets had their own queues, kept here as the baseline
+"""
+async def gather_broadcast(sockets: List[FakeWebSocket], data: Dict):
+    await asyncio.gather(*[websocket.send_json(data) for websocket in sockets], return_exceptions=True)
+
+def make_room() -> List[FakeWebSocket]:
+    return [FakeWebSocket(SLOW_DELAY if i == 0 else 0) for i in range(USERS)]
+
+def message(i: int) -> Dict:
+    return {"type": "chat.message", "userId": "user-1", "text": f"message {i} " + "x" * 100, "ts": "2025-03-03T14:30:00+00:00"}
+
+def report(name: str, calls: List[float], sockets: List[FakeWebSocket], started: float):
+    fast_done = max(websocket.received[-1] for websocket in sockets[1:]) - started
+    print(f"{name:<10} broadcast call p50 {sorted(calls)[len(calls) // 2] * 1000:8.3f}ms  max {max(calls) * 1000:8.3f}ms  "
+          f"fast sockets done after {fast_done * 1000:8.1f}ms")
+
+async def main():
+    sockets = make_room()
+    calls = []
+    started = time.perf_counter()
+    for i in range(MESSAGES):
+        call_started = time.perf_counter()
+        await gather_broadcast(sockets, message(i))
+        calls.append(time.perf_counter() - call_started)
+        await asyncio.sleep(MESSAGE_GAP)
+    report("gather", calls, sockets, started)
+
+    for policy in ("drop_oldest", "disconnect"):
+        manager = ConnectionManager(queue_size=16, slow_consumer_policy=policy)
+        sockets = make_room()
+        manager.rooms[ROOM] = {f"user-{i}": websocket for i, websocket in enumerate(sockets)}
+        manager.room_users[ROOM] = list(manager.rooms[ROOM])
+        manager.room_info[ROOM] = {}
+        await manager.join_room(ROOM)
+        for user_id, websocket in manager.rooms[ROOM].items():
+            manager.attach(websocket, ROOM, user_id)
+
+        calls = []
+        started = time.perf_counter()
+        for i in range(MESSAGES):
+            call_started = time.perf_counter()
+            await manager.broadcast_json(ROOM, message(i))
+            calls.append(time.perf_counter() - call_started)
+            await asyncio.sleep(MESSAGE_GAP)
+        while any(len(websocket.received) < MESSAGES for websocket in sockets[1:]):
+            await asyncio.sleep(0.001)
+        report(policy, calls, sockets, started)
+        print(f"{'':<10} slow socket: {'connected' if 'user-0' in manager.rooms.get(ROOM, {}) else 'disconnected'}, "
+              f"received {len(sockets[0].received)} so far")
+
+        for user_id, websocket in list(manager.rooms.get(ROOM, {}).items()):
+            manager.detach(websocket, ROOM, user_id)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,128 @@
+"""
+Load test for the draft scheduler: runs thousands of concurrent snake drafts in one process with an in-memory store,
+where about half the turns are picked and the rest time out. Halfway through, the scheduler is stopped and a new one
+resumes every draft from the store, like a server restart.
+Run from backend/: python benchmarks/bench_draft_scheduler.py [num_drafts]
+"""
+from datetime import datetime, timezone as tz
+from typing import Any, Dict, List
+import asyncio
+import random
+import resource
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TIME_CHUNK_SIZE", "15")
+
+from draft_scheduler import Draft, DraftScheduler, DraftState, DraftStore
+
+MEMBERS = 10
+ROUNDS = 3
+TURN_TIMEOUT = 0.5
+
+"""
+DraftStore keeping records in a dict, counting writes
+"""
+class MemoryDraftStore(DraftStore):
+    def __init__(self):
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self.writes = 0
+        self.completed = 0
+
+    async def load_active(self) -> List[Dict[str, Any]]:
+        return [dict(record) for record in self.records.values() if record.get("draft_state") == DraftState.IN_PROGRESS.value]
+
+    async def save(self, records: List[Dict[str, Any]]):
+        self.writes += 1
+        for record in records:
+            self.records.setdefault(record["league_id"], {}).update(record)
+
+    async def claim(self, league_id: str, owner: str, lease_until: datetime) -> bool:
+        record = self.records.setdefault(league_id, {"league_id": league_id})
+        lease = record.get("lease_until")
+        if record.get("owner") not in (None, owner) and lease is not None and datetime.fromisoformat(lease) >= datetime.now(tz.utc):
+            return False
+        record.update({"owner": owner, "lease_until": lease_until.isoformat()})
+        return True
+
+    async def renew(self, league_ids: List[str], owner: str, lease_until: datetime) -> List[str]:
+        owned = [league_id for league_id in league_ids if self.records.get(league_id, {}).get("owner") == owner]
+        for league_id in owned:
+            self.records[league_id]["lease_until"] = lease_until.isoformat()
+        return owned
+
+    async def set_league_state(self, league_id: str, state: DraftState):
+        if state == DraftState.COMPLETED:
+            self.completed += 1
+
+"""
+DraftScheduler recording how late each timed out turn was handled
+"""
+class MeasuredScheduler(DraftScheduler):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_lag = 0.0
+
+    async def advance(self, draft: Draft):
+        if draft.deadline is not None:
+            self.max_lag = max(self.max_lag, datetime.now(tz.utc).timestamp() - draft.deadline.timestamp())
+        await super().advance(draft)
+
+async def pick_randomly(scheduler: DraftScheduler, stop: asyncio.Event):
+    while not stop.is_set():
+        for draft in list(scheduler.drafts.values()):
+            if random.random() < 0.05:
+                await scheduler.pick(draft.league_id, draft.current_user)
+        await asyncio.sleep(0.01)
+
+async def run_until(scheduler: DraftScheduler, store: MemoryDraftStore, num_drafts: int, done_fraction: float):
+    stop = asyncio.Event()
+    picker = asyncio.create_task(pick_randomly(scheduler, stop))
+    while store.completed < num_drafts * done_fraction:
+        await asyncio.sleep(0.05)
+    stop.set()
+    await picker
+
+async def main(num_drafts: int):
+    messages = 0
+
+    async def publish(league_id: str, data: Dict):
+        nonlocal messages
+        messages += 1
+
+    store = MemoryDraftStore()
+    scheduler = MeasuredScheduler(publish, store, flush_interval=0.2)
+    await scheduler.start()
+
+    started = time.perf_counter()
+    for i in range(num_drafts):
+        await scheduler.start_draft(f"league-{i}", [f"user-{j}" for j in range(MEMBERS)], ROUNDS, TURN_TIMEOUT)
+    start_seconds = time.perf_counter() - started
+
+    await run_until(scheduler, store, num_drafts, 0.5)
+    await scheduler.stop()
+    lag = scheduler.max_lag
+
+    restarted = time.perf_counter()
+    scheduler = MeasuredScheduler(publish, store, flush_interval=0.2)
+    await scheduler.start()
+    resumed = len(scheduler.drafts)
+    resume_seconds = time.perf_counter() - restarted
+
+    await run_until(scheduler, store, num_drafts, 1)
+    await scheduler.stop()
+    total_seconds = time.perf_counter() - started
+
+    print(f"drafts:              {num_drafts} x {MEMBERS} members x {ROUNDS} rounds, {TURN_TIMEOUT}s turns")
+    print(f"start all drafts:    {start_seconds:.3f}s")
+    print(f"resumed on restart:  {resumed} drafts in {resume_seconds:.3f}s")
+    print(f"completed:           {store.completed} in {total_seconds:.2f}s")
+    print(f"messages published:  {messages} ({messages / total_seconds:,.0f}/s)")
+    print(f"store writes:        {store.writes}")
+    print(f"max timeout lag:     {max(lag, scheduler.max_lag) * 1000:.1f}ms")
+    print(f"peak memory:         {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f}MB")
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
@@ -0,0 +1,97 @@
+"""
+Simulates several workers in one process, each with its own chat manager and draft scheduler, connected through the
+LocalBroker stand-in. League members are spread over the workers. Checks that chat broadcasts, presence and draft turns
+reach every worker, that picks are forwarded to the draft's owner and that another worker adopts a draft when its owner stops.
+Run from backend/: python benchmarks/bench_multiworker.py [workers] [leagues]
+"""
+from typing import Dict, List
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TIME_CHUNK_SIZE", "15")
+
+from pubsub import BrokerPubSub, LocalBroker
+from websocket import UserContextConnectionManager
+from draft_scheduler import DraftScheduler
+from bench_draft_scheduler import MemoryDraftStore
+from fakes import FakeClientSocket
+
+MEMBERS = 12
+MESSAGES = 20
+
+"""
+Chat/draft manager whose league members are generated instead of loaded from the database
+"""
+class LocalManager(UserContextConnectionManager):
+    async def load_league_users(self, league_id: str) -> List[str]:
+        return [f"user-{i}" for i in range(MEMBERS)]
+
+class Worker:
+    def __init__(self, broker: LocalBroker, store: MemoryDraftStore, index: int):
+        self.pubsub = BrokerPubSub(broker.connect(), origin=f"worker-{index}")
+        self.chat = LocalManager("chat", self.pubsub)
+        self.draft = LocalManager("draft", self.pubsub)
+        self.scheduler = DraftScheduler(self.draft.broadcast_json, store, self.pubsub, flush_interval=0.1, lease_seconds=3)
+
+async def wait_for(condition, timeout: float = 5):
+    started = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - started > timeout:
+            raise TimeoutError("condition not reached")
+        await asyncio.sleep(0.001)
+
+async def main(num_workers: int, num_leagues: int):
+    broker = LocalBroker()
+    store = MemoryDraftStore()
+    workers = [Worker(broker, store, i) for i in range(num_workers)]
+    for worker in workers:
+        await worker.scheduler.start()
+
+    # Every member connects to chat and draft on a worker picked round robin
+    sockets: Dict[str, Dict[str, FakeClientSocket]] = {"chat": {}, "draft": {}}
+    started = time.perf_counter()
+    for league in range(num_leagues):
+        for member in range(MEMBERS):
+            worker = workers[member % num_workers]
+            for kind, manager in (("chat", worker.chat), ("draft", worker.draft)):
+                websocket = sockets[kind][f"{league}/{member}"] = FakeClientSocket()
+                await manager.connect(websocket, f"league-{league}", f"user-{member}")
+    print(f"connected {num_leagues * MEMBERS * 2} sockets over {num_workers} workers in {time.perf_counter() - started:.2f}s")
+
+    _, active, _ = await workers[-1].chat.get_room_info("league-0")
+    print(f"active users seen by the last worker: {len(active)} of {MEMBERS}")
+
+    started = time.perf_counter()
+    for league in range(num_leagues):
+        for i in range(MESSAGES):
+            await workers[0].chat.broadcast_json(f"league-{league}", {"type": "chat.message", "userId": "user-0", "text": f"hi {i}", "ts": "now"})
+    await wait_for(lambda: all(sum('"chat.message"' in text for text in ws.texts) == MESSAGES for ws in sockets["chat"].values()))
+    delivered = num_leagues * MEMBERS * MESSAGES
+    print(f"chat: {delivered} deliveries to sockets on every worker in {time.perf_counter() - started:.2f}s")
+
+    await workers[0].scheduler.start_draft("league-0", [f"user-{i}" for i in range(MEMBERS)], 2, 30)
+    await wait_for(lambda: all("league-0" in worker.scheduler.mirrors for worker in workers[1:]))
+    print(f"draft: started on worker-0, starting it again on worker-1 returns {await workers[1].scheduler.start_draft('league-0', ['user-0'])}")
+
+    # user-1 is connected to worker-1, which forwards the pick to worker-0
+    await workers[0].scheduler.pick("league-0", "user-0")
+    await workers[1].scheduler.pick("league-0", "user-1")
+    await wait_for(lambda: workers[0].scheduler.drafts["league-0"].pick_index == 2)
+    await wait_for(lambda: all(sum('"draft.turnStart"' in text for text in ws.texts) == 3 for key, ws in sockets["draft"].items() if key.startswith("0/")))
+    print("draft: pick forwarded to the owner, every socket of the league saw all 3 turn starts")
+
+    await workers[0].scheduler.stop()
+    adopted = time.perf_counter()
+    await wait_for(lambda: any("league-0" in worker.scheduler.drafts for worker in workers[1:]), timeout=10)
+    owner = next(worker for worker in workers[1:] if "league-0" in worker.scheduler.drafts)
+    print(f"draft: {owner.pubsub.origin} adopted the draft {time.perf_counter() - adopted:.2f}s after worker-0 stopped, "
+          f"at pick {owner.scheduler.drafts['league-0'].pick_index}")
+
+    for worker in workers[1:]:
+        await worker.scheduler.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 4, int(sys.argv[2]) if len(sys.argv) > 2 else 50))
@@ -0,0 +1,79 @@
+"""
+Reconnect storm after a network blip: every member of a 200 user room drops and reconnects within 50ms. Counts the
+presence frames the room's sockets receive with debounced presence against the previous immediate join/leave broadcasts.
+Run from backend/: python benchmarks/bench_presence.py [users]
+"""
+from typing import List
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TIME_CHUNK_SIZE", "15")
+
+from websocket import UserContextConnectionManager
+from time_utils import get_now_iso
+from fakes import FakeClientSocket
+
+ROOM = "league"
+STORM = 0.05 # seconds over which the reconnects are spread
+
+class LocalManager(UserContextConnectionManager):
+    def __init__(self, users: int, **kwargs):
+        super().__init__(**kwargs)
+        self.users = users
+
+    async def load_league_users(self, league_id: str) -> List[str]:
+        return [f"user-{i}" for i in range(self.users)]
+
+"""
+The presence broadcasts UserContextConnectionManager made before they were debounced, kept here as the baseline
+"""
+class ImmediateManager(LocalManager):
+    async def connect(self, websocket, league_id: str, user_id: str):
+        await super().connect(websocket, league_id, user_id)
+        await self.broadcast_json(league_id, {"type": "presence.join", "userId": user_id, "ts": get_now_iso()})
+
+    async def disconnect(self, league_id: str, user_id: str) -> bool:
+        removed = await super().disconnect(league_id, user_id)
+        await self.broadcast_json(league_id, {"type": "presence.leave", "userId": user_id, "ts": get_now_iso()})
+        return removed
+
+def presence_frames(sockets: List[FakeClientSocket]) -> int:
+    return sum(json.loads(text)["type"].startswith("presence.") for websocket in sockets for text in websocket.texts)
+
+async def reconnect(manager: LocalManager, sockets: List[FakeClientSocket], i: int):
+    await asyncio.sleep(random.random() * STORM)
+    await manager.disconnect(ROOM, f"user-{i}")
+    await asyncio.sleep(random.random() * STORM)
+    sockets[i] = FakeClientSocket()
+    await manager.connect(sockets[i], ROOM, f"user-{i}")
+
+async def run(name: str, manager: LocalManager, users: int):
+    sockets = [FakeClientSocket() for _ in range(users)]
+    for i, websocket in enumerate(sockets):
+        await manager.connect(websocket, ROOM, f"user-{i}")
+    await asyncio.sleep(0.5) # lets the joins of the initial connections settle before counting
+
+    before = list(sockets)
+    for websocket in before:
+        websocket.texts.clear()
+    started = time.perf_counter()
+    await asyncio.gather(*[reconnect(manager, sockets, i) for i in range(users)])
+    await asyncio.sleep(0.5)
+    storm_seconds = time.perf_counter() - started
+
+    frames = presence_frames(before) + presence_frames([websocket for websocket in sockets if websocket not in before])
+    print(f"{name:<12} presence frames delivered during the storm: {frames:>7,}  ({storm_seconds:.2f}s)")
+
+async def main(users: int):
+    await run("immediate", ImmediateManager(users, namespace="immediate", presence_window=3600), users)
+    manager = LocalManager(users, namespace="debounced")
+    await run("debounced", manager, users)
+    print(f"debouncer:   {manager.presence.stats()}")
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
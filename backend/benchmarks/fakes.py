@@ -0,0 +1,364 @@
+"""
+In-memory stand-ins for the services the backend talks to, so benchmarks run offline: FakeSupabase implements the part
+of the supabase table API the backend uses, FakeAlpaca replays recorded minute bars, and install() points stocks.py at both. FakeWebSocket and FakeClientSocket
+stand in for connected browsers.
+Every round trip can be given a simulated latency and is counted, so a change that adds queries shows up in the results
+"""
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TIME_CHUNK_SIZE", "15")
+os.environ.setdefault("BAR_STORE_ENABLED", "false")
+
+import pandas as pd
+
+from database import ClientPool
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "alpaca_bars.csv.gz")
+TIME_COLUMNS = {"timestamp", "created_date", "ts", "lease_until"}
+
+@lru_cache(maxsize=100000)
+def parse_time(value: str) -> pd.Timestamp:
+    return pd.Timestamp(value)
+
+"""
+Makes stored and queried values comparable: time columns compare as timestamps whether they are strings or datetimes
+"""
+def normalize(column: str, value: Any) -> Any:
+    if column in TIME_COLUMNS and value is not None:
+        return parse_time(value) if isinstance(value, str) else pd.Timestamp(value)
+    return value
+
+class FakeResponse:
+    def __init__(self, data: List[Dict[str, Any]]):
+        self.data = data
+
+"""
+One table query, built with the same chained calls as postgrest's request builders
+"""
+class FakeQuery:
+    def __init__(self, database: "FakeSupabase", table: str):
+        self.database = database
+        self.table = table
+        self.filters: List[Callable[[Dict[str, Any]], bool]] = []
+        self.operation = "select"
+        self.columns: Optional[tuple] = None
+        self.payload: Any = None
+        self.conflict: List[str] = []
+        self.ignore_duplicates = False
+        self.orders: List[tuple] = []
+        self.limit_count: Optional[int] = None
+        self.offsets: Optional[tuple] = None
+
+    def filter(self, column: str, test: Callable[[Any, Any], bool], value: Any) -> "FakeQuery":
+        value = normalize(column, value)
+        self.filters.append(lambda row: test(normalize(column, row.get(column)), value))
+        return self
+
+    def select(self, *columns: str) -> "FakeQuery":
+        self.columns = columns
+        return self
+
+    def eq(self, column: str, value: Any) -> "FakeQuery":
+        return self.filter(column, lambda a, b: a == b, value)
+
+    def neq(self, column: str, value: Any) -> "FakeQuery":
+        return self.filter(column, lambda a, b: a != b, value)
+
+    def gt(self, column: str, value: Any) -> "FakeQuery":
+        return self.filter(column, lambda a, b: a is not None and a > b, value)
+
+    def gte(self, column: str, value: Any) -> "FakeQuery":
+        return self.filter(column, lambda a, b: a is not None and a >= b, value)
+
+    def lt(self, column: str, value: Any) -> "FakeQuery":
+        return self.filter(column, lambda a, b: a is not None and a < b, value)
+
+    def lte(self, column: str, value: Any) -> "FakeQuery":
+        return self.filter(column, lambda a, b: a is not None and a <= b, value)
+
+    """
+    Supports the null tests postgrest accepts: is_(column, None / "null") and is_(column, "not.null")
+    """
+    def is_(self, column: str, value: Any) -> "FakeQuery":
+        if value is None or value == "null":
+            self.filters.append(lambda row: row.get(column) is None)
+        elif value == "not.null":
+            self.filters.append(lambda row: row.get(column) is not None)
+        else:
+            raise ValueError(f"FakeQuery.is_ does not support the value {value!r}.")
+        return self
+
+    def in_(self, column: str, values: List[Any]) -> "FakeQuery":
+        allowed = {normalize(column, value) for value in values}
+        self.filters.append(lambda row: normalize(column, row.get(column)) in allowed)
+        return self
+
+    def order(self, column: str, desc: bool = False) -> "FakeQuery":
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, count: int) -> "FakeQuery":
+        self.limit_count = count
+        return self
+
+    def range(self, start: int, end: int) -> "FakeQuery":
+        self.offsets = (start, end)
+        return self
+
+    def insert(self, rows: Any) -> "FakeQuery":
+        self.operation, self.payload = "insert", rows if isinstance(rows, list) else [rows]
+        return self
+
+    def upsert(self, rows: Any, on_conflict: str = "id", ignore_duplicates: bool = False, **kwargs) -> "FakeQuery":
+        self.operation, self.payload = "upsert", rows if isinstance(rows, list) else [rows]
+        self.conflict = [column.strip() for column in on_conflict.split(",")]
+        self.ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, values: Dict[str, Any]) -> "FakeQuery":
+        self.operation, self.payload = "update", values
+        return self
+
+    def delete(self) -> "FakeQuery":
+        self.operation = "delete"
+        return self
+
+    def run(self) -> FakeResponse:
+        self.database.queries += 1
+        rows = self.database.tables.setdefault(self.table, [])
+
+        if self.operation == "insert":
+            rows.extend(dict(row) for row in self.payload)
+            return FakeResponse(self.payload)
+
+        if self.operation == "upsert":
+            key = lambda row: tuple(normalize(column, row.get(column)) for column in self.conflict)
+            stored = {key(row): row for row in rows}
+            for row in self.payload:
+                existing = stored.get(key(row))
+                if existing is None:
+                    stored[key(row)] = dict(row)
+                    rows.append(stored[key(row)])
+                elif not self.ignore_duplicates:
+                    existing.update(row)
+            return FakeResponse(self.payload)
+
+        matched = [row for row in rows if all(test(row) for test in self.filters)]
+        if self.operation == "update":
+            for row in matched:
+                row.update(self.payload)
+            return FakeResponse(matched)
+
+        if self.operation == "delete":
+            removed = {id(row) for row in matched}
+            self.database.tables[self.table] = [row for row in rows if id(row) not in removed]
+            return FakeResponse(matched)
+
+        for column, desc in reversed(self.orders):
+            matched.sort(key=lambda row: normalize(column, row.get(column)), reverse=desc)
+        if self.offsets is not None:
+            matched = matched[self.offsets[0]:self.offsets[1] + 1]
+        if self.limit_count is not None:
+            matched = matched[:self.limit_count]
+        if self.columns and self.columns != ("*",):
+            return FakeResponse([{column: row.get(column) for column in self.columns} for row in matched])
+        return FakeResponse([dict(row) for row in matched])
+
+    def execute(self) -> FakeResponse:
+        if self.database.latency:
+            time.sleep(self.database.latency)
+        return self.run()
+
+class FakeAsyncQuery(FakeQuery):
+    async def execute(self) -> FakeResponse:
+        if self.database.latency:
+            await asyncio.sleep(self.database.latency)
+        return self.run()
+
+def set_start_of_week_totals(database: "FakeSupabase", params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    totals = {row["league_member_id"]: row["start_of_week_total"] for row in params["p_totals"]}
+    for row in database.tables.get("portfolios", []):
+        if row["league_member_id"] in totals:
+            row["start_of_week_total"] = totals[row["league_member_id"]]
+    return []
+
+def latest_stock_prices(database: "FakeSupabase", params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    after, before = normalize("timestamp", params["p_after"]), normalize("timestamp", params["p_before"])
+    latest: Dict[str, Dict[str, Any]] = {}
+    for row in database.tables.get("stock_prices", []):
+        if row["symbol"] in params["p_symbols"] and after <= normalize("timestamp", row["timestamp"]) <= before:
+            current = latest.get(row["symbol"])
+            if current is None or normalize("timestamp", row["timestamp"]) > normalize("timestamp", current["timestamp"]):
+                latest[row["symbol"]] = row
+    return [dict(row) for row in latest.values()]
+
+"""
+The database functions of supabase/migrations the backend calls, as {name -> function(database, params) -> rows}
+"""
+FUNCTIONS: Dict[str, Callable[["FakeSupabase", Dict[str, Any]], List[Dict[str, Any]]]] = {
+    "set_start_of_week_totals": set_start_of_week_totals,
+    "latest_stock_prices": latest_stock_prices,
+}
+
+class FakeRpc:
+    def __init__(self, database: "FakeSupabase", name: str, params: Dict[str, Any]):
+        if name not in FUNCTIONS:
+            raise ValueError(f"FakeSupabase has no function {name!r}")
+        self.database = database
+        self.name = name
+        self.params = params
+
+    def run(self) -> FakeResponse:
+        self.database.queries += 1
+        return FakeResponse(FUNCTIONS[self.name](self.database, self.params))
+
+    def execute(self) -> FakeResponse:
+        if self.database.latency:
+            time.sleep(self.database.latency)
+        return self.run()
+
+class FakeAsyncRpc(FakeRpc):
+    async def execute(self) -> FakeResponse:
+        if self.database.latency:
+            await asyncio.sleep(self.database.latency)
+        return self.run()
+
+"""
+Tables of row dicts behind a supabase-like client. latency is added to every query, queries counts them
+"""
+class FakeSupabase:
+    def __init__(self, tables: Optional[Dict[str, List[Dict[str, Any]]]] = None, latency: float = 0):
+        self.tables = tables if tables is not None else {}
+        self.latency = latency
+        self.queries = 0
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, name: str, params: Dict[str, Any]) -> FakeRpc:
+        return FakeRpc(self, name, params)
+
+"""
+Async client over the same tables as a FakeSupabase
+"""
+class FakeAsyncSupabase:
+    def __init__(self, database: FakeSupabase):
+        self.database = database
+
+    def table(self, name: str) -> FakeAsyncQuery:
+        return FakeAsyncQuery(self.database, name)
+
+    def rpc(self, name: str, params: Dict[str, Any]) -> FakeAsyncRpc:
+        return FakeAsyncRpc(self.database, name, params)
+
+class FakeAsyncPool:
+    def __init__(self, database: FakeSupabase):
+        self.client = FakeAsyncSupabase(database)
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.client
+
+    async def close(self):
+        pass
+
+    def stats(self) -> Dict[str, float]:
+        return {}
+
+"""
+What StockHistoricalDataClient.get_stock_bars returns: bars indexed by (symbol, timestamp) and the symbols that had any
+"""
+class FakeBarSet:
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.data = {symbol: [] for symbol in df.index.get_level_values("symbol").unique()}
+
+"""
+Answers bar requests from recorded minute bars, counting requests
+"""
+class FakeAlpaca:
+    def __init__(self, bars: pd.DataFrame, latency: float = 0):
+        self.bars = bars.sort_index()
+        self.symbols = set(self.bars.index.get_level_values("symbol"))
+        self.latency = latency
+        self.requests = 0
+
+    def get_stock_bars(self, request) -> FakeBarSet:
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        symbols = request.symbol_or_symbols if isinstance(request.symbol_or_symbols, list) else [request.symbol_or_symbols]
+        start, end = pd.Timestamp(request.start), pd.Timestamp(request.end)
+        if start.tzinfo is None:
+            start, end = start.tz_localize("UTC"), end.tz_localize("UTC")
+
+        present = [symbol for symbol in symbols if symbol in self.symbols]
+        if not present:
+            return FakeBarSet(self.bars.iloc[:0])
+        bars = self.bars.loc[present]
+        timestamps = bars.index.get_level_values("timestamp")
+        return FakeBarSet(bars[(timestamps >= start) & (timestamps <= end)])
+
+"""
+Recorded minute bars indexed by (symbol, timestamp) like Alpaca's bars.df
+"""
+def load_fixture_bars(path: str = FIXTURE) -> pd.DataFrame:
+    bars = pd.read_csv(path)
+    bars["timestamp"] = pd.to_datetime(bars["timestamp"], utc=True)
+    return bars.set_index(["symbol", "timestamp"])
+
+"""
+Points stocks.py at the fakes and clears its in-process state
+"""
+def install(database: FakeSupabase, alpaca: FakeAlpaca):
+    import stocks
+    from price_cache import price_cache
+
+    stocks.client_pool = ClientPool(factory=lambda: database, size=1)
+    stocks.async_client_pool = FakeAsyncPool(database)
+    stocks._alpaca_client = alpaca
+    stocks.bar_store = None
+    stocks._high_water.clear()
+    price_cache.clear()
+
+"""
+Records when each message arrives. delay is how long every send takes
+"""
+class FakeWebSocket:
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.received: List[float] = []
+
+    async def send_text(self, text: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.received.append(time.perf_counter())
+
+    async def send_json(self, data: Dict):
+        await self.send_text(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+    async def close(self, code: int = 1000):
+        pass
+
+"""
+FakeWebSocket that can be accepted and keeps the text of every frame it was sent
+"""
+class FakeClientSocket(FakeWebSocket):
+    def __init__(self):
+        super().__init__()
+        self.texts: List[str] = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.texts.append(text)
+        await super().send_text(text)
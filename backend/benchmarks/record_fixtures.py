@@ -0,0 +1,59 @@
+"""
+Writes the minute bars the benchmark suite replays to benchmarks/fixtures/alpaca_bars.csv.gz.
+By default they are requested from Alpaca (needs ALPACA_API_KEY and ALPACA_API_SECRET) for the fixture tickers over two
+trading weeks. --synthetic writes the same shape from a seeded random walk instead, with about a fifth of minutes missing
+like thinly traded IEX symbols, for machines without Alpaca access.
+Run from backend/: python benchmarks/record_fixtures.py [--synthetic]
+"""
+from datetime import datetime, timezone as tz
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TIME_CHUNK_SIZE", "15")
+
+import numpy as np
+import pandas as pd
+
+from market_calendar import market_calendar
+from fakes import FIXTURE
+
+TICKERS = ["AAPL", "MSFT", "NVDA", "AMZN", "GOOGL", "META", "TSLA", "JPM"]
+START = datetime(2025, 3, 3, 14, 0, tzinfo=tz.utc)
+END = datetime(2025, 3, 14, 20, 0, tzinfo=tz.utc)
+
+def record() -> pd.DataFrame:
+    from stocks import request_bars
+    return request_bars(TICKERS, START, END).df.reset_index()
+
+def synthesize(seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    minutes = pd.date_range(START, END, freq="1min")
+    minutes = minutes[[market_calendar.is_open(minute) for minute in minutes]]
+
+    frames = []
+    for i, ticker in enumerate(TICKERS):
+        ts = minutes[rng.random(len(minutes)) < 0.8]
+        close = np.round(100 * (i + 1) * np.exp(rng.normal(0, 0.0005, len(ts)).cumsum()), 2)
+        spread = np.round(np.abs(rng.normal(0, 0.02, len(ts))) * (i + 1), 2)
+        frames.append(pd.DataFrame({
+            "symbol": ticker, "timestamp": ts,
+            "open": close, "high": np.round(close + spread, 2), "low": np.round(close - spread, 2), "close": close,
+            "volume": rng.integers(100, 5000, len(ts)), "trade_count": rng.integers(1, 60, len(ts)),
+            "vwap": np.round(close + spread / 3, 4),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the minute bar fixture of the benchmark suite")
+    parser.add_argument("--synthetic", action="store_true", help="generate the bars instead of requesting them from Alpaca")
+    args = parser.parse_args()
+
+    bars = synthesize() if args.synthetic else record()
+    os.makedirs(os.path.dirname(FIXTURE), exist_ok=True)
+    bars.to_csv(FIXTURE, index=False, compression="gzip")
+    print(f"wrote {len(bars)} bars of {bars['symbol'].nunique()} tickers to {FIXTURE}")
+
+if __name__ == "__main__":
+    main()
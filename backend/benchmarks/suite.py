@@ -0,0 +1,256 @@
+"""
+Offline benchmark suite for the backend hot paths: price lookups (cache hit, database hit, Alpaca miss), forward fill at
+several window sizes, weekly scoring of 10/100/1000 member leagues and websocket broadcast to many sockets.
+Supabase and Alpaca are replaced by the in-memory fakes of benchmarks/fakes.py replaying benchmarks/fixtures/alpaca_bars.csv.gz.
+Every case reports its median time and the database queries and Alpaca requests it made. --json writes the results,
+--compare checks them against a saved run and exits with 1 if a case got slower by more than --threshold or made more requests.
+Run from backend/: python benchmarks/suite.py [--only price] [--json results.json] [--compare baseline.json]
+"""
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone as tz
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TIME_CHUNK_SIZE", "15")
+
+from fakes import FakeAlpaca, FakeClientSocket, FakeSupabase, install, load_fixture_bars
+
+import numpy as np
+import pandas as pd
+
+import stocks
+from price_cache import price_cache
+from pubsub import InMemoryPubSub
+from time_utils import process_time
+from websocket import ConnectionManager
+
+USE_TIME = datetime(2025, 3, 14, 19, 0, tzinfo=tz.utc)
+FILL_WINDOWS = {"1h": timedelta(hours=1), "1d": timedelta(days=1), "1w": timedelta(days=7), "11d": timedelta(days=11)} # 11d is the whole fixture
+LEAGUE_SIZES = [10, 100, 1000]
+SOCKET_COUNTS = [100, 1000]
+BROADCAST_MESSAGES = 20
+
+"""
+Runs func repeat times after a warm up run. setup runs before each run, outside the timing, and warmed_up once after
+the warm up run. Returns the median and best seconds of one run
+"""
+def measure(func: Callable[[], Any], repeat: int, setup: Callable[[], Any] = lambda: None, warmed_up: Callable[[], Any] = lambda: None) -> Dict[str, float]:
+    setup()
+    func()
+    warmed_up()
+    timings = []
+    for _ in range(repeat):
+        setup()
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return {"seconds": statistics.median(timings), "best_seconds": min(timings)}
+
+class Suite:
+    def __init__(self, repeat: int, latency: float):
+        self.repeat = repeat
+        self.latency = latency
+        self.bars = load_fixture_bars()
+        self.tickers = sorted(self.bars.index.get_level_values("symbol").unique())
+        self.results: List[Dict[str, Any]] = []
+
+    def record(self, name: str, params: Dict[str, Any], timing: Dict[str, float], database: Optional[FakeSupabase] = None,
+               alpaca: Optional[FakeAlpaca] = None, runs: int = 0):
+        result = {"name": name, "params": params, **timing}
+        if runs:
+            if database is not None:
+                result["queries"] = database.queries / runs
+            if alpaca is not None:
+                result["alpaca_requests"] = alpaca.requests / runs
+        self.results.append(result)
+        counts = "".join(f"  {key} {result[key]:g}" for key in ("queries", "alpaca_requests") if key in result)
+        print(f"{name:<28} {json.dumps(params):<24} {result['seconds'] * 1000:10.3f}ms{counts}")
+
+    def reset_counts(self, database: FakeSupabase, alpaca: Optional[FakeAlpaca] = None):
+        database.queries = 0
+        if alpaca is not None:
+            alpaca.requests = 0
+
+    def fakes(self) -> tuple:
+        database = FakeSupabase(latency=self.latency)
+        alpaca = FakeAlpaca(self.bars, latency=self.latency)
+        install(database, alpaca)
+        return database, alpaca
+
+    def price_lookup(self):
+        database, alpaca = self.fakes()
+
+        def miss_setup():
+            database.tables.clear()
+            price_cache.clear()
+            stocks._high_water.clear()
+        reset = lambda: self.reset_counts(database, alpaca)
+        timing = measure(lambda: stocks.fetch_prices(self.tickers, USE_TIME), self.repeat, miss_setup, reset)
+        self.record("price_lookup.miss", {"tickers": len(self.tickers)}, timing, database, alpaca, self.repeat)
+
+        timing = measure(lambda: stocks.fetch_prices(self.tickers, USE_TIME), self.repeat, price_cache.clear, reset)
+        self.record("price_lookup.database", {"tickers": len(self.tickers)}, timing, database, alpaca, self.repeat)
+
+        calls = 1000
+        def hits():
+            for _ in range(calls):
+                stocks.fetch_prices(self.tickers, USE_TIME)
+        timing = measure(hits, self.repeat, warmed_up=reset)
+        self.record("price_lookup.hit", {"tickers": len(self.tickers), "calls": calls}, timing, database, alpaca, self.repeat)
+
+    def fill_forward(self):
+        end = process_time(USE_TIME)
+        for label, window in FILL_WINDOWS.items():
+            start = end - window
+            timestamps = self.bars.index.get_level_values("timestamp")
+            bars = self.bars[(timestamps >= start - timedelta(minutes=30)) & (timestamps <= end)]
+            starts = {ticker: start for ticker in self.tickers}
+            timing = measure(lambda: stocks.fill_forward_many(bars, starts, end), self.repeat)
+            self.record("fill_forward", {"window": label, "bars": len(bars)}, timing)
+
+    """
+    A league of size members paired into matchups, each member holding half of the fixture tickers, with the week end
+    prices already stored in the database
+    """
+    def league_tables(self, size: int) -> tuple:
+        from MatchupCalc import get_current_week
+        rng = np.random.default_rng(size)
+        created = (datetime.today() + timedelta(hours=1)).replace(microsecond=0) # get_current_week looks for matchups created after now
+        members = [f"member-{i}" for i in range(size)]
+        matchups = [
+            {"id": i, "league_id": "league", "week": 1, "created_date": created.isoformat(),
+             "user1_id": members[2 * i], "user2_id": members[2 * i + 1], "winner_id": None, "u1_score": None, "u2_score": None}
+            for i in range(size // 2)
+        ]
+        tables = {
+            "matchups": [dict(matchup) for matchup in matchups],
+            "portfolios": [{"league_member_id": member, "current_balance": float(rng.uniform(0, 1000)), "start_of_week_total": 10000.0} for member in members],
+            "holdings": [
+                {"league_member_id": member, "ticker": ticker, "stock_amount": float(rng.uniform(1, 20))}
+                for member in members for ticker in rng.choice(self.tickers, len(self.tickers) // 2, replace=False)
+            ],
+        }
+
+        with redirect_stdout(io.StringIO()):
+            week = get_current_week(FakeSupabase(tables))
+        week_end = process_time(created + timedelta(days=7 * week))
+        last = self.bars.groupby(level="symbol").tail(1).reset_index()
+        last["timestamp"] = week_end.isoformat()
+        tables["stock_prices"] = last.to_dict(orient="records")
+        return tables, matchups
+
+    def weekly_scoring(self):
+        from MatchupCalc import weekly_score_calc
+        for size in LEAGUE_SIZES:
+            tables, matchups = self.league_tables(size)
+            database = FakeSupabase(tables, latency=self.latency)
+            install(database, FakeAlpaca(self.bars, latency=self.latency))
+
+            def score():
+                with redirect_stdout(io.StringIO()):
+                    weekly_score_calc(database, [dict(matchup) for matchup in matchups])
+            timing = measure(score, self.repeat, price_cache.clear, lambda: self.reset_counts(database))
+            self.record("weekly_scoring", {"members": size}, timing, database, None, self.repeat)
+
+    async def broadcast_once(self, sockets: int) -> float:
+        manager = ConnectionManager("bench", InMemoryPubSub(), queue_size=BROADCAST_MESSAGES * 2)
+        room = "league"
+        clients = [FakeClientSocket() for _ in range(sockets)]
+        manager.rooms[room] = {f"user-{i}": websocket for i, websocket in enumerate(clients)}
+        manager.room_users[room] = list(manager.rooms[room])
+        manager.room_info[room] = {}
+        await manager.join_room(room)
+        for user_id, websocket in manager.rooms[room].items():
+            manager.attach(websocket, room, user_id)
+
+        started = time.perf_counter()
+        for i in range(BROADCAST_MESSAGES):
+            await manager.broadcast_json(room, {"type": "chat.message", "userId": "user-0", "text": f"message {i}", "ts": "2025-03-03T14:30:00+00:00"})
+        while any(len(websocket.texts) < BROADCAST_MESSAGES for websocket in clients):
+            await asyncio.sleep(0)
+        elapsed = time.perf_counter() - started
+
+        for outbox in list(manager.outboxes.values()):
+            outbox.close()
+        return elapsed
+
+    def broadcast(self):
+        for sockets in SOCKET_COUNTS:
+            timings = [asyncio.run(self.broadcast_once(sockets)) for _ in range(self.repeat + 1)][1:] # the first run warms up
+            timing = {"seconds": statistics.median(timings), "best_seconds": timings[0]}
+            self.record("broadcast", {"sockets": sockets, "messages": BROADCAST_MESSAGES}, timing)
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def result_key(result: Dict[str, Any]) -> str:
+    return f"{result['name']} {json.dumps(result['params'], sort_keys=True)}"
+
+"""
+Prints how every case compares with the baseline run. Returns the cases that regressed
+"""
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    previous = {result_key(result): result for result in baseline["results"]}
+    regressions = []
+    print(f"\ncompared with {baseline.get('commit') or 'baseline'}:")
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        ratio = result["seconds"] / old["seconds"] if old["seconds"] else 1.0
+        more_requests = [key for key in ("queries", "alpaca_requests") if result.get(key, 0) > old.get(key, 0)]
+        regressed = ratio > 1 + threshold or more_requests
+        if regressed:
+            regressions.append(result_key(result))
+        print(f"{result_key(result):<52} {ratio:6.2f}x{'  more ' + ', '.join(more_requests) if more_requests else ''}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the backend hot paths")
+    parser.add_argument("--only", action="append", help="run only the cases starting with this name, can be repeated")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=0, help="simulated round trip of every database query and Alpaca request")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results file of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25, help="slowdown ratio above 1 reported as a regression")
+    args = parser.parse_args()
+
+    suite = Suite(args.repeat, args.latency_ms / 1000)
+    for name in ("price_lookup", "fill_forward", "weekly_scoring", "broadcast"):
+        if not args.only or any(name.startswith(only) or only.startswith(name) for only in args.only):
+            getattr(suite, name)()
+
+    report = {
+        "commit": git_commit(),
+        "created": datetime.now(tz.utc).isoformat(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "repeat": args.repeat,
+        "latency_ms": args.latency_ms,
+        "results": suite.results,
+    }
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(suite.results, json.load(file), args.threshold)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
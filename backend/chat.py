@@ -1,28 +1,73 @@
 from fastapi import FastAPI, APIRouter, WebSocket, WebSocketDisconnect
 import asyncio
-from typing import List, Set, Dict
+import logging
+from typing import Any, List, Set, Dict
 
-from websocket import ConnectionManager, UserContextConnectionManager
+from websocket import ConnectionManager, UserContextConnectionManager, encode_json
+from chat_history import chat_history
+from live_scores import LiveScores
 from time_utils import get_now_iso
 
 router = APIRouter(prefix="/chat", tags=["chat"])
-manager = UserContextConnectionManager()
+
+logger = logging.getLogger(__name__)
+
+"""
+Chat rooms that keep each league's recent messages in chat_history. Every worker holding sockets of a league records
+the league's messages as they are delivered, and only the worker a message was sent to writes it to the database
+"""
+class ChatConnectionManager(UserContextConnectionManager):
+    async def send_chat(self, league_id: str, message: Dict[str, Any]):
+        chat_history.record(league_id, message, persist=True)
+        await self.pubsub.publish(self.topic(league_id), {"kind": "broadcast", "text": encode_json(message), "chat": message, "origin": self.pubsub.origin})
+
+    async def on_message(self, room: str, message: Dict[str, Any]):
+        if "chat" in message and message.get("origin") != self.pubsub.origin:
+            chat_history.record(room, message["chat"])
+        await super().on_message(room, message)
+
+    async def after_state(self, websocket: WebSocket, league_id: str):
+        try:
+            await self.send_json(websocket, {"type": "chat.history", "messages": await chat_history.recent(league_id)})
+        except Exception:
+            logger.exception("Could not send the chat history of %s", league_id)
+        try:
+            scores = await live_scores.snapshot(league_id)
+            if scores is not None:
+                await self.send_json(websocket, scores)
+        except Exception:
+            logger.exception("Could not send the live scores of %s", league_id)
+
+    """
+    With several workers a league's ring misses the messages sent while this worker held none of its sockets
+    """
+    async def leave_room(self, room: str):
+        await super().leave_room(room)
+        if self.pubsub.shared:
+            chat_history.forget(room)
+
+manager = ChatConnectionManager("chat")
+live_scores = LiveScores(manager)
 
 """
 This websocket helps manage a chat window. It sends json information of the following types:  
 1. state - {'type', 'allUsers', 'activeUsers', 'ts'}
-2. presence.join - {'type', 'userId', 'ts'}
-3. presence.leave - {'type', 'userId', 'ts'}
-4. chat.message - {'type', 'userId', 'text', 'ts'}
+2. chat.history - {'type', 'messages'}, the league's recent chat.message frames oldest first, sent right after state
+3. presence.join - {'type', 'userId', 'ts'}
+4. presence.leave - {'type', 'userId', 'ts'}
+5. presence.batch - {'type', 'events', 'ts'}, several presence.join/presence.leave events collected within PRESENCE_DEBOUNCE seconds
+6. chat.message - {'type', 'userId', 'text', 'ts'}
+7. matchup.live - {'type', 'matchups', 'ts'}, live scores of the current week's matchups, after chat.history and whenever a price moves them
 """
 @router.websocket("/ws/{league_id}/{user_id}")
 async def chat_websocket(league_id: str, user_id: str, websocket: WebSocket):
     try: 
-        await manager.connect(websocket, league_id, user_id)
+        if not await manager.connect(websocket, league_id, user_id):
+            return
 
         while True: 
             msg = await websocket.receive_text()
-            await manager.broadcast_json(league_id, {
+            await manager.send_chat(league_id, {
                 "type": "chat.message", 
                 "userId": user_id, 
                 "text": msg, 
@@ -30,4 +75,8 @@ async def chat_websocket(league_id: str, user_id: str, websocket: WebSocket):
             })
 
     except WebSocketDisconnect: 
-        await manager.disconnect(league_id, user_id)
\ No newline at end of file
+        pass
+    finally:
+        # Whatever ended the socket, unless the user already reconnected with another one
+        if manager.rooms.get(league_id, {}).get(user_id) is websocket:
+            await manager.disconnect(league_id, user_id)
\ No newline at end of file
@@ -0,0 +1,213 @@
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from dotenv import load_dotenv
+import asyncio
+import logging
+import os
+
+from database import async_client_pool
+
+load_dotenv()
+
+CHAT_HISTORY_SIZE = int(os.getenv("CHAT_HISTORY_SIZE", "100")) # messages kept per league
+CHAT_HISTORY_LEAGUES = int(os.getenv("CHAT_HISTORY_LEAGUES", "1000")) # leagues kept in memory, least recently used are dropped
+CHAT_FLUSH_INTERVAL = float(os.getenv("CHAT_FLUSH_INTERVAL", "1")) # seconds between writes of new messages
+CHAT_FLUSH_BATCH = int(os.getenv("CHAT_FLUSH_BATCH", "500")) # new messages that trigger a write right away
+CHAT_MAX_PENDING = 10000 # unwritten messages kept while the database is unreachable
+
+logger = logging.getLogger(__name__)
+
+class ChatMessage:
+    __slots__ = ("user_id", "text", "ts")
+
+    def __init__(self, user_id: str, text: str, ts: str):
+        self.user_id = user_id
+        self.text = text
+        self.ts = ts
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": "chat.message", "userId": self.user_id, "text": self.text, "ts": self.ts}
+
+    """
+    Identifies the message across sources. ts is compared as a time, since get_now_iso and Postgres format the same
+    timestamptz differently
+    """
+    def key(self) -> Tuple[datetime, str, str]:
+        return (datetime.fromisoformat(self.ts), self.user_id, self.text)
+
+"""
+Fixed capacity buffer of a league's latest messages. Once full, each new message overwrites the oldest one
+"""
+class MessageRing:
+    __slots__ = ("items", "start", "size")
+
+    def __init__(self, capacity: int):
+        self.items: List[Optional[ChatMessage]] = [None] * capacity
+        self.start = 0
+        self.size = 0
+
+    def append(self, message: ChatMessage):
+        capacity = len(self.items)
+        if self.size < capacity:
+            self.items[(self.start + self.size) % capacity] = message
+            self.size += 1
+        else:
+            self.items[self.start] = message
+            self.start = (self.start + 1) % capacity
+
+    def __iter__(self) -> Iterator[ChatMessage]:
+        capacity = len(self.items)
+        for i in range(self.size):
+            yield self.items[(self.start + i) % capacity]
+
+    def __len__(self) -> int:
+        return self.size
+
+"""
+Recent chat messages of each league, kept in a MessageRing per league and stored in the chat_messages table
+(supabase/migrations: league_id, user_id, text, ts). A league's ring is loaded from the database the first time it is needed.
+New messages are written behind: they are queued and inserted in batches by a background task
+"""
+class ChatHistory:
+    def __init__(self, size: int = CHAT_HISTORY_SIZE, max_leagues: int = CHAT_HISTORY_LEAGUES,
+                 flush_interval: float = CHAT_FLUSH_INTERVAL, flush_batch: int = CHAT_FLUSH_BATCH):
+        self.size = size
+        self.max_leagues = max_leagues
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.rings: OrderedDict[str, MessageRing] = OrderedDict()
+        self.loading: Dict[str, asyncio.Task] = {}
+        self.arrived: Dict[str, List[ChatMessage]] = {} # {league_id -> messages recorded while its ring loads}
+        self.pending: List[Dict[str, Any]] = []
+        self.flush_now = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    async def query(self, league_id: str) -> List[ChatMessage]:
+        async with async_client_pool.acquire() as db_client:
+            response = await (
+                db_client.table("chat_messages").select("user_id", "text", "ts")
+                .eq("league_id", league_id).order("ts", desc=True).limit(self.size).execute()
+            )
+        return [ChatMessage(row["user_id"], row["text"], row["ts"]) for row in reversed(response.data or [])]
+
+    """
+    Builds the league's ring from the stored messages, the ones still waiting to be written and the ones recorded while
+    the query ran, which a flush may have written after the query read the table
+    """
+    async def load(self, league_id: str) -> MessageRing:
+        self.arrived[league_id] = []
+        try:
+            stored = await self.query(league_id)
+        finally:
+            arrived = self.arrived.pop(league_id, [])
+        unwritten = [ChatMessage(row["user_id"], row["text"], row["ts"]) for row in self.pending if row["league_id"] == league_id]
+
+        messages = {message.key(): message for message in stored + unwritten + arrived}
+        ring = MessageRing(self.size)
+        for key in sorted(messages):
+            ring.append(messages[key])
+
+        self.rings[league_id] = ring
+        while len(self.rings) > self.max_leagues:
+            self.rings.popitem(last=False)
+        return ring
+
+    def finish_load(self, league_id: str, task: asyncio.Task):
+        if self.loading.get(league_id) is task:
+            del self.loading[league_id]
+
+    async def get_ring(self, league_id: str) -> MessageRing:
+        ring = self.rings.get(league_id)
+        if ring is not None:
+            self.rings.move_to_end(league_id)
+            return ring
+
+        task = self.loading.get(league_id)
+        if task is None:
+            task = self.loading[league_id] = asyncio.create_task(self.load(league_id))
+            task.add_done_callback(lambda done: self.finish_load(league_id, done))
+        return await asyncio.shield(task)
+
+    """
+    The league's recent messages as chat.message dicts, oldest first
+    """
+    async def recent(self, league_id: str) -> List[Dict[str, Any]]:
+        return [message.to_dict() for message in await self.get_ring(league_id)]
+
+    """
+    Adds a chat.message dict to the league's ring if it is in memory. persist queues it for the database as well
+    """
+    def record(self, league_id: str, message: Dict[str, Any], persist: bool = False):
+        ring = self.rings.get(league_id)
+        if ring is not None:
+            ring.append(ChatMessage(message["userId"], message["text"], message["ts"]))
+        elif league_id in self.arrived:
+            self.arrived[league_id].append(ChatMessage(message["userId"], message["text"], message["ts"]))
+
+        if persist:
+            self.pending.append({"league_id": league_id, "user_id": message["userId"], "text": message["text"], "ts": message["ts"]})
+            if len(self.pending) > CHAT_MAX_PENDING:
+                logger.warning("Dropping %d unwritten chat messages.", len(self.pending) - CHAT_MAX_PENDING)
+                del self.pending[:len(self.pending) - CHAT_MAX_PENDING]
+            if len(self.pending) >= self.flush_batch:
+                self.flush_now.set()
+
+    """
+    Forgets a league's ring so the next use reloads it, e.g. when other workers may have added messages meanwhile
+    """
+    def forget(self, league_id: str):
+        self.rings.pop(league_id, None)
+
+    """
+    Inserts every queued message with a single insert. Messages are queued again if it fails
+    """
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        try:
+            async with async_client_pool.acquire() as db_client:
+                await db_client.table("chat_messages").insert(batch).execute()
+        except Exception:
+            self.pending = batch + self.pending
+            raise
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_now.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_now.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Chat history flush failed")
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Final chat history flush failed")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "leagues": len(self.rings),
+            "messages": sum(len(ring) for ring in self.rings.values()),
+            "pending": len(self.pending),
+        }
+
+chat_history = ChatHistory()
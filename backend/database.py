@@ -1,53 +1,327 @@
-from supabase import create_client, Client, acreate_client, AsyncClient
+from supabase import create_client, Client, acreate_client, AsyncClient, ClientOptions, AsyncClientOptions
+from contextlib import contextmanager, asynccontextmanager
 import pandas as pd
+from datetime import datetime
+from typing import Callable, Dict, Iterator, AsyncIterator, List, Optional
+import asyncio
+import threading
+import queue
+import time
 
+from metrics import timed
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
+
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "8"))
+SUPABASE_POOL_TIMEOUT = float(os.getenv("SUPABASE_POOL_TIMEOUT", "10"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "30"))
+
 """
-Get a supabase client
+Create a new supabase client. Prefer client_pool.acquire() which reuses clients and their keep-alive connections
 """
+@timed("supabase.get_client")
 def get_client() -> Client: 
     url = os.getenv("VITE_SUPABASE_URL")
     key = os.getenv("VITE_SUPABASE_ANON_KEY")
-    client = create_client(url, key)
+    client = create_client(url, key, ClientOptions(postgrest_client_timeout=SUPABASE_TIMEOUT))
     
     return client
 
 """
-Get an async supabase client
+Create a new async supabase client. Prefer async_client_pool.acquire() which reuses clients and their keep-alive connections
 """
+@timed("supabase.get_async_client")
 async def get_async_client() -> AsyncClient: 
     url = os.getenv("VITE_SUPABASE_URL")
     key = os.getenv("VITE_SUPABASE_ANON_KEY")
-    client = await acreate_client(url, key)
+    client = await acreate_client(url, key, AsyncClientOptions(postgrest_client_timeout=SUPABASE_TIMEOUT))
     return client
-    
+
+"""
+Tracks how long callers waited to check a client out of a pool
+"""
+class PoolWaitStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, wait: float):
+        self.count += 1
+        self.total += wait
+        self.max = max(self.max, wait)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            "waits": self.count,
+            "wait_seconds_total": self.total,
+            "wait_seconds_max": self.max,
+            "wait_seconds_avg": self.total / self.count if self.count else 0.0,
+        }
+
+"""
+Process-wide pool of sync supabase clients, created lazily up to size and reused across requests and threads.
+Usage: with client_pool.acquire() as client: ...
+"""
+class ClientPool:
+    def __init__(self, factory: Callable[[], Client] = get_client, size: int = SUPABASE_POOL_SIZE, timeout: float = SUPABASE_POOL_TIMEOUT):
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self.idle: queue.LifoQueue[Client] = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+        self.waits = PoolWaitStats()
+
+    def _checkout(self) -> Client:
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            create = self.created < self.size
+            if create:
+                self.created += 1
+
+        if create:
+            try:
+                return self.factory()
+            except Exception:
+                with self.lock:
+                    self.created -= 1
+                raise
+
+        try:
+            return self.idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"Timed out after {self.timeout}s waiting for a supabase client.")
+
+    @contextmanager
+    def acquire(self) -> Iterator[Client]:
+        start = time.perf_counter()
+        client = self._checkout()
+        with self.lock:
+            self.waits.record(time.perf_counter() - start)
+
+        try:
+            yield client
+        finally:
+            self.idle.put(client)
+
+    def close(self):
+        while True:
+            try:
+                client = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            client.postgrest.aclose()
+        with self.lock:
+            self.created = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            return {"size": self.size, "created": self.created, "idle": self.idle.qsize(), **self.waits.to_dict()}
+
+"""
+Async counterpart of ClientPool for the websocket routers. Must only be used from the server's event loop.
+Usage: async with async_client_pool.acquire() as client: ...
+"""
+class AsyncClientPool:
+    def __init__(self, size: int = SUPABASE_POOL_SIZE, timeout: float = SUPABASE_POOL_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self.idle: Optional[asyncio.LifoQueue[AsyncClient]] = None
+        self.created = 0
+        self.waits = PoolWaitStats()
+
+    async def _checkout(self) -> AsyncClient:
+        if self.idle is None:
+            self.idle = asyncio.LifoQueue()
+
+        if not self.idle.empty():
+            return self.idle.get_nowait()
+
+        if self.created < self.size:
+            self.created += 1
+            try:
+                return await get_async_client()
+            except Exception:
+                self.created -= 1
+                raise
+
+        try:
+            return await asyncio.wait_for(self.idle.get(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Timed out after {self.timeout}s waiting for an async supabase client.")
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[AsyncClient]:
+        start = time.perf_counter()
+        client = await self._checkout()
+        self.waits.record(time.perf_counter() - start)
+
+        try:
+            yield client
+        finally:
+            self.idle.put_nowait(client)
+
+    async def close(self):
+        while self.idle is not None and not self.idle.empty():
+            client = self.idle.get_nowait()
+            await client.postgrest.aclose()
+        self.created = 0
+
+    def stats(self) -> Dict[str, float]:
+        idle = self.idle.qsize() if self.idle is not None else 0
+        return {"size": self.size, "created": self.created, "idle": idle, **self.waits.to_dict()}
+
+client_pool = ClientPool()
+async_client_pool = AsyncClientPool()
+
+"""
+Converts the raw timestamp strings returned by supabase into pd.Timestamp, in place
+"""
+def _parse_timestamps(rows: List[Dict]) -> List[Dict]:
+    for row in rows:
+        row["timestamp"] = pd.Timestamp(row["timestamp"]).tz_convert("UTC")
+    return rows
+
+"""
+Given the ticker and a processed time chunk point, get the single row stored for it. Returns None if it is missing
+Note that the timestamp value is of type pd.Timestamp (NOT STR!)
+"""
+@timed("supabase.retrieve_stock_at")
+def retrieve_stock_at(client: Client, ticker: str, timestamp: datetime) -> Optional[Dict]:
+    response = client.table("stock_prices").select("*").eq("symbol", ticker).eq("timestamp", timestamp.isoformat()).limit(1).execute()
+    if not response.data:
+        return None
+    return _parse_timestamps(response.data)[0]
+
 """
-Given the ticker, get all of its previous stock data. If the ticker is not in the database, returns None
+Given the ticker, get its stored rows with start <= timestamp <= end ordered by timestamp. Returns None if there are none
 Note that the timestamp column is of type pd.Timestamp (NOT STR!)
 """
-def retrieve_stock(client: Client, ticker: str) -> pd.DataFrame: 
-    response = client.table("stock_prices").select("*").eq("symbol", ticker).execute()
-    data =  pd.DataFrame(response.data)
-    if data.empty: 
+@timed("supabase.retrieve_stock_range")
+def retrieve_stock_range(client: Client, ticker: str, start: datetime, end: datetime) -> Optional[pd.DataFrame]:
+    response = (
+        client.table("stock_prices").select("*")
+        .eq("symbol", ticker)
+        .gte("timestamp", start.isoformat())
+        .lte("timestamp", end.isoformat())
+        .order("timestamp")
+        .execute()
+    )
+    data = pd.DataFrame(response.data)
+    if data.empty:
         return None
-    
+
     data["timestamp"] = pd.to_datetime(data['timestamp'], utc=True)
     return data
 
 """
-Given a dataframe, insert all its rows that don't already exist into the database. 
-Expects index to be default
+Given several tickers, get each one's most recent stored row with after <= timestamp <= before, with one call of the
+latest_stock_prices function (supabase/migrations), which reads a single row per ticker.
+Returns {ticker -> row}; tickers without such a row are left out. timestamp values are of type pd.Timestamp
 """
-def add_entries(client: Client, data: pd.DataFrame):
+@timed("supabase.retrieve_latest_stocks")
+def retrieve_latest_stocks(client: Client, tickers: List[str], after: datetime, before: datetime) -> Dict[str, Dict]:
+    symbols = list(set(tickers))
+    if not symbols:
+        return {}
+
+    response = client.rpc("latest_stock_prices", {"p_symbols": symbols, "p_after": after.isoformat(), "p_before": before.isoformat()}).execute()
+    return {row["symbol"]: row for row in _parse_timestamps(response.data or [])}
+
+"""
+Async version of retrieve_latest_stocks
+"""
+@timed("supabase.retrieve_latest_stocks_async")
+async def retrieve_latest_stocks_async(client: AsyncClient, tickers: List[str], after: datetime, before: datetime) -> Dict[str, Dict]:
+    symbols = list(set(tickers))
+    if not symbols:
+        return {}
+
+    response = await client.rpc("latest_stock_prices", {"p_symbols": symbols, "p_after": after.isoformat(), "p_before": before.isoformat()}).execute()
+    return {row["symbol"]: row for row in _parse_timestamps(response.data or [])}
+
+"""
+Given several tickers and a single processed time chunk point, get the rows stored for that point.
+Returns {ticker -> row}; tickers without a stored row are left out
+"""
+@timed("supabase.retrieve_stocks_at")
+def retrieve_stocks_at(client: Client, tickers: List[str], timestamp: datetime) -> Dict[str, Dict]:
+    tickers = list(set(tickers))
+    if not tickers:
+        return {}
+
+    response = client.table("stock_prices").select("*").in_("symbol", tickers).eq("timestamp", timestamp.isoformat()).execute()
+    return {row["symbol"]: row for row in _parse_timestamps(response.data or [])}
+
+"""
+Async version of retrieve_stocks_at
+"""
+@timed("supabase.retrieve_stocks_at_async")
+async def retrieve_stocks_at_async(client: AsyncClient, tickers: List[str], timestamp: datetime) -> Dict[str, Dict]:
+    tickers = list(set(tickers))
+    if not tickers:
+        return {}
+
+    response = await client.table("stock_prices").select("*").in_("symbol", tickers).eq("timestamp", timestamp.isoformat()).execute()
+    return {row["symbol"]: row for row in _parse_timestamps(response.data or [])}
+
+"""
+Given several tickers and several processed time chunk points, get every stored row for any of those pairs with one
+paged query. Returns a dataframe with the stock_prices columns (empty if nothing is stored); timestamp is of type pd.Timestamp
+"""
+@timed("supabase.retrieve_stocks_at_times")
+def retrieve_stocks_at_times(client: Client, tickers: List[str], timestamps: List[datetime], page_size: int = 1000) -> pd.DataFrame:
+    tickers = list(set(tickers))
+    timestamps = list({timestamp.isoformat() for timestamp in timestamps})
+    rows = []
+    while tickers and timestamps:
+        response = (
+            client.table("stock_prices").select("*")
+            .in_("symbol", tickers)
+            .in_("timestamp", timestamps)
+            .order("symbol").order("timestamp")
+            .range(len(rows), len(rows) + page_size - 1)
+            .execute()
+        )
+        rows.extend(response.data or [])
+        if len(response.data or []) < page_size:
+            break
+    return pd.DataFrame(_parse_timestamps(rows))
+
+"""
+Converts a dataframe of stock rows into json records for supabase. Expects index to be default
+"""
+def _entries_to_records(data: pd.DataFrame) -> List[Dict]:
     data = data.copy(deep = False)
     data["timestamp"] = data["timestamp"].astype(str)
-    records = data.to_dict(orient="records")
+    return data.to_dict(orient="records")
 
+"""
+Given a dataframe, insert all its rows that don't already exist into the database. 
+Expects index to be default
+"""
+@timed("supabase.add_entries")
+def add_entries(client: Client, data: pd.DataFrame):
     client.table("stock_prices").upsert(
-        records,
+        _entries_to_records(data),
+        on_conflict="symbol, timestamp",
+        ignore_duplicates=True
+    ).execute()
+
+"""
+Async version of add_entries
+"""
+@timed("supabase.add_entries_async")
+async def add_entries_async(client: AsyncClient, data: pd.DataFrame):
+    await client.table("stock_prices").upsert(
+        _entries_to_records(data),
         on_conflict="symbol, timestamp",
         ignore_duplicates=True
     ).execute()
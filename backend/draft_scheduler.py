@@ -0,0 +1,397 @@
+from datetime import datetime, timedelta, timezone as tz
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+import asyncio
+import heapq
+import logging
+import os
+
+from database import async_client_pool
+from pubsub import InMemoryPubSub, pubsub as default_pubsub
+
+load_dotenv()
+
+DRAFT_FLUSH_INTERVAL = float(os.getenv("DRAFT_FLUSH_INTERVAL", "1")) # seconds between writes of changed draft state
+DRAFT_LEASE_SECONDS = float(os.getenv("DRAFT_LEASE_SECONDS", "30")) # how long a worker owns its drafts without renewing
+CONTROL_TOPIC = "draft.control"
+
+logger = logging.getLogger(__name__)
+
+class DraftState(Enum):
+    NOT_STARTED = "NOT_STARTED"
+    IN_PROGRESS = "IN_PROGRESS"
+    COMPLETED = "COMPLETED"
+
+"""
+State of one snake draft. The turn is fully described by pick_index, so the current user and round are O(1) lookups
+"""
+class Draft:
+    def __init__(self, league_id: str, order: List[str], num_rounds: int, turn_timeout: int,
+                 pick_index: int = 0, deadline: Optional[datetime] = None, state: DraftState = DraftState.IN_PROGRESS):
+        self.league_id = league_id
+        self.order = order
+        self.num_rounds = num_rounds
+        self.turn_timeout = turn_timeout
+        self.pick_index = pick_index
+        self.deadline = deadline
+        self.state = state
+
+    @property
+    def total_picks(self) -> int:
+        return len(self.order) * self.num_rounds
+
+    @property
+    def round_num(self) -> int:
+        return self.pick_index // len(self.order) + 1
+
+    @property
+    def current_user(self) -> str:
+        position = self.pick_index % len(self.order)
+        if self.round_num % 2 == 0: # For snake draft
+            position = len(self.order) - 1 - position
+        return self.order[position]
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "type": "draft.info",
+            "currentUserId": self.current_user,
+            "roundNum": self.round_num,
+            "deadline": self.deadline.isoformat(),
+            "draftState": self.state.value,
+        }
+
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            "league_id": self.league_id,
+            "pick_order": self.order,
+            "num_rounds": self.num_rounds,
+            "turn_timeout": self.turn_timeout,
+            "pick_index": self.pick_index,
+            "deadline": self.deadline.isoformat() if self.deadline is not None else None,
+            "draft_state": self.state.value,
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "Draft":
+        return cls(
+            league_id=record["league_id"],
+            order=list(record["pick_order"]),
+            num_rounds=record["num_rounds"],
+            turn_timeout=record["turn_timeout"],
+            pick_index=record["pick_index"],
+            deadline=datetime.fromisoformat(record["deadline"]) if record.get("deadline") else None,
+            state=DraftState(record["draft_state"]),
+        )
+
+"""
+Persists drafts in the drafts table (supabase/migrations: league_id primary key, pick_order jsonb, num_rounds, turn_timeout,
+pick_index, deadline timestamptz, draft_state, owner, lease_until timestamptz) and mirrors the draft state onto leagues.draft_state.
+owner and lease_until record which worker runs a draft; another worker may only take it over once the lease expired
+"""
+class DraftStore:
+    async def load_active(self) -> List[Dict[str, Any]]:
+        async with async_client_pool.acquire() as db_client:
+            response = await db_client.table("drafts").select("*").eq("draft_state", DraftState.IN_PROGRESS.value).execute()
+        return response.data or []
+
+    async def save(self, records: List[Dict[str, Any]]):
+        async with async_client_pool.acquire() as db_client:
+            await db_client.table("drafts").upsert(records, on_conflict="league_id").execute()
+
+    """
+    Makes owner the draft's owner until lease_until unless another worker holds an unexpired lease. Returns whether it did
+    """
+    async def claim(self, league_id: str, owner: str, lease_until: datetime) -> bool:
+        now = datetime.now(tz.utc).isoformat()
+        async with async_client_pool.acquire() as db_client:
+            await db_client.table("drafts").upsert({"league_id": league_id}, on_conflict="league_id", ignore_duplicates=True).execute()
+            response = await (
+                db_client.table("drafts")
+                .update({"owner": owner, "lease_until": lease_until.isoformat()})
+                .eq("league_id", league_id)
+                .or_(f"owner.is.null,owner.eq.{owner},lease_until.lt.{now}")
+                .execute()
+            )
+        return bool(response.data)
+
+    """
+    Extends owner's lease on the given drafts to lease_until. Returns the league ids owner still owns
+    """
+    async def renew(self, league_ids: List[str], owner: str, lease_until: datetime) -> List[str]:
+        async with async_client_pool.acquire() as db_client:
+            response = await (
+                db_client.table("drafts")
+                .update({"lease_until": lease_until.isoformat()})
+                .in_("league_id", league_ids)
+                .eq("owner", owner)
+                .execute()
+            )
+        return [record["league_id"] for record in response.data or []]
+
+    async def set_league_state(self, league_id: str, state: DraftState):
+        async with async_client_pool.acquire() as db_client:
+            await db_client.table("leagues").update({"draft_state": state.value}).eq("league_id", league_id).execute()
+
+"""
+Runs every draft in the process from one heap of turn deadlines and a single timer task, instead of one task per draft.
+Picks and timeouts advance a draft synchronously before anything is awaited, so they never race each other.
+Heap entries are (deadline, league_id, pick_index) and are skipped when the draft has moved past that pick.
+Changed drafts are written with one upsert every DRAFT_FLUSH_INTERVAL seconds, and in progress drafts are reloaded on start.
+With several workers each draft is run by the worker holding its lease. Owners share every change on CONTROL_TOPIC so
+the other workers keep read-only mirrors, picks made on other workers are forwarded to the owner, and drafts whose
+owner stopped renewing are adopted.
+It sends json information of the following types through publish(league_id, data):
+1. draft.stateChange - {'type', 'draftState'}
+2. draft.turnStart - {'type', 'roundNum', 'currentUserId', 'deadline', 'draftState'}
+3. draft.turnEnd - {'type', 'roundNum', 'previousUserId', 'draftState'}
+"""
+class DraftScheduler:
+    def __init__(self, publish: Callable[[str, Dict], Awaitable[None]], store: Optional[DraftStore] = None,
+                 pubsub: InMemoryPubSub = default_pubsub, flush_interval: float = DRAFT_FLUSH_INTERVAL,
+                 lease_seconds: float = DRAFT_LEASE_SECONDS):
+        self.publish = publish
+        self.store = store or DraftStore()
+        self.pubsub = pubsub
+        self.owner = pubsub.origin
+        self.flush_interval = flush_interval
+        self.lease_seconds = lease_seconds
+        self.drafts: Dict[str, Draft] = {} # {league_id -> active draft run by this worker}
+        self.mirrors: Dict[str, Draft] = {} # {league_id -> active draft run by another worker}
+        self.deadlines: List[Tuple[float, str, int]] = []
+        self.dirty: Dict[str, Draft] = {} # {league_id -> draft changed since the last flush}
+        self.saving: Dict[str, Draft] = {} # {league_id -> draft whose write is in flight}
+        self.wake = asyncio.Event()
+        self.tasks: List[asyncio.Task] = []
+
+    def get(self, league_id: str) -> Optional[Draft]:
+        return self.drafts.get(league_id) or self.mirrors.get(league_id)
+
+    def lease_until(self) -> datetime:
+        return datetime.now(tz.utc) + timedelta(seconds=self.lease_seconds)
+
+    async def share(self, draft: Draft):
+        await self.pubsub.publish(CONTROL_TOPIC, {"kind": "state", "origin": self.owner, "record": draft.to_record()})
+
+    async def on_control(self, message: Dict[str, Any]):
+        if message.get("origin") == self.owner:
+            return
+        if message["kind"] == "pick":
+            if message["league_id"] in self.drafts:
+                await self.pick(message["league_id"], message["user_id"])
+        elif message["kind"] == "state":
+            draft = Draft.from_record(message["record"])
+            if draft.state != DraftState.IN_PROGRESS:
+                self.mirrors.pop(draft.league_id, None)
+            elif draft.league_id not in self.drafts:
+                self.mirrors[draft.league_id] = draft
+
+    def schedule(self, draft: Draft):
+        entry = (draft.deadline.timestamp(), draft.league_id, draft.pick_index)
+        heapq.heappush(self.deadlines, entry)
+        self.dirty[draft.league_id] = draft
+        if self.deadlines[0] is entry:
+            self.wake.set()
+
+    def begin_turn(self, draft: Draft):
+        draft.deadline = datetime.now(tz.utc) + timedelta(seconds=draft.turn_timeout)
+        self.schedule(draft)
+
+    async def send_turn_start(self, draft: Draft):
+        await self.publish(draft.league_id, {
+            "type": "draft.turnStart",
+            "roundNum": draft.round_num,
+            "currentUserId": draft.current_user,
+            "deadline": draft.deadline.isoformat(),
+            "draftState": draft.state.value,
+        })
+
+    """
+    Starts a draft. Returns False if the league already has one running on any worker
+    """
+    async def start_draft(self, league_id: str, order: List[str], num_rounds: int = 3, turn_timeout: int = 30) -> bool:
+        if self.get(league_id) is not None:
+            return False
+        if not order:
+            raise ValueError(f"League {league_id} has no members to draft.")
+        if not await self.store.claim(league_id, self.owner, self.lease_until()) or self.get(league_id) is not None:
+            return False
+
+        draft = Draft(league_id, order, num_rounds, turn_timeout)
+        self.drafts[league_id] = draft
+        self.begin_turn(draft)
+        await self.share(draft)
+
+        await self.store.set_league_state(league_id, DraftState.IN_PROGRESS)
+        await self.publish(league_id, {"type": "draft.stateChange", "draftState": DraftState.IN_PROGRESS.value})
+        await self.send_turn_start(draft)
+        return True
+
+    """
+    Ends the current turn of draft, then starts the next one or completes the draft
+    """
+    async def advance(self, draft: Draft):
+        round_num, previous_user = draft.round_num, draft.current_user
+        draft.pick_index += 1
+        finished = draft.pick_index >= draft.total_picks
+        if finished:
+            draft.state = DraftState.COMPLETED
+            draft.deadline = None
+            self.drafts.pop(draft.league_id, None)
+            self.dirty[draft.league_id] = draft
+        else:
+            self.begin_turn(draft)
+
+        await self.publish(draft.league_id, {
+            "type": "draft.turnEnd",
+            "roundNum": round_num,
+            "previousUserId": previous_user,
+            "draftState": DraftState.IN_PROGRESS.value,
+        })
+        await self.share(draft)
+
+        if finished:
+            await self.store.set_league_state(draft.league_id, DraftState.COMPLETED)
+            await self.publish(draft.league_id, {"type": "draft.stateChange", "draftState": DraftState.COMPLETED.value})
+        else:
+            await self.send_turn_start(draft)
+
+    """
+    Ends user_id's turn if it is their turn, forwarding the pick to the owner when another worker runs the draft.
+    Returns whether the pick was accepted or forwarded
+    """
+    async def pick(self, league_id: str, user_id: str) -> bool:
+        draft = self.get(league_id)
+        if draft is None or draft.current_user != user_id:
+            return False
+        if league_id not in self.drafts:
+            await self.pubsub.publish(CONTROL_TOPIC, {"kind": "pick", "origin": self.owner, "league_id": league_id, "user_id": user_id})
+            return True
+        await self.advance(draft)
+        return True
+
+    """
+    Pops every expired deadline and advances the drafts they still belong to
+    """
+    async def expire(self, now: float):
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, league_id, pick_index = heapq.heappop(self.deadlines)
+            draft = self.drafts.get(league_id)
+            if draft is None or draft.pick_index != pick_index:
+                continue
+            try:
+                await self.advance(draft)
+            except Exception:
+                logger.exception("Could not advance the draft of %s", league_id)
+
+    async def run_timer(self):
+        while True:
+            timeout = None
+            if self.deadlines:
+                timeout = max(0, self.deadlines[0][0] - datetime.now(tz.utc).timestamp())
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            await self.expire(datetime.now(tz.utc).timestamp())
+
+    """
+    Writes every draft changed since the last flush with a single upsert. If the upsert fails, the drafts this worker
+    still runs and the completed ones are marked changed again, behind any newer change, so the next flush retries them
+    """
+    async def flush(self):
+        if not self.dirty:
+            return
+        drafts, self.dirty = self.dirty, {}
+        self.saving = drafts
+        try:
+            await self.store.save([draft.to_record() for draft in drafts.values()])
+        except Exception:
+            for league_id, draft in drafts.items():
+                if league_id in self.drafts or draft.state == DraftState.COMPLETED:
+                    self.dirty.setdefault(league_id, draft)
+            raise
+        finally:
+            self.saving = {}
+
+    async def run_flush(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Draft flush failed")
+
+    """
+    Takes over in progress drafts that have no live owner, e.g. after a restart, and mirrors the ones other workers run.
+    Turns whose deadline passed while nobody owned the draft expire right away. Drafts with a write still pending here,
+    such as a completion, are newer than their stored row and are left alone
+    """
+    async def resume(self):
+        now = datetime.now(tz.utc)
+        for record in await self.store.load_active():
+            draft = Draft.from_record(record)
+            if draft.league_id in self.drafts or draft.pick_index >= draft.total_picks:
+                continue
+            if draft.league_id in self.dirty or draft.league_id in self.saving:
+                continue
+
+            lease_until = datetime.fromisoformat(record["lease_until"]) if record.get("lease_until") else None
+            owned_elsewhere = record.get("owner") not in (None, self.owner) and lease_until is not None and lease_until >= now
+            if owned_elsewhere or not await self.store.claim(draft.league_id, self.owner, self.lease_until()):
+                self.mirrors.setdefault(draft.league_id, draft)
+                continue
+
+            if draft.deadline is None:
+                draft.deadline = now
+            self.mirrors.pop(draft.league_id, None)
+            self.drafts[draft.league_id] = draft
+            self.schedule(draft)
+            self.dirty.pop(draft.league_id, None)
+
+    """
+    Renews the leases of the drafts run here, drops the ones another worker took over, then adopts orphaned drafts
+    """
+    async def run_leases(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                if self.drafts:
+                    owned = set(await self.store.renew(list(self.drafts), self.owner, self.lease_until()))
+                    for league_id in [league_id for league_id in self.drafts if league_id not in owned]:
+                        self.drafts.pop(league_id)
+                        self.dirty.pop(league_id, None)
+                await self.resume()
+            except Exception:
+                logger.exception("Draft lease renewal failed")
+
+    async def start(self):
+        if self.tasks:
+            return
+        await self.pubsub.subscribe(CONTROL_TOPIC, self.on_control)
+        try:
+            await self.resume()
+        except Exception:
+            logger.exception("Could not resume drafts")
+        self.tasks = [asyncio.create_task(self.run_timer()), asyncio.create_task(self.run_flush()), asyncio.create_task(self.run_leases())]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        for task in self.tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.tasks = []
+        await self.pubsub.unsubscribe(CONTROL_TOPIC, self.on_control)
+
+        # Expire the leases right away so another worker adopts these drafts without waiting
+        try:
+            await self.flush()
+            if self.drafts:
+                await self.store.renew(list(self.drafts), self.owner, datetime.now(tz.utc))
+        except Exception:
+            logger.exception("Could not hand off drafts on shutdown")
+        self.drafts.clear()
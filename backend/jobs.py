@@ -0,0 +1,166 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone as tz
+from enum import Enum
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+import threading
+import logging
+import uuid
+import os
+
+from database import client_pool
+from MatchupCalc import fetch_unprocessed_matchups, weekly_score_calc
+from standings import standings
+
+load_dotenv()
+
+MATCHUP_WORKERS = int(os.getenv("MATCHUP_WORKERS", "4"))
+MAX_KEPT_JOBS = 50
+
+logger = logging.getLogger(__name__)
+
+class JobStatus(Enum):
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    COMPLETED = "COMPLETED"
+    FAILED = "FAILED"
+
+"""
+Progress of a single /run-matchups run. Counters are only touched while holding lock since leagues finish on different threads
+"""
+class MatchupJob:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = JobStatus.QUEUED
+        self.total = 0
+        self.done = 0
+        self.failures: List[Dict[str, Any]] = []
+        self.error: Optional[str] = None
+        self.created_at = datetime.now(tz.utc)
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.lock = threading.Lock()
+
+    def record_done(self, count: int):
+        with self.lock:
+            self.done += count
+
+    def record_failure(self, matchup: Dict, error: Exception):
+        with self.lock:
+            self.done += 1
+            self.failures.append({"matchupId": matchup.get("id"), "leagueId": matchup.get("league_id"), "error": str(error)})
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            elapsed = None
+            if self.started_at is not None:
+                elapsed = ((self.finished_at or datetime.now(tz.utc)) - self.started_at).total_seconds()
+
+            return {
+                "jobId": self.id,
+                "status": self.status.value,
+                "done": self.done,
+                "total": self.total,
+                "failed": len(self.failures),
+                "failures": list(self.failures),
+                "error": self.error,
+                "elapsedSeconds": elapsed,
+                "createdAt": self.created_at.isoformat(),
+            }
+
+"""
+Runs weekly matchup scoring in the background. Runs are processed one at a time so two runs never score the same
+matchups, while the leagues inside a run are scored concurrently on a worker pool.
+"""
+class MatchupJobRunner:
+    def __init__(self, max_workers: int = MATCHUP_WORKERS):
+        self.job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="matchup-job")
+        self.league_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="matchup-league")
+        self.jobs: OrderedDict[str, MatchupJob] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self) -> MatchupJob:
+        job = MatchupJob()
+        with self.lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > MAX_KEPT_JOBS:
+                self.jobs.popitem(last=False)
+
+        self.job_executor.submit(self.run_job, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[MatchupJob]:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self) -> List[MatchupJob]:
+        with self.lock:
+            return list(self.jobs.values())
+
+    def shutdown(self):
+        self.job_executor.shutdown(wait=False, cancel_futures=True)
+        self.league_executor.shutdown(wait=False, cancel_futures=True)
+
+    def run_job(self, job: MatchupJob):
+        job.status = JobStatus.RUNNING
+        job.started_at = datetime.now(tz.utc)
+
+        try:
+            with client_pool.acquire() as client:
+                matchups = fetch_unprocessed_matchups(client, datetime.now())
+            job.total = len(matchups)
+
+            leagues: Dict[Any, List[Dict]] = {}
+            for matchup in matchups:
+                leagues.setdefault(matchup.get("league_id"), []).append(matchup)
+
+            futures = {self.league_executor.submit(self.score_league, job, league_matchups): league_matchups for league_matchups in leagues.values()}
+            scored = []
+            for future in as_completed(futures):
+                try:
+                    scored.extend(future.result())
+                except Exception as e:
+                    # e.g. no database client: only this league fails, the others' results are still recorded below
+                    league_matchups = futures[future]
+                    logger.exception("Scoring league %s failed", league_matchups[0].get("league_id"))
+                    for matchup in league_matchups:
+                        job.record_failure(matchup, e)
+
+            # Only once every league is scored, so a standings failure can never make a league be scored again
+            with client_pool.acquire() as client:
+                standings.record_scored(client, scored)
+
+            job.status = JobStatus.COMPLETED
+        except Exception as e:
+            logger.exception("Matchup job %s failed", job.id)
+            job.error = str(e)
+            job.status = JobStatus.FAILED
+        finally:
+            job.finished_at = datetime.now(tz.utc)
+
+    """
+    Scores one league in bulk. If the bulk pass fails, rescore its matchups one by one so a single bad matchup
+    only fails itself. Pricing reuses the league's client, so each league holds at most one pool client.
+    Returns the matchup rows that were written
+    """
+    def score_league(self, job: MatchupJob, matchups: List[Dict]) -> List[Dict]:
+        with client_pool.acquire() as client:
+            try:
+                scored = weekly_score_calc(client, matchups)
+                job.record_done(len(matchups))
+                return scored
+            except Exception:
+                logger.exception("Scoring %d matchups together failed, retrying one at a time", len(matchups))
+
+            scored = []
+            for matchup in matchups:
+                try:
+                    scored.extend(weekly_score_calc(client, [matchup]))
+                    job.record_done(1)
+                except Exception as e:
+                    logger.exception("Scoring matchup %s failed", matchup.get("id"))
+                    job.record_failure(matchup, e)
+            return scored
+
+matchup_jobs = MatchupJobRunner()
@@ -0,0 +1,117 @@
+from typing import Any, Dict, List, Tuple
+from dotenv import load_dotenv
+import asyncio
+import time
+import logging
+import os
+
+from database import async_client_pool
+from pubsub import InMemoryPubSub, pubsub as default_pubsub
+
+load_dotenv()
+
+LEAGUE_MEMBERS_TTL = float(os.getenv("LEAGUE_MEMBERS_TTL", "300")) # seconds a league's member list is reused
+LEAGUE_MEMBERS_REFRESH = float(os.getenv("LEAGUE_MEMBERS_REFRESH", "30")) # minimum seconds between reloads of a league caused by an unknown user
+INVALIDATION_TOPIC = "league_members.invalidate"
+
+logger = logging.getLogger(__name__)
+
+"""
+Process-wide cache of each league's user ids, shared by the chat and draft managers. Entries expire after ttl seconds,
+concurrent loads of the same league share one query, and invalidate drops an entry on every worker when members change
+"""
+class LeagueMembersCache:
+    def __init__(self, ttl: float = LEAGUE_MEMBERS_TTL, pubsub: InMemoryPubSub = default_pubsub, refresh_interval: float = LEAGUE_MEMBERS_REFRESH):
+        self.ttl = ttl
+        self.pubsub = pubsub
+        self.refresh_interval = refresh_interval
+        self.refreshed: Dict[str, float] = {} # {league_id -> when refresh last reloaded it}
+        self.entries: Dict[str, Tuple[float, List[str]]] = {} # {league_id -> (expiry, user ids)}
+        self.loading: Dict[str, asyncio.Task] = {}
+        self.generations: Dict[str, int] = {} # bumped on invalidation so loads started before it are not cached
+        self.hits = 0
+        self.misses = 0
+
+    async def query(self, league_id: str) -> List[str]:
+        async with async_client_pool.acquire() as db_client:
+            response = await db_client.table("league_members").select("user_id").eq("league_id", league_id).execute()
+
+        if response.data is None:
+            logger.error("Error fetching league members: %s", response.error)
+            raise ValueError("Could not fetch league members!")
+
+        return [user["user_id"] for user in response.data]
+
+    async def load(self, league_id: str) -> List[str]:
+        generation = self.generations.get(league_id, 0)
+        users = await self.query(league_id)
+        if self.generations.get(league_id, 0) == generation:
+            self.entries[league_id] = (time.monotonic() + self.ttl, users)
+        return users
+
+    def finish_load(self, league_id: str, task: asyncio.Task):
+        if self.loading.get(league_id) is task:
+            del self.loading[league_id]
+
+    """
+    Returns the user ids of league_id, loading them at most once at a time per league
+    """
+    async def get(self, league_id: str) -> List[str]:
+        entry = self.entries.get(league_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return list(entry[1])
+
+        self.misses += 1
+        task = self.loading.get(league_id)
+        if task is None:
+            task = self.loading[league_id] = asyncio.create_task(self.load(league_id))
+            task.add_done_callback(lambda done: self.finish_load(league_id, done))
+        return list(await asyncio.shield(task))
+
+    """
+    Reloads league_id's user ids on this worker for a user missing from the cached list, e.g. one who just joined.
+    Reloads happen at most once per refresh_interval per league, so unknown or reconnecting users cannot bypass the cache
+    """
+    async def refresh(self, league_id: str) -> List[str]:
+        now = time.monotonic()
+        if now - self.refreshed.get(league_id, float("-inf")) >= self.refresh_interval:
+            self.refreshed[league_id] = now
+            self.invalidate_local(league_id)
+        return await self.get(league_id)
+
+    """
+    Drops this worker's entry for league_id. Loads already running are not cached
+    """
+    def invalidate_local(self, league_id: str):
+        self.entries.pop(league_id, None)
+        self.loading.pop(league_id, None)
+        self.generations[league_id] = self.generations.get(league_id, 0) + 1
+
+    """
+    Drops the entry for league_id on every worker
+    """
+    async def invalidate(self, league_id: str):
+        self.invalidate_local(league_id)
+        await self.pubsub.publish(INVALIDATION_TOPIC, {"origin": self.pubsub.origin, "league_id": league_id})
+
+    async def on_invalidate(self, message: Dict[str, Any]):
+        if message.get("origin") != self.pubsub.origin:
+            self.invalidate_local(message["league_id"])
+
+    async def start(self):
+        await self.pubsub.subscribe(INVALIDATION_TOPIC, self.on_invalidate)
+
+    async def stop(self):
+        await self.pubsub.unsubscribe(INVALIDATION_TOPIC, self.on_invalidate)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "leagues": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+league_members = LeagueMembersCache()
@@ -0,0 +1,243 @@
+from datetime import date, datetime, timedelta, timezone as tz
+from typing import Any, Dict, List, Optional, Set
+from dotenv import load_dotenv
+import asyncio
+import logging
+import time
+import os
+
+from database import async_client_pool
+from websocket import ConnectionManager, encode_json
+from market_calendar import market_calendar
+from prices import price_stream, PRICE_STREAM_DELAY
+from time_utils import seconds_until_next_chunk, get_now_iso
+
+load_dotenv()
+
+TIME_CHUNK_SIZE = int(os.getenv("TIME_CHUNK_SIZE"))
+LIVE_SCORES_RELOAD = float(os.getenv("LIVE_SCORES_RELOAD", "300")) # seconds before a league's matchups, balances and holdings are read again
+
+logger = logging.getLogger(__name__)
+
+"""
+The matchups of a league's current week and when they were loaded
+"""
+class LeagueBook:
+    def __init__(self, league_id: str, matchups: List[Dict[str, Any]]):
+        self.league_id = league_id
+        self.matchups = matchups
+        self.members: Set[str] = {m[key] for m in matchups for key in ("user1_id", "user2_id")}
+        self.loaded_at = time.monotonic()
+
+def is_current_week(matchup: Dict[str, Any], today: date) -> bool:
+    start = datetime.fromisoformat(matchup["created_date"]).date() + timedelta(days=7 * (matchup["week"] - 1))
+    return start <= today < start + timedelta(days=7)
+
+"""
+Scores the current week's matchups of every league with sockets in manager while the market is open. Each member's
+cash balance and holdings are kept in memory together with their total value, and a reverse index
+{ticker -> members holding it} limits every TIME_CHUNK_SIZE tick to the members holding a ticker whose price moved:
+their totals change by amount * (new price - old price). Leagues with a changed member get a matchup.live frame
+{'type', 'matchups': [{'id', 'user1_id', 'user2_id', 'u1_score', 'u2_score'}], 'ts'}, scored like weekly_score_calc
+as total over start_of_week_total
+"""
+class LiveScores:
+    def __init__(self, manager: ConnectionManager, delay: float = PRICE_STREAM_DELAY, reload_interval: float = LIVE_SCORES_RELOAD):
+        self.manager = manager
+        self.delay = delay
+        self.reload_interval = reload_interval
+        self.leagues: Dict[str, LeagueBook] = {}
+        self.member_league: Dict[str, str] = {}
+        self.holdings: Dict[str, Dict[str, float]] = {} # {league_member_id -> {ticker -> stock_amount}}
+        self.starts: Dict[str, float] = {} # {league_member_id -> start_of_week_total}
+        self.values: Dict[str, float] = {} # {league_member_id -> cash balance plus holdings at the latest prices}
+        self.holders: Dict[str, Set[str]] = {} # {ticker -> league_member_ids holding it}
+        self.prices: Dict[str, float] = {} # {ticker -> latest vwap}
+        self.locks: Dict[str, asyncio.Lock] = {} # {league_id -> held while the league is loaded}
+        self.task: Optional[asyncio.Task] = None
+        self.revalued = 0
+        self.pushed = 0
+
+    async def query(self, league_id: str):
+        async with async_client_pool.acquire() as db_client:
+            matchups = await db_client.table("matchups").select("*").eq("league_id", league_id).is_("winner_id", None).execute()
+            current = [m for m in matchups.data or [] if is_current_week(m, date.today())]
+            member_ids = list({m[key] for m in current for key in ("user1_id", "user2_id")})
+            if not member_ids:
+                return current, [], []
+
+            portfolios = await db_client.table("portfolios").select("league_member_id", "current_balance", "start_of_week_total").in_("league_member_id", member_ids).execute()
+            holdings = await db_client.table("holdings").select("league_member_id", "ticker", "stock_amount").in_("league_member_id", member_ids).execute()
+        return current, portfolios.data or [], holdings.data or []
+
+    def league_lock(self, league_id: str) -> asyncio.Lock:
+        lock = self.locks.get(league_id)
+        if lock is None:
+            lock = self.locks[league_id] = asyncio.Lock()
+        return lock
+
+    def forget(self, league_id: str):
+        lock = self.locks.get(league_id)
+        if lock is not None and not lock.locked():
+            del self.locks[league_id]
+        book = self.leagues.pop(league_id, None)
+        if book is None:
+            return
+        for member in book.members:
+            for ticker in self.holdings.pop(member, {}):
+                holders = self.holders.get(ticker)
+                if holders is not None:
+                    holders.discard(member)
+                    if not holders:
+                        del self.holders[ticker]
+                        self.prices.pop(ticker, None)
+            self.member_league.pop(member, None)
+            self.starts.pop(member, None)
+            self.values.pop(member, None)
+
+    """
+    Reads a league's current matchups, balances and holdings and values its members at the known prices.
+    Call while holding the league's lock. The in-memory state only changes after the reads, without awaiting,
+    so scores are never read half updated
+    """
+    async def load(self, league_id: str) -> LeagueBook:
+        matchups, portfolios, holdings = await self.query(league_id)
+        self.forget(league_id)
+
+        book = self.leagues[league_id] = LeagueBook(league_id, matchups)
+        for member in book.members:
+            self.member_league[member] = league_id
+            self.holdings[member] = {}
+        for row in holdings:
+            if row["league_member_id"] in book.members:
+                owned = self.holdings[row["league_member_id"]]
+                owned[row["ticker"]] = owned.get(row["ticker"], 0) + float(row["stock_amount"] or 0)
+                self.holders.setdefault(row["ticker"], set()).add(row["league_member_id"])
+
+        balances = {row["league_member_id"]: row for row in portfolios}
+        for member in book.members:
+            portfolio = balances.get(member, {})
+            self.starts[member] = float(portfolio.get("start_of_week_total") or 0)
+            self.values[member] = float(portfolio.get("current_balance") or 0) + sum(
+                amount * self.prices.get(ticker, 0) for ticker, amount in self.holdings[member].items()
+            )
+        return book
+
+    """
+    Moves the totals of the members holding each ticker whose price changed. Returns the leagues that changed
+    """
+    def apply_prices(self, prices: Dict[str, float]) -> Set[str]:
+        changed: Set[str] = set()
+        for ticker, price in prices.items():
+            delta = price - self.prices.get(ticker, 0)
+            if not delta:
+                continue
+            self.prices[ticker] = price
+            for member in self.holders.get(ticker, ()):
+                self.values[member] += self.holdings[member][ticker] * delta
+                self.revalued += 1
+                changed.add(self.member_league[member])
+        return changed
+
+    async def fetch_prices(self, tickers: List[str], now: datetime) -> Dict[str, float]:
+        if not tickers:
+            return {}
+        rows = await price_stream.fetch_rows(tickers, now)
+        return {ticker: float(row["vwap"]) for ticker, row in rows.items() if row.get("vwap") is not None}
+
+    def score(self, member: str) -> Optional[float]:
+        start = self.starts.get(member)
+        return self.values[member] / start if start else None
+
+    def frame(self, league_id: str) -> Dict[str, Any]:
+        return {
+            "type": "matchup.live",
+            "matchups": [
+                {"id": m["id"], "user1_id": m["user1_id"], "user2_id": m["user2_id"],
+                 "u1_score": self.score(m["user1_id"]), "u2_score": self.score(m["user2_id"])}
+                for m in self.leagues[league_id].matchups
+            ],
+            "ts": get_now_iso(),
+        }
+
+    """
+    Each worker scores the leagues of its own sockets, so frames are delivered to this worker's sockets only
+    """
+    async def push(self, league_id: str):
+        if self.leagues[league_id].matchups:
+            self.pushed += 1
+            await self.manager.deliver(league_id, encode_json(self.frame(league_id)))
+
+    """
+    Reloads the leagues that are due one at a time under their own lock, then prices every held ticker without any
+    lock, so a snapshot never waits on the price fetch
+    """
+    async def tick(self, now: datetime):
+        rooms = set(self.manager.rooms)
+        for league_id in [league_id for league_id in self.leagues if league_id not in rooms]:
+            self.forget(league_id)
+
+        changed: Set[str] = set()
+        for league_id in rooms:
+            book = self.leagues.get(league_id)
+            if book is None or time.monotonic() - book.loaded_at > self.reload_interval:
+                async with self.league_lock(league_id):
+                    await self.load(league_id)
+                changed.add(league_id)
+
+        changed |= self.apply_prices(await self.fetch_prices(list(self.holders), now))
+
+        for league_id in changed:
+            if league_id in self.leagues:
+                await self.push(league_id)
+
+    """
+    The league's matchup.live frame for a socket that just joined, from the last computed scores. Only a league this
+    worker is not scoring yet is loaded first, under that league's lock
+    """
+    async def snapshot(self, league_id: str) -> Optional[Dict[str, Any]]:
+        if league_id not in self.leagues:
+            async with self.league_lock(league_id):
+                if league_id not in self.leagues:
+                    book = await self.load(league_id)
+                    tickers = {ticker for member in book.members for ticker in self.holdings[member] if ticker not in self.prices}
+                    self.apply_prices(await self.fetch_prices(list(tickers), datetime.now(tz.utc)))
+        book = self.leagues.get(league_id)
+        if book is None or not book.matchups:
+            return None
+        return self.frame(league_id)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(seconds_until_next_chunk(datetime.now(tz.utc), self.delay))
+
+            now = datetime.now(tz.utc)
+            if not market_calendar.has_session_between(now - timedelta(minutes=TIME_CHUNK_SIZE), now):
+                continue
+
+            try:
+                await self.tick(now)
+            except Exception:
+                logger.exception("Live scoring tick failed")
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "leagues": len(self.leagues),
+            "members": len(self.values),
+            "tickers": len(self.holders),
+            "revalued": self.revalued,
+            "pushed": self.pushed,
+        }
@@ -1,20 +1,65 @@
-from fastapi import FastAPI, HTTPException, WebSocket
+from fastapi import FastAPI, HTTPException, Request, WebSocket
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone as tz
 from typing import Optional
 from datetime import datetime
 
-from stocks import fetch_price
-from MatchupCalc import run_weekly_matchups
+from stocks import fetch_price_async
+from price_cache import price_cache
+from jobs import matchup_jobs
+from prefetch import prefetcher
 from stockManagement import Stock, add_stock, remove_stock
-import traceback
-from database import get_client
-from draft import router as draft_router
-from chat import router as chat_router
+from rosters import rosters, RosterBatch
+from standings import standings
+import logging
+import time
+from database import client_pool, async_client_pool
+from pubsub import pubsub
+from league_members import league_members
+from chat_history import chat_history
+from draft import router as draft_router, scheduler as draft_scheduler, manager as draft_manager
+from chat import router as chat_router, manager as chat_manager, live_scores
+from prices import router as prices_router, price_stream
+from metrics import registry, configure_logging
 
-app = FastAPI()
+configure_logging()
+logger = logging.getLogger(__name__)
+
+"""
+Starts the price prefetcher, price stream, live matchup scoring, the chat and draft members heartbeats, league member and roster invalidation, chat history writer and draft scheduler (resuming in progress drafts), then writes pending chat messages and closes the pubsub backend, the shared supabase client pools and background workers when the server shuts down
+"""
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    prefetcher.start()
+    price_stream.start()
+    live_scores.start()
+    chat_manager.start()
+    draft_manager.start()
+    await league_members.start()
+    await rosters.start()
+    chat_history.start()
+    await draft_scheduler.start()
+    yield
+    await draft_scheduler.stop()
+    await chat_history.stop()
+    await rosters.stop()
+    await league_members.stop()
+    await draft_manager.stop()
+    await chat_manager.stop()
+    await pubsub.close()
+    await live_scores.stop()
+    await price_stream.stop()
+    await prefetcher.stop()
+    matchup_jobs.shutdown()
+    client_pool.close()
+    await async_client_pool.close()
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(draft_router)
 app.include_router(chat_router)
+app.include_router(prices_router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,12 +69,64 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+request_seconds = registry.histogram("http_request_duration_seconds", "Time to answer HTTP requests by route template")
+
+"""
+Times every HTTP request under its route template, so /leagues/{league_id}/standings is one series for all leagues
+"""
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        request_seconds.observe(time.perf_counter() - started, method=request.method,
+                                route=getattr(route, "path", "unmatched"), status=str(status))
+
+caches = {"price_cache": price_cache, "league_members": league_members, "standings": standings}
+managers = {"chat": chat_manager, "draft": draft_manager, "prices": price_stream.manager}
+registry.gauge("cache_hit_rate", "Share of lookups answered from memory", lambda: {(("cache", name),): cache.stats()["hit_rate"] for name, cache in caches.items()})
+registry.gauge("cache_hits_total", "Lookups answered from memory", lambda: {(("cache", name),): cache.stats()["hits"] for name, cache in caches.items()}, kind="counter")
+registry.gauge("cache_misses_total", "Lookups that went to the database or Alpaca", lambda: {(("cache", name),): cache.stats()["misses"] for name, cache in caches.items()}, kind="counter")
+registry.gauge("websocket_rooms", "Rooms with sockets on this worker", lambda: {(("manager", name),): len(manager.rooms) for name, manager in managers.items()})
+registry.gauge("websocket_sockets", "Open sockets on this worker", lambda: {(("manager", name),): len(manager.outboxes) for name, manager in managers.items()})
+registry.gauge("chat_messages_pending", "Chat messages waiting to be written to the database", lambda: chat_history.stats()["pending"])
+registry.gauge("supabase_pool_wait_seconds_max", "Longest wait for a pooled supabase client", lambda: {
+    (("pool", "sync"),): client_pool.stats()["wait_seconds_max"], (("pool", "async"),): async_client_pool.stats()["wait_seconds_max"],
+})
+
 @app.get("/")
 def root():
     return {"message": "Stock price API is running."}
 
+@app.get("/stats")
+def stats():
+    return {
+        "price_cache": price_cache.stats(),
+        "supabase_pool": client_pool.stats(),
+        "supabase_async_pool": async_client_pool.stats(),
+        "prefetch": prefetcher.last_run,
+        "league_members": league_members.stats(),
+        "chat_history": chat_history.stats(),
+        "rosters": rosters.stats(),
+        "standings": standings.stats(),
+        "live_scores": live_scores.stats(),
+        "presence": {"chat": chat_manager.presence.stats(), "draft": draft_manager.presence.stats()},
+    }
+
+"""
+Request latency and span histograms, cache hit rates and socket counts of this worker in the Prometheus text format
+"""
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return registry.render()
+
 @app.get("/price")
-def get_stock_price(ticker: str, ts: Optional[str] = None):
+async def get_stock_price(ticker: str, ts: Optional[str] = None):
     try:
         ticker = ticker.upper()
         if ts:
@@ -37,49 +134,84 @@ def get_stock_price(ticker: str, ts: Optional[str] = None):
         else:
             dt = datetime.now(tz.utc)
 
-        price_data = fetch_price(ticker, dt)
+        price_data = await fetch_price_async(ticker, dt)
         return {"price_data": price_data}
     
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.post("/run-matchups")
-def run_matchups():
+"""
+Called after a league's members change so every worker reloads them on the next connection
+"""
+@app.post("/leagues/{league_id}/members/changed")
+async def league_members_changed(league_id: str):
+    await league_members.invalidate(league_id)
+    return {"status": "ok"}
+
+"""
+The league's members ordered by rank, each {'league_member_id', 'wins', 'losses', 'total_score', 'streak', 'last_week', 'rank', ...}
+"""
+@app.get("/leagues/{league_id}/standings")
+async def league_standings(league_id: str):
     try:
-        run_weekly_matchups()
-        return {"message": "Matchup calculations completed successfully."}
+        return {"standings": await standings.get(league_id)}
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Could not load the standings of %s", league_id)
         raise HTTPException(status_code=500, detail=str(e))
-    
-@app.post("/add-stock")
-def add_stock_endpoint(stock: Stock):
 
-    print("Adding Stock!")
+@app.post("/run-matchups", status_code=202)
+def run_matchups():
+    job = matchup_jobs.submit()
+    return {"message": "Matchup calculations queued.", "job_id": job.id}
 
+@app.get("/run-matchups")
+def list_matchup_jobs():
+    return {"jobs": [job.to_dict() for job in matchup_jobs.list()]}
+
+@app.get("/run-matchups/{job_id}")
+def get_matchup_job(job_id: str):
+    job = matchup_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job.to_dict()
+    
+@app.post("/add-stock")
+async def add_stock_endpoint(stock: Stock):
     try:
-        return add_stock(stock)
+        return await add_stock(stock)
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Could not add %s", stock.ticker)
         raise HTTPException(status_code=500, detail=str(e))
     
 @app.post("/remove-stock")
-def remove_stock_endpoint(stock: Stock):
+async def remove_stock_endpoint(stock: Stock):
+    try:
+        return await remove_stock(stock)
+    except Exception as e:
+        logger.exception("Could not remove %s", stock.ticker)
+        raise HTTPException(status_code=500, detail=str(e))
+
+"""
+Applies a list of add/drop/has operations of one league member in order, checked against the league's roster index and
+written in one transaction. Returns {'results': [{'op', 'ticker', 'ok', 'message' or 'has_ticker', 'row' for adds}]}
+"""
+@app.post("/stocks/batch")
+async def stocks_batch(batch: RosterBatch):
     try:
-        return remove_stock(stock)
+        return {"results": await rosters.apply(batch)}
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Roster batch of %s failed", batch.league_member_id)
         raise HTTPException(status_code=500, detail=str(e))
     
 @app.get("/hasTicker")
 def has_ticker(leagueMemberId, ticker):
     try:
-        client = get_client()
-        existing_stock = client.table("user_stocks").select("*").eq("league_member_id", leagueMemberId).eq("Ticker", ticker).execute().data
-        print("Query response:", existing_stock)
+        with client_pool.acquire() as client:
+            existing_stock = client.table("user_stocks").select("Ticker").eq("league_member_id", leagueMemberId).eq("Ticker", ticker).limit(1).execute().data
+        logger.debug("Query response: %s", existing_stock)
         return {"has_ticker": len(existing_stock) > 0}  
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("hasTicker failed for %s", ticker)
         raise HTTPException(status_code=500, detail=str(e))
     
 @app.websocket("/ws")
@@ -0,0 +1,132 @@
+from bisect import bisect_right
+from datetime import date, datetime, time as dtime, timedelta, timezone as tz
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+from dotenv import load_dotenv
+import json
+import os
+
+load_dotenv()
+
+MARKET_CALENDAR_FILE = os.getenv("MARKET_CALENDAR_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "market_calendar.json"))
+
+"""
+Trading calendar for the exchange described in market_calendar.json (sessions, holidays and early closes).
+Every session inside the file's range is precomputed as UTC (open, close) pairs, so open/close times stay correct across
+DST changes. Lookups by day are O(1) and lookups by time are O(log n) over the sorted session closes.
+Days outside the file's range fall back to regular weekday sessions.
+"""
+class MarketCalendar:
+    def __init__(self, timezone: str, open_time: dtime, close_time: dtime, early_close_time: dtime,
+                 start: date, end: date, holidays: List[date], early_closes: List[date]):
+        self.timezone = ZoneInfo(timezone)
+        self.open_time = open_time
+        self.close_time = close_time
+        self.early_close_time = early_close_time
+        self.start = start
+        self.end = end
+        self.holidays = set(holidays)
+        self.early_closes = set(early_closes)
+
+        self.sessions: Dict[date, Tuple[datetime, datetime]] = {} # {exchange day -> (open, close)} in UTC
+        day = start
+        while day <= end:
+            session = self._build_session(day)
+            if session is not None:
+                self.sessions[day] = session
+            day += timedelta(days=1)
+
+        self.closes: List[datetime] = [close for _, close in self.sessions.values()]
+
+    @classmethod
+    def from_file(cls, path: str = MARKET_CALENDAR_FILE) -> "MarketCalendar":
+        with open(path) as f:
+            raw = json.load(f)
+
+        return cls(
+            timezone=raw["timezone"],
+            open_time=dtime.fromisoformat(raw["open"]),
+            close_time=dtime.fromisoformat(raw["close"]),
+            early_close_time=dtime.fromisoformat(raw["early_close"]),
+            start=date.fromisoformat(raw["start"]),
+            end=date.fromisoformat(raw["end"]),
+            holidays=[date.fromisoformat(day) for day in raw["holidays"]],
+            early_closes=[date.fromisoformat(day) for day in raw["early_closes"]],
+        )
+
+    def _build_session(self, day: date) -> Optional[Tuple[datetime, datetime]]:
+        if day.weekday() >= 5 or day in self.holidays:
+            return None
+
+        close_time = self.early_close_time if day in self.early_closes else self.close_time
+        open_dt = datetime.combine(day, self.open_time, tzinfo=self.timezone).astimezone(tz.utc)
+        close_dt = datetime.combine(day, close_time, tzinfo=self.timezone).astimezone(tz.utc)
+        return open_dt, close_dt
+
+    def _covers(self, day: date) -> bool:
+        return self.start <= day <= self.end
+
+    """
+    The exchange-local date of a UTC time
+    """
+    def local_date(self, time: datetime) -> date:
+        return time.astimezone(self.timezone).date()
+
+    """
+    Returns the (open, close) UTC times of the session on the given exchange day, or None if the market is closed that day
+    """
+    def session(self, day: date) -> Optional[Tuple[datetime, datetime]]:
+        if self._covers(day):
+            return self.sessions.get(day)
+        return self._build_session(day)
+
+    def is_open(self, time: datetime) -> bool:
+        session = self.session(self.local_date(time))
+        return session is not None and session[0] <= time < session[1]
+
+    """
+    Latest session close at or before time
+    """
+    def previous_close(self, time: datetime) -> datetime:
+        day = self.local_date(time)
+        if self._covers(day):
+            i = bisect_right(self.closes, time) - 1
+            if i >= 0:
+                return self.closes[i]
+
+        # Outside the precomputed range, walk back over regular sessions
+        while True:
+            session = self.session(day)
+            if session is not None and session[1] <= time:
+                return session[1]
+            day -= timedelta(days=1)
+
+    """
+    Clips time down to the latest moment the market was trading: time itself during a session, otherwise the previous close
+    """
+    def clip(self, time: datetime) -> datetime:
+        session = self.session(self.local_date(time))
+        if session is not None and session[0] <= time:
+            return min(time, session[1])
+        return self.previous_close(time)
+
+    """
+    Opening time of the first session in the exchange week containing time. Normally Monday's open,
+    later in the week when Monday is a holiday
+    """
+    def week_open(self, time: datetime) -> datetime:
+        day = self.local_date(time)
+        monday = day - timedelta(days=day.weekday())
+        for offset in range(5):
+            session = self.session(monday + timedelta(days=offset))
+            if session is not None:
+                return session[0]
+        return datetime.combine(monday, self.open_time, tzinfo=self.timezone).astimezone(tz.utc)
+
+    """
+    Whether the market trades at any point in [start, end]
+    """
+    def has_session_between(self, start: datetime, end: datetime) -> bool:
+        return self.clip(end) > start
+
+market_calendar = MarketCalendar.from_file()
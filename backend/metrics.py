@@ -0,0 +1,179 @@
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from dotenv import load_dotenv
+import functools
+import inspect
+import logging
+import threading
+import time
+import os
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+"""
+Sends every backend logger to stderr at LOG_LEVEL. Call once when the server starts
+"""
+def configure_logging(level: str = LOG_LEVEL):
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+def label_key(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: Dict[Labels, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            return [f"{self.name}{format_labels(labels)} {value}" for labels, value in self.values.items()]
+
+"""
+Cumulative histogram per label set with fixed bucket bounds, like prometheus_client's
+"""
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.values: Dict[Labels, List[float]] = {} # {labels -> [count per bucket..., +Inf count, sum]}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = label_key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self.lock:
+            for labels, counts in self.values.items():
+                total = 0.0
+                for bound, count in zip(self.buckets, counts):
+                    total += count
+                    lines.append(f"{self.name}_bucket{format_labels(labels, ('le', repr(float(bound))))} {total}")
+                total += counts[len(self.buckets)]
+                lines.append(f"{self.name}_bucket{format_labels(labels, ('le', '+Inf'))} {total}")
+                lines.append(f"{self.name}_count{format_labels(labels)} {total}")
+                lines.append(f"{self.name}_sum{format_labels(labels)} {counts[-1]}")
+        return lines
+
+"""
+Value read when /metrics is scraped. collect returns {labels dict as a tuple of pairs -> value}, or a single number.
+kind is "counter" when it reads a running total kept elsewhere, such as a cache's hits
+"""
+class Gauge:
+    def __init__(self, name: str, help: str, collect: Callable[[], object], kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.kind = kind
+
+    def samples(self) -> List[str]:
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{format_labels(label_key(dict(labels)))} {float(value)}" for labels, value in values.items()]
+
+"""
+Every metric the server exposes, rendered in the Prometheus text format by /metrics
+"""
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.metrics.get(name) or self.add(Counter(name, help))
+
+    def histogram(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.metrics.get(name) or self.add(Histogram(name, help, buckets))
+
+    def gauge(self, name: str, help: str, collect: Callable[[], object], kind: str = "gauge") -> Gauge:
+        return self.add(Gauge(name, help, collect, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                samples = metric.samples()
+            except Exception:
+                logging.getLogger(__name__).exception("Could not collect %s", metric.name)
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+span_seconds = registry.histogram("span_duration_seconds", "Time spent in instrumented calls to Supabase, Alpaca, forward fill and websocket broadcasts")
+span_errors = registry.counter("span_errors_total", "Instrumented calls that raised")
+
+"""
+Times the block into span_duration_seconds{span=name, ...labels}, counting it in span_errors_total if it raises
+"""
+@contextmanager
+def span(name: str, **labels: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        span_errors.inc(span=name, **labels)
+        raise
+    finally:
+        span_seconds.observe(time.perf_counter() - started, span=name, **labels)
+
+"""
+Decorator wrapping every call of a sync or async function in span(name)
+"""
+def timed(name: str, **labels: str):
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, **labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
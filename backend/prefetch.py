@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta, timezone as tz
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+import asyncio
+import time
+import logging
+import os
+
+from database import async_client_pool
+from market_calendar import market_calendar
+from stocks import fetch_prices_async
+from pubsub import WORKER_ID
+from time_utils import seconds_until_next_chunk, process_time
+
+load_dotenv()
+
+TIME_CHUNK_SIZE = int(os.getenv("TIME_CHUNK_SIZE"))
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+PREFETCH_BATCH_SIZE = int(os.getenv("PREFETCH_BATCH_SIZE", "50"))
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "2"))
+PREFETCH_RATE_LIMIT = float(os.getenv("PREFETCH_RATE_LIMIT", "120")) # Alpaca requests per minute
+PREFETCH_DELAY = float(os.getenv("PREFETCH_DELAY", "5")) # seconds after a chunk boundary before its bars are requested
+TICKER_PAGE_SIZE = 1000 # PostgREST's default max rows
+
+logger = logging.getLogger(__name__)
+
+"""
+Spaces out calls so that at most rate_per_minute of them start in any minute
+"""
+class RateLimiter:
+    def __init__(self, rate_per_minute: float):
+        self.interval = 60 / rate_per_minute if rate_per_minute > 0 else 0
+        self.next_time = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+"""
+Loads the latest chunk of every held or drafted ticker into the price cache and stock_prices right after each
+TIME_CHUNK_SIZE boundary while the market is trading, so user requests and matchup scoring find prices already in place.
+Every worker runs the loop, but each chunk is claimed in prefetch_runs (supabase/migrations) and only the worker that
+claimed it prefetches
+"""
+class PricePrefetcher:
+    def __init__(self, batch_size: int = PREFETCH_BATCH_SIZE, concurrency: int = PREFETCH_CONCURRENCY,
+                 rate_per_minute: float = PREFETCH_RATE_LIMIT, delay: float = PREFETCH_DELAY):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(rate_per_minute)
+        self.delay = delay
+        self.task: Optional[asyncio.Task] = None
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    """
+    Every distinct held or drafted ticker, read in pages from prefetch_tickers
+    """
+    async def load_tickers(self) -> List[str]:
+        tickers = []
+        async with async_client_pool.acquire() as db_client:
+            while True:
+                response = await db_client.rpc("prefetch_tickers", {}).order("ticker").range(len(tickers), len(tickers) + TICKER_PAGE_SIZE - 1).execute()
+                rows = response.data or []
+                tickers.extend(row["ticker"] for row in rows)
+                if len(rows) < TICKER_PAGE_SIZE:
+                    return tickers
+
+    async def claim(self, now: datetime) -> bool:
+        async with async_client_pool.acquire() as db_client:
+            response = await db_client.rpc("claim_prefetch", {"p_chunk": process_time(now).isoformat(), "p_owner": WORKER_ID}).execute()
+        return response.data is True
+
+    async def fetch_batch(self, batch: List[str], now: datetime, semaphore: asyncio.Semaphore) -> List[str]:
+        async with semaphore:
+            await self.rate_limiter.wait()
+            try:
+                await fetch_prices_async(batch, now)
+                return []
+            except Exception as e:
+                logger.warning("Prefetch failed for %s: %s", batch, e)
+                return batch
+
+    """
+    Prefetches the chunk containing now for every tracked ticker
+    """
+    async def run_once(self, now: datetime) -> Dict[str, Any]:
+        started = time.perf_counter()
+        tickers = await self.load_tickers()
+        batches = [tickers[i:i + self.batch_size] for i in range(0, len(tickers), self.batch_size)]
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        failed = await asyncio.gather(*[self.fetch_batch(batch, now, semaphore) for batch in batches])
+
+        self.last_run = {
+            "ts": now.isoformat(),
+            "tickers": len(tickers),
+            "batches": len(batches),
+            "failedBatches": [batch for batch in failed if batch],
+            "seconds": time.perf_counter() - started,
+        }
+        return self.last_run
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(seconds_until_next_chunk(datetime.now(tz.utc), self.delay))
+
+            now = datetime.now(tz.utc)
+            if not market_calendar.has_session_between(now - timedelta(minutes=TIME_CHUNK_SIZE), now):
+                continue
+
+            try:
+                if await self.claim(now):
+                    await self.run_once(now)
+            except Exception:
+                logger.exception("Prefetch run failed")
+
+    def start(self):
+        if PREFETCH_ENABLED and self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+prefetcher = PricePrefetcher()
@@ -0,0 +1,84 @@
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+from dotenv import load_dotenv
+import asyncio
+import logging
+import os
+
+from time_utils import get_now_iso
+
+load_dotenv()
+
+PRESENCE_DEBOUNCE = float(os.getenv("PRESENCE_DEBOUNCE", "0.25")) # seconds presence changes of a room are collected before they are sent
+
+Publish = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+logger = logging.getLogger(__name__)
+
+"""
+Collects the presence.join and presence.leave events of each room for a short window, then publishes what changed
+in one message: the single event when only one user changed, otherwise a presence.batch frame {'type', 'events', 'ts'}.
+A user who leaves and joins again (or joins and leaves) within the window cancels out and is not announced at all
+"""
+class PresenceDebouncer:
+    def __init__(self, publish: Publish, window: float = PRESENCE_DEBOUNCE):
+        self.publish = publish
+        self.window = window
+        self.pending: Dict[str, Dict[str, Tuple[str, Dict[str, Any]]]] = {} # {room -> {user_id -> (first event type, last event)}}
+        self.timers: Dict[str, asyncio.Task] = {}
+        self.noted = 0
+        self.cancelled = 0
+        self.sent = 0
+
+    """
+    Records a presence.join or presence.leave of user_id and schedules the room's next publish
+    """
+    def note(self, room: str, event_type: str, user_id: str):
+        event = {"type": event_type, "userId": user_id, "ts": get_now_iso()}
+        self.noted += 1
+        users = self.pending.setdefault(room, {})
+        first = users[user_id][0] if user_id in users else event_type
+        users[user_id] = (first, event)
+        if room not in self.timers:
+            self.timers[room] = asyncio.create_task(self.flush_later(room))
+
+    """
+    The events of a room's window that changed someone's presence. A user whose last event matches the first one
+    changed, otherwise the events cancel out
+    """
+    def take(self, room: str) -> List[Dict[str, Any]]:
+        events = []
+        for first, event in self.pending.pop(room, {}).values():
+            if event["type"] == first:
+                events.append(event)
+            else:
+                self.cancelled += 1
+        return events
+
+    async def flush(self, room: str):
+        events = self.take(room)
+        if not events:
+            return
+
+        self.sent += 1
+        if len(events) == 1:
+            await self.publish(room, events[0])
+        else:
+            await self.publish(room, {"type": "presence.batch", "events": events, "ts": get_now_iso()})
+
+    async def flush_later(self, room: str):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            self.timers.pop(room, None)
+        try:
+            await self.flush(room)
+        except Exception:
+            logger.exception("Could not flush the presence events of %s", room)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rooms_pending": len(self.pending),
+            "events": self.noted,
+            "cancelled": self.cancelled,
+            "messages": self.sent,
+        }
@@ -0,0 +1,82 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone as tz
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+import threading
+import time
+import os
+
+load_dotenv()
+
+TIME_CHUNK_SIZE = int(os.getenv("TIME_CHUNK_SIZE"))
+PRICE_CACHE_SIZE = int(os.getenv("PRICE_CACHE_SIZE", "10000"))
+PRICE_CACHE_TTL = float(os.getenv("PRICE_CACHE_TTL", "60"))
+
+"""
+In-process LRU cache of price rows keyed by (ticker, processed time chunk point).
+Rows for closed chunks never expire (they can only be evicted by the size limit).
+Rows for the chunk that is still open expire after ttl seconds.
+"""
+class PriceCache:
+    def __init__(self, max_size: int = PRICE_CACHE_SIZE, ttl: float = PRICE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict[Tuple[str, datetime], Tuple[dict, Optional[float]]] = OrderedDict() # {key -> (row, expiry)}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    """
+    A chunk is closed once the next chunk point has been reached, after that its price can no longer change
+    """
+    def is_closed(self, chunk: datetime) -> bool:
+        return chunk + timedelta(minutes=TIME_CHUNK_SIZE) <= datetime.now(tz.utc)
+
+    """
+    Returns a copy of the cached row or None on a miss
+    """
+    def get(self, ticker: str, chunk: datetime) -> Optional[dict]:
+        key = (ticker, chunk)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                row, expiry = entry
+                if expiry is None or expiry > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(row)
+                del self.entries[key]
+
+            self.misses += 1
+            return None
+
+    def put(self, ticker: str, chunk: datetime, row: dict):
+        if self.max_size <= 0:
+            return
+
+        key = (ticker, chunk)
+        expiry = None if self.is_closed(chunk) else time.monotonic() + self.ttl
+        with self.lock:
+            self.entries[key] = (dict(row), expiry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+price_cache = PriceCache()
@@ -0,0 +1,237 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from datetime import datetime, timedelta, timezone as tz
+import os
+
+from websocket import ConnectionManager
+from pubsub import InMemoryPubSub
+from market_calendar import market_calendar
+from stocks import fetch_prices_async, fetch_price_async
+from bar_store import SYMBOL_PATTERN
+from time_utils import seconds_until_next_chunk, process_time
+
+load_dotenv()
+
+TIME_CHUNK_SIZE = int(os.getenv("TIME_CHUNK_SIZE"))
+PRICE_STREAM_DELAY = float(os.getenv("PRICE_STREAM_DELAY", "10")) # seconds after a chunk boundary before the new bars are pushed
+PRICE_STREAM_MAX_TICKERS = int(os.getenv("PRICE_STREAM_MAX_TICKERS", "50")) # subscriptions one socket may hold
+PRICE_STREAM_FAILED_TTL = float(os.getenv("PRICE_STREAM_FAILED_TTL", "3600")) # seconds a ticker that could not be priced is not tried again
+
+router = APIRouter(prefix="/prices", tags=["prices"])
+
+logger = logging.getLogger(__name__)
+
+"""
+ConnectionManager where every room is a ticker and every member is one subscribed socket, so a bar is fanned out
+to all of a ticker's subscribers with a single broadcast. A socket that falls behind loses its oldest updates,
+which newer bars supersede anyway, instead of being disconnected.
+Every worker prices the tickers its own sockets subscribe to, so updates stay on a worker-local pubsub
+"""
+class TickerConnectionManager(ConnectionManager):
+    async def subscribe(self, websocket: WebSocket, ticker: str, connection_id: str):
+        lock = await self.get_lock(ticker)
+        async with lock:
+            if ticker not in self.rooms:
+                await self.join_room(ticker)
+            self.rooms.setdefault(ticker, {})[connection_id] = websocket
+            self.attach(websocket, ticker, connection_id)
+            self.room_users.setdefault(ticker, [])
+            self.room_info.setdefault(ticker, {})
+
+    async def unsubscribe(self, ticker: str, connection_id: str):
+        await self.disconnect(ticker, connection_id)
+
+    async def subscribed_tickers(self) -> List[str]:
+        async with self.lock_access:
+            return list(self.rooms.keys())
+
+"""
+Computes each subscribed ticker's bar once per TIME_CHUNK_SIZE chunk and pushes it to every subscriber
+"""
+class PriceStream:
+    def __init__(self, delay: float = PRICE_STREAM_DELAY, failed_ttl: float = PRICE_STREAM_FAILED_TTL):
+        self.manager = TickerConnectionManager("prices", InMemoryPubSub(), slow_consumer_policy="drop_oldest")
+        self.latest: Dict[str, Dict] = {} # {ticker -> last update sent}
+        self.failed: Dict[str, float] = {} # {ticker -> monotonic time until which it is not priced again}
+        self.delay = delay
+        self.failed_ttl = failed_ttl
+        self.task: Optional[asyncio.Task] = None
+
+    def is_failed(self, ticker: str) -> bool:
+        until = self.failed.get(ticker)
+        if until is not None and until <= time.monotonic():
+            self.failed.pop(ticker, None)
+            return False
+        return until is not None
+
+    def to_update(self, row: Dict) -> Dict:
+        return {
+            "type": "price.update",
+            "ticker": row["symbol"],
+            "ts": row["timestamp"],
+            "price": row["vwap"],
+            "close": row["close"],
+        }
+
+    """
+    Fetches the bars for the chunk containing now with one batched lookup. If some ticker fails the others are still
+    priced one by one, and the ones that failed again are skipped for failed_ttl seconds. When nothing could be priced
+    the database or Alpaca is more likely down than every ticker unknown, so nothing is remembered
+    """
+    async def fetch_rows(self, tickers: List[str], now: datetime) -> Dict[str, Dict]:
+        tickers = [ticker for ticker in tickers if not self.is_failed(ticker)]
+        if not tickers:
+            return {}
+        try:
+            return await fetch_prices_async(tickers, now)
+        except Exception:
+            if len(tickers) == 1:
+                return {}
+            rows = await asyncio.gather(*[fetch_price_async(ticker, now) for ticker in tickers], return_exceptions=True)
+            priced = {ticker: row for ticker, row in zip(tickers, rows) if not isinstance(row, Exception)}
+            if priced:
+                for ticker in tickers:
+                    if ticker not in priced:
+                        logger.warning("Could not price %s, skipping it for %.0fs", ticker, self.failed_ttl)
+                        self.failed[ticker] = time.monotonic() + self.failed_ttl
+            return priced
+
+    """
+    Pushes the bars of the chunk containing now, skipping tickers whose bar has already been sent
+    """
+    async def publish(self, now: datetime):
+        tickers = await self.manager.subscribed_tickers()
+        if not tickers:
+            return
+
+        rows = await self.fetch_rows(tickers, now)
+        for ticker, row in rows.items():
+            previous = self.latest.get(ticker)
+            if previous is not None and previous["ts"] == row["timestamp"]:
+                continue
+
+            update = self.to_update(row)
+            self.latest[ticker] = update
+            await self.manager.broadcast_json(ticker, update)
+
+    """
+    Sends the newest bar of the given tickers to one socket, fetching the ones without an up to date bar.
+    Returns the tickers that have no bar at all
+    """
+    async def send_snapshot(self, websocket: WebSocket, tickers: List[str]) -> List[str]:
+        now = datetime.now(tz.utc)
+        current = process_time(now).isoformat()
+        missing = [ticker for ticker in tickers if ticker not in self.latest or self.latest[ticker]["ts"] != current]
+        if missing:
+            for ticker, row in (await self.fetch_rows(missing, now)).items():
+                self.latest[ticker] = self.to_update(row)
+
+        for ticker in tickers:
+            if ticker in self.latest:
+                await self.manager.send_json(websocket, self.latest[ticker])
+        return [ticker for ticker in tickers if ticker not in self.latest]
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(seconds_until_next_chunk(datetime.now(tz.utc), self.delay))
+
+            now = datetime.now(tz.utc)
+            if not market_calendar.has_session_between(now - timedelta(minutes=TIME_CHUNK_SIZE), now):
+                continue
+
+            try:
+                await self.publish(now)
+            except Exception:
+                logger.exception("Price stream publish failed")
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+price_stream = PriceStream()
+
+"""
+Returns the upper cased tickers of a subscribe or unsubscribe message, or None if it is not an object whose 'tickers' is a list of strings
+"""
+def parse_tickers(data) -> Optional[List[str]]:
+    if not isinstance(data, dict):
+        return None
+    tickers = data.get("tickers", [])
+    if not isinstance(tickers, list) or not all(isinstance(ticker, str) for ticker in tickers):
+        return None
+    return [ticker.upper() for ticker in tickers]
+
+"""
+This websocket streams prices. It sends json information of the following types:
+1. price.update - {'type', 'ticker', 'ts', 'price', 'close'}, once per new TIME_CHUNK_SIZE bar of each subscribed ticker
+2. error - {'type', 'message'}, for a message that is not valid json or not one of the types below, and
+   {'type', 'message', 'tickers'} for subscribed tickers that were dropped: invalid symbols, ones past
+   PRICE_STREAM_MAX_TICKERS subscriptions and ones that could not be priced
+
+recieves json of the following types:
+1. {'type': 'subscribe', 'tickers': [...]} - the latest bar of each ticker is sent right away
+2. {'type': 'unsubscribe', 'tickers': [...]}
+"""
+@router.websocket("/ws")
+async def prices_websocket(websocket: WebSocket):
+    await websocket.accept()
+    connection_id = uuid.uuid4().hex
+    subscribed = set()
+
+    try:
+        while True:
+            text = await websocket.receive_text()
+            try:
+                data = json.loads(text)
+            except ValueError:
+                data = None
+            tickers = parse_tickers(data)
+            if tickers is None or data.get("type") not in ("subscribe", "unsubscribe"):
+                await price_stream.manager.send_json(websocket, {"type": "error", "message": "Expected {'type': 'subscribe' or 'unsubscribe', 'tickers': [ticker, ...]}."})
+                continue
+
+            if data["type"] == "subscribe":
+                new_tickers = [ticker for ticker in dict.fromkeys(tickers) if ticker not in subscribed]
+                invalid = [ticker for ticker in new_tickers if not SYMBOL_PATTERN.fullmatch(ticker)]
+                new_tickers = [ticker for ticker in new_tickers if ticker not in invalid]
+                over_limit = new_tickers[max(0, PRICE_STREAM_MAX_TICKERS - len(subscribed)):]
+                new_tickers = [ticker for ticker in new_tickers if ticker not in over_limit]
+
+                for ticker in new_tickers:
+                    await price_stream.manager.subscribe(websocket, ticker, connection_id)
+                    subscribed.add(ticker)
+                unpriced = await price_stream.send_snapshot(websocket, new_tickers)
+                for ticker in unpriced:
+                    await price_stream.manager.unsubscribe(ticker, connection_id)
+                    subscribed.discard(ticker)
+
+                for message, dropped in (("Invalid tickers", invalid), (f"More than {PRICE_STREAM_MAX_TICKERS} subscriptions", over_limit), ("No price found for", unpriced)):
+                    if dropped:
+                        await price_stream.manager.send_json(websocket, {"type": "error", "message": f"{message}: {', '.join(dropped)}.", "tickers": dropped})
+
+            else:
+                for ticker in tickers:
+                    if ticker in subscribed:
+                        await price_stream.manager.unsubscribe(ticker, connection_id)
+                        subscribed.discard(ticker)
+
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for ticker in subscribed:
+            await price_stream.manager.unsubscribe(ticker, connection_id)
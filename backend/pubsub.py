@@ -0,0 +1,178 @@
+from typing import Any, Awaitable, Callable, Dict, List, Set
+from dotenv import load_dotenv
+import asyncio
+import logging
+import uuid
+import os
+
+from database import get_async_client
+
+load_dotenv()
+
+PUBSUB_BACKEND = os.getenv("PUBSUB_BACKEND", "memory") # "memory" for a single worker, "supabase" to fan out across workers and nodes
+WORKER_ID = uuid.uuid4().hex # identifies this process in messages shared with other workers
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+logger = logging.getLogger(__name__)
+
+"""
+Topic based publish/subscribe between the parts of one worker. publish hands a json-able message to every handler
+subscribed to the topic in this process. This is the default backend when only one worker runs
+"""
+class InMemoryPubSub:
+    shared = False # whether other workers see the messages
+
+    def __init__(self, origin: str = WORKER_ID):
+        self.origin = origin
+        self.handlers: Dict[str, List[Handler]] = {} # {topic -> [handler]}
+
+    async def subscribe(self, topic: str, handler: Handler):
+        self.handlers.setdefault(topic, []).append(handler)
+
+    async def unsubscribe(self, topic: str, handler: Handler):
+        handlers = self.handlers.get(topic, [])
+        if handler in handlers:
+            handlers.remove(handler)
+        if not handlers:
+            self.handlers.pop(topic, None)
+
+    async def deliver(self, topic: str, message: Dict[str, Any]):
+        for handler in list(self.handlers.get(topic, [])):
+            try:
+                await handler(message)
+            except Exception:
+                logger.exception("Pubsub handler failed on %s", topic)
+
+    async def publish(self, topic: str, message: Dict[str, Any]):
+        await self.deliver(topic, message)
+
+    async def close(self):
+        self.handlers.clear()
+
+"""
+InMemoryPubSub that also relays every message through an out-of-process broker, so handlers in every worker receive it.
+Local handlers are called directly and messages coming back from the broker with this worker's origin are ignored.
+The broker needs async join(topic, callback), leave(topic) and send(topic, data); callback(data) is called for
+every message other workers send on a joined topic
+"""
+class BrokerPubSub(InMemoryPubSub):
+    shared = True
+
+    def __init__(self, broker, origin: str = WORKER_ID):
+        super().__init__(origin)
+        self.broker = broker
+
+    async def subscribe(self, topic: str, handler: Handler):
+        joined = topic in self.handlers
+        await super().subscribe(topic, handler)
+        if not joined:
+            await self.broker.join(topic, lambda data: self.receive(topic, data))
+
+    async def unsubscribe(self, topic: str, handler: Handler):
+        await super().unsubscribe(topic, handler)
+        if topic not in self.handlers:
+            await self.broker.leave(topic)
+
+    async def receive(self, topic: str, data: Dict[str, Any]):
+        if data.get("origin") != self.origin:
+            await self.deliver(topic, data["message"])
+
+    async def publish(self, topic: str, message: Dict[str, Any]):
+        await self.deliver(topic, message)
+        try:
+            await self.broker.send(topic, {"origin": self.origin, "message": message})
+        except Exception:
+            logger.exception("Could not publish to the broker on %s", topic)
+
+    async def close(self):
+        await super().close()
+        await self.broker.close()
+
+"""
+Broker over Supabase Realtime broadcast channels, one channel per topic on a dedicated async client
+"""
+class SupabaseBroker:
+    EVENT = "message"
+
+    def __init__(self):
+        self.client = None
+        self.channels: Dict[str, Any] = {} # {topic -> joined realtime channel}
+        self.send_channels: Dict[str, Any] = {} # {topic -> channel used only for sending}
+        self.lock = asyncio.Lock()
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def get_client(self):
+        async with self.lock:
+            if self.client is None:
+                self.client = await get_async_client()
+            return self.client
+
+    def dispatch(self, callback: Callable[[Dict[str, Any]], Awaitable[None]], payload: Dict[str, Any]):
+        task = asyncio.create_task(callback(payload["payload"]))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def join(self, topic: str, callback: Callable[[Dict[str, Any]], Awaitable[None]]):
+        client = await self.get_client()
+        channel = client.channel(topic)
+        channel.on_broadcast(self.EVENT, lambda payload: self.dispatch(callback, payload))
+        await channel.subscribe()
+        self.channels[topic] = channel
+
+    async def leave(self, topic: str):
+        channel = self.channels.pop(topic, None)
+        if channel is not None:
+            await self.client.remove_channel(channel)
+
+    async def send(self, topic: str, data: Dict[str, Any]):
+        channel = self.channels.get(topic) or self.send_channels.get(topic)
+        if channel is None: # Realtime only sends through a joined channel, even without listening on it
+            client = await self.get_client()
+            channel = await client.channel(topic).subscribe()
+            self.send_channels[topic] = channel
+        await channel.send_broadcast(self.EVENT, data)
+
+    async def close(self):
+        for topic in list(self.channels):
+            await self.leave(topic)
+        for channel in self.send_channels.values():
+            await self.client.remove_channel(channel)
+        self.send_channels.clear()
+
+"""
+In-process stand-in for an out-of-process broker. Every BrokerPubSub sharing one LocalBroker behaves like a separate worker
+connected to the same broker (give each its own origin), which is how multi-worker behaviour can be exercised in a single process
+"""
+class LocalBroker:
+    def __init__(self):
+        self.callbacks: Dict[str, Dict[int, Callable[[Dict[str, Any]], Awaitable[None]]]] = {} # {topic -> {connection -> callback}}
+
+    def connect(self) -> "LocalBrokerConnection":
+        return LocalBrokerConnection(self)
+
+class LocalBrokerConnection:
+    def __init__(self, broker: LocalBroker):
+        self.broker = broker
+
+    async def join(self, topic: str, callback: Callable[[Dict[str, Any]], Awaitable[None]]):
+        self.broker.callbacks.setdefault(topic, {})[id(self)] = callback
+
+    async def leave(self, topic: str):
+        self.broker.callbacks.get(topic, {}).pop(id(self), None)
+
+    async def send(self, topic: str, data: Dict[str, Any]):
+        for key, callback in list(self.broker.callbacks.get(topic, {}).items()):
+            if key != id(self):
+                await callback(data)
+
+    async def close(self):
+        for callbacks in self.broker.callbacks.values():
+            callbacks.pop(id(self), None)
+
+def create_pubsub(backend: str = PUBSUB_BACKEND) -> InMemoryPubSub:
+    if backend == "supabase":
+        return BrokerPubSub(SupabaseBroker())
+    return InMemoryPubSub()
+
+pubsub = create_pubsub()
@@ -0,0 +1,225 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+from dotenv import load_dotenv
+import argparse
+import json
+import time
+import os
+
+import numpy as np
+import pandas as pd
+
+load_dotenv()
+
+from database import client_pool, retrieve_stocks_at_times
+from stocks import fetch_prices, retrieve_local, store_locally
+from time_utils import process_time
+from standings import standings
+
+STARTING_BALANCE = float(os.getenv("STARTING_BALANCE", "10000")) # every portfolio's total before week 1
+SCORE_TOLERANCE = 1e-9
+
+"""
+End of the given matchup week for a league whose matchups were created at created_date
+"""
+def get_week_end(created_date: str, week: int) -> datetime:
+    return datetime.fromisoformat(created_date) + timedelta(days=7 * week)
+
+"""
+Loads every matchup of a league with one query. Only weeks that have already ended are kept
+"""
+def load_league_matchups(client, league_id) -> pd.DataFrame:
+    matchups = pd.DataFrame(client.table("matchups").select("*").eq("league_id", league_id).order("week").execute().data or [])
+    if matchups.empty:
+        raise ValueError(f"No matchups found for league {league_id}.")
+
+    week_ends = [get_week_end(created, week) for created, week in zip(matchups["created_date"], matchups["week"])]
+    return matchups[[week_end.date() <= datetime.today().date() for week_end in week_ends]].reset_index(drop=True)
+
+"""
+Gets the vwap of every ticker at every time chunk point, trying the local bar store, then one bulk database read,
+and only then fetch_prices (which downloads from Alpaca) for anything still missing.
+Returns a (points x tickers) dataframe
+"""
+def load_week_end_prices(client, tickers: List[str], points: List[datetime]) -> pd.DataFrame:
+    prices = pd.DataFrame(np.nan, index=pd.Index(points), columns=pd.Index(tickers), dtype=float)
+    if not tickers:
+        return prices
+
+    for point in points:
+        for ticker, row in retrieve_local(tickers, point).items():
+            prices.at[point, ticker] = row["vwap"]
+
+    missing_points = [point for point in points if prices.loc[point].isna().any()]
+    if missing_points:
+        stored = retrieve_stocks_at_times(client, tickers, missing_points)
+        if not stored.empty:
+            store_locally(stored)
+            for ticker, point, vwap in zip(stored["symbol"], stored["timestamp"], stored["vwap"]):
+                prices.at[point.to_pydatetime(), ticker] = vwap
+
+    for point in points:
+        missing = prices.columns[prices.loc[point].isna()].tolist()
+        if missing:
+            for ticker, row in fetch_prices(missing, point, client).items():
+                prices.at[point, ticker] = row["vwap"]
+
+    return prices
+
+"""
+Recomputes every matchup of league_id with start_week <= week <= end_week from stored bars, entirely in memory, and compares
+the result with what is stored. Each member's score is their total at the end of the week over their total at the end of the
+previous week (STARTING_BALANCE before week 1). Past holdings are not kept, so totals use the members' current cash
+balance and holdings. weekly_score_calc scores a week when it ends, against that week's holdings, so a replayed week
+differs from its stored result as soon as a member traded after it, and such diffs do not mean the stored score is wrong.
+For that reason only the league's latest finished week can be written: unless dry_run is set, start_week and end_week
+must both be that week, the matchups that changed are written back with one upsert, the start_of_week_total of members
+whose latest scored week it is is set with one call, and the league's standings are rebuilt if any matchup changed.
+Returns a summary with the changed matchups and portfolios
+"""
+def replay_league(league_id, start_week: int, end_week: int, dry_run: bool = True) -> Dict[str, Any]:
+    started = time.perf_counter()
+    with client_pool.acquire() as client:
+        league_matchups = load_league_matchups(client, league_id)
+        matchups = league_matchups[league_matchups["week"].between(start_week, end_week)].reset_index(drop=True)
+        if matchups.empty:
+            raise ValueError(f"League {league_id} has no finished matchups between weeks {start_week} and {end_week}.")
+        latest_finished = int(league_matchups["week"].max())
+        if not dry_run and start_week < latest_finished:
+            raise ValueError(f"Only the latest finished week ({latest_finished}) can be written; earlier weeks were scored "
+                             f"with holdings that are no longer known.")
+
+        member_ids = list(pd.unique(matchups[["user1_id", "user2_id"]].to_numpy().ravel()))
+        portfolios = pd.DataFrame(
+            client.table("portfolios").select("league_member_id", "current_balance", "start_of_week_total").in_("league_member_id", member_ids).execute().data or [],
+            columns=["league_member_id", "current_balance", "start_of_week_total"]
+        )
+        holdings = pd.DataFrame(
+            client.table("holdings").select("league_member_id", "ticker", "stock_amount").in_("league_member_id", member_ids).execute().data or [],
+            columns=["league_member_id", "ticker", "stock_amount"]
+        )
+        missing = set(member_ids) - set(portfolios.get("league_member_id", []))
+        if missing:
+            raise ValueError(f"No portfolio found for league members {sorted(missing)}.")
+        portfolios = portfolios.set_index("league_member_id", drop=False).loc[member_ids]
+
+        # Every week end a replayed matchup needs, including the end of the week before each one
+        weeks = np.concatenate([matchups["week"].to_numpy(), matchups["week"].to_numpy() - 1])
+        created = np.concatenate([matchups["created_date"].to_numpy(), matchups["created_date"].to_numpy()])
+        ends = pd.DataFrame({"created_date": created, "week": weeks}).drop_duplicates()
+        ends = ends[ends["week"] >= 1]
+        ends["point"] = [process_time(get_week_end(c, w)) for c, w in zip(ends["created_date"], ends["week"])]
+        points = list(dict.fromkeys(ends["point"]))
+
+        amounts = holdings.pivot_table(index="league_member_id", columns="ticker", values="stock_amount", aggfunc="sum", fill_value=0)
+        amounts = amounts.reindex(index=member_ids, fill_value=0)
+        prices = load_week_end_prices(client, amounts.columns.tolist(), points)
+
+    # (members x points) portfolio totals with a single matrix product
+    totals = portfolios["current_balance"].to_numpy(dtype=float)[:, None] + amounts.to_numpy(dtype=float) @ prices.to_numpy().T
+    member_pos = {member: i for i, member in enumerate(member_ids)}
+    point_pos = {(c, w): points.index(p) for c, w, p in zip(ends["created_date"], ends["week"], ends["point"])}
+
+    def totals_at(members: pd.Series, created: pd.Series, weeks: pd.Series) -> np.ndarray:
+        rows = members.map(member_pos).to_numpy()
+        values = np.full(len(rows), STARTING_BALANCE)
+        later = (weeks >= 1).to_numpy()
+        cols = np.array([point_pos[(c, w)] for c, w in zip(created[later], weeks[later])], dtype=int)
+        values[later] = totals[rows[later], cols]
+        return values
+
+    scores = {}
+    for side in (1, 2):
+        members = matchups[f"user{side}_id"]
+        end_totals = totals_at(members, matchups["created_date"], matchups["week"])
+        start_totals = totals_at(members, matchups["created_date"], matchups["week"] - 1)
+        scores[side] = end_totals / start_totals
+        matchups[f"total{side}"] = end_totals
+
+    replayed = matchups.assign(
+        u1_score=scores[1],
+        u2_score=scores[2],
+        winner_id=np.where(scores[1] > scores[2], matchups["user1_id"], matchups["user2_id"]),
+    )
+
+    stored_u1 = pd.to_numeric(matchups["u1_score"], errors="coerce").to_numpy(dtype=float)
+    stored_u2 = pd.to_numeric(matchups["u2_score"], errors="coerce").to_numpy(dtype=float)
+    changed = (
+        (replayed["winner_id"].to_numpy() != matchups["winner_id"].to_numpy())
+        | ~np.isclose(stored_u1, scores[1], rtol=0, atol=SCORE_TOLERANCE)
+        | ~np.isclose(stored_u2, scores[2], rtol=0, atol=SCORE_TOLERANCE)
+    )
+    matchup_diffs = [
+        {
+            "matchupId": new["id"],
+            "week": int(new["week"]),
+            "winnerId": [old["winner_id"], new["winner_id"]],
+            "u1Score": [old["u1_score"], float(new["u1_score"])],
+            "u2Score": [old["u2_score"], float(new["u2_score"])],
+        }
+        for (_, old), (_, new) in zip(matchups[changed].iterrows(), replayed[changed].iterrows())
+    ]
+
+    # start_of_week_total is the total at the end of each member's latest scored week, if that week was replayed
+    sides = pd.concat([
+        replayed[[f"user{side}_id", "week", f"total{side}"]].set_axis(["league_member_id", "week", "total"], axis=1)
+        for side in (1, 2)
+    ])
+    scored = league_matchups[league_matchups["winner_id"].notna()]
+    latest_week = pd.concat([scored[["user1_id", "week"]].set_axis(["league_member_id", "week"], axis=1),
+                             scored[["user2_id", "week"]].set_axis(["league_member_id", "week"], axis=1)]).groupby("league_member_id")["week"].max()
+    final = sides.sort_values("week").groupby("league_member_id").last()
+    final = final[final["week"] >= final.index.map(latest_week).fillna(0)]
+    stored_start = pd.to_numeric(portfolios.loc[final.index, "start_of_week_total"], errors="coerce").to_numpy(dtype=float)
+    portfolio_changed = ~np.isclose(stored_start, final["total"].to_numpy(), rtol=0, atol=SCORE_TOLERANCE)
+    portfolio_diffs = [
+        {"leagueMemberId": member, "startOfWeekTotal": [old, float(new)]}
+        for member, old, new in zip(final.index[portfolio_changed], stored_start[portfolio_changed], final["total"][portfolio_changed])
+    ]
+
+    if not dry_run and (matchup_diffs or portfolio_diffs):
+        with client_pool.acquire() as client:
+            if matchup_diffs:
+                matchup_rows = replayed.loc[changed, league_matchups.columns]
+                client.table("matchups").upsert(
+                    matchup_rows.astype(object).where(matchup_rows.notna(), None).to_dict(orient="records"),
+                    on_conflict="id"
+                ).execute()
+
+            if portfolio_diffs:
+                members = final.index[portfolio_changed]
+                client.rpc("set_start_of_week_totals", {"p_totals": [
+                    {"league_member_id": member, "start_of_week_total": float(total)}
+                    for member, total in zip(members, final.loc[members, "total"])
+                ]}).execute()
+
+            if matchup_diffs:
+                standings.rebuild(client, league_id)
+
+    return {
+        "leagueId": league_id,
+        "weeks": [start_week, end_week],
+        "matchups": len(matchups),
+        "changedMatchups": matchup_diffs,
+        "changedPortfolios": portfolio_diffs,
+        "dryRun": dry_run,
+        "seconds": time.perf_counter() - started,
+    }
+
+"""
+Rescores past weeks of a league. Run from backend/: python replay.py <league_id> --start-week 1 --end-week 10
+Add --write with --start-week set to the latest finished week to write its results back
+"""
+def main():
+    parser = argparse.ArgumentParser(description="Replay matchup scoring for a league and diff it against the stored results.")
+    parser.add_argument("league_id")
+    parser.add_argument("--start-week", type=int, default=1)
+    parser.add_argument("--end-week", type=int, required=True)
+    parser.add_argument("--write", action="store_true", help="write changed matchups and portfolios instead of a dry run (latest finished week only)")
+    args = parser.parse_args()
+
+    summary = replay_league(args.league_id, args.start_week, args.end_week, dry_run=not args.write)
+    print(json.dumps(summary, indent=2, default=str))
+
+if __name__ == "__main__":
+    main()
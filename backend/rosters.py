@@ -0,0 +1,157 @@
+from typing import Any, Dict, List, Tuple
+from pydantic import BaseModel
+from postgrest.exceptions import APIError
+import asyncio
+import logging
+
+from database import async_client_pool
+from pubsub import InMemoryPubSub, pubsub as default_pubsub
+
+INVALIDATION_TOPIC = "rosters.invalidate"
+UNIQUE_VIOLATION = "23505"
+
+logger = logging.getLogger(__name__)
+
+class RosterOperation(BaseModel):
+    op: str # "add", "drop" or "has"
+    ticker: str
+
+class RosterBatch(BaseModel):
+    league_member_id: str
+    league_id: str
+    operations: List[RosterOperation]
+
+"""
+Index of the tradable stocks of every loaded league, {league_id -> {ticker -> league_member_id}}, built from user_stocks.
+Batches of add/drop/has operations are checked against it while holding the league's lock and written in one transaction
+by the apply_roster_batch function. The unique (league_id, "Ticker") constraint settles races with other workers, whose
+index can be stale until their invalidation arrives: a conflicting batch changes nothing, the index is reloaded and the
+batch checked again. Other workers drop their copy of a league after each write
+"""
+class RosterIndex:
+    def __init__(self, pubsub: InMemoryPubSub = default_pubsub):
+        self.pubsub = pubsub
+        self.owners: Dict[str, Dict[str, str]] = {}
+        self.locks: Dict[str, asyncio.Lock] = {}
+
+    async def query(self, league_id: str) -> Dict[str, str]:
+        async with async_client_pool.acquire() as db_client:
+            response = await db_client.table("user_stocks").select("Ticker", "league_member_id").eq("league_id", league_id).execute()
+        return {row["Ticker"]: row["league_member_id"] for row in response.data or []}
+
+    def get_lock(self, league_id: str) -> asyncio.Lock:
+        lock = self.locks.get(league_id)
+        if lock is None:
+            lock = self.locks[league_id] = asyncio.Lock()
+        return lock
+
+    """
+    The league's {ticker -> league_member_id}. Call while holding the league's lock
+    """
+    async def get_owners(self, league_id: str) -> Dict[str, str]:
+        owners = self.owners.get(league_id)
+        if owners is None:
+            owners = self.owners[league_id] = await self.query(league_id)
+        return owners
+
+    """
+    Checks each operation in order against the roster as changed by the operations before it. Returns a result per operation
+    and the net (added, dropped) tickers of the member
+    """
+    def check(self, owners: Dict[str, str], member_id: str, operations: List[RosterOperation]) -> Tuple[List[Dict[str, Any]], List[str], List[str]]:
+        owned = dict(owners)
+        results = []
+        for operation in operations:
+            owner = owned.get(operation.ticker)
+            result: Dict[str, Any] = {"op": operation.op, "ticker": operation.ticker}
+            if operation.op == "has":
+                result.update(ok=True, has_ticker=owner == member_id)
+            elif operation.op == "add":
+                if owner is None:
+                    owned[operation.ticker] = member_id
+                    result.update(ok=True, message="Stock added successfully.")
+                else:
+                    result.update(ok=False, message="Stock already exists in the league.")
+            elif operation.op == "drop":
+                if owner == member_id:
+                    del owned[operation.ticker]
+                    result.update(ok=True, message="Stock removed successfully.")
+                else:
+                    result.update(ok=False, message="You do not own this stock.")
+            else:
+                result.update(ok=False, message=f"Unknown operation {operation.op}.")
+            results.append(result)
+
+        added = [ticker for ticker, owner in owned.items() if owner == member_id and owners.get(ticker) != member_id]
+        dropped = [ticker for ticker, owner in owners.items() if owner == member_id and ticker not in owned]
+        return results, added, dropped
+
+    """
+    Deletes every dropped ticker and inserts every added one in a single transaction. Returns the inserted rows
+    """
+    async def write(self, batch: RosterBatch, added: List[str], dropped: List[str]) -> List[Dict[str, Any]]:
+        async with async_client_pool.acquire() as db_client:
+            response = await db_client.rpc("apply_roster_batch", {
+                "p_league_id": batch.league_id,
+                "p_league_member_id": batch.league_member_id,
+                "p_added": added,
+                "p_dropped": dropped,
+            }).execute()
+        return response.data or []
+
+    """
+    Checks and applies a batch of operations of one league member. Returns a result per operation, successful adds
+    with the inserted user_stocks row under 'row'
+    """
+    async def apply(self, batch: RosterBatch) -> List[Dict[str, Any]]:
+        async with self.get_lock(batch.league_id):
+            for attempt in range(2):
+                owners = await self.get_owners(batch.league_id)
+                results, added, dropped = self.check(owners, batch.league_member_id, batch.operations)
+                if not added and not dropped:
+                    return results
+
+                try:
+                    rows = await self.write(batch, added, dropped)
+                    break
+                except APIError as e:
+                    self.owners.pop(batch.league_id, None) # another worker added one of the tickers, check against the table again
+                    if e.code != UNIQUE_VIOLATION or attempt:
+                        raise
+                except Exception:
+                    self.owners.pop(batch.league_id, None)
+                    raise
+
+            for ticker in dropped:
+                del owners[ticker]
+            for ticker in added:
+                owners[ticker] = batch.league_member_id
+
+        inserted = {row["Ticker"]: row for row in rows}
+        for result in results:
+            if result["op"] == "add" and result["ok"]:
+                result["row"] = inserted.get(result["ticker"])
+
+        try:
+            await self.pubsub.publish(INVALIDATION_TOPIC, {"origin": self.pubsub.origin, "league_id": batch.league_id})
+        except Exception:
+            logger.exception("Could not publish the roster invalidation of %s", batch.league_id)
+        return results
+
+    async def on_invalidate(self, message: Dict[str, Any]):
+        if message.get("origin") != self.pubsub.origin:
+            self.owners.pop(message["league_id"], None)
+
+    async def start(self):
+        await self.pubsub.subscribe(INVALIDATION_TOPIC, self.on_invalidate)
+
+    async def stop(self):
+        await self.pubsub.unsubscribe(INVALIDATION_TOPIC, self.on_invalidate)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "leagues": len(self.owners),
+            "tickers": sum(len(owners) for owners in self.owners.values()),
+        }
+
+rosters = RosterIndex()
@@ -0,0 +1,171 @@
+from typing import Any, Dict, List, Tuple
+from dotenv import load_dotenv
+import asyncio
+import logging
+import threading
+import time
+import os
+
+from database import client_pool, async_client_pool
+
+load_dotenv()
+
+STANDINGS_TTL = float(os.getenv("STANDINGS_TTL", "60")) # seconds a league's standings are served from memory
+
+logger = logging.getLogger(__name__)
+
+"""
+One league member's row of the league_standings table (league_id, league_member_id, wins, losses, total_score, streak,
+last_week, rank). total_score sums the member's weekly scores, streak counts the latest consecutive wins (positive)
+or losses (negative)
+"""
+def empty_standing(league_id, league_member_id) -> Dict[str, Any]:
+    return {
+        "league_id": league_id,
+        "league_member_id": league_member_id,
+        "wins": 0,
+        "losses": 0,
+        "total_score": 0.0,
+        "streak": 0,
+        "last_week": 0,
+        "rank": None,
+    }
+
+"""
+Adds one scored matchup to the standings of its two members. With only_new, a member whose standing already counts
+the matchup's week (last_week) is left alone, so recording the same results twice changes nothing
+"""
+def apply_result(table: Dict[Any, Dict[str, Any]], matchup: Dict[str, Any], only_new: bool = False):
+    for side in (1, 2):
+        member = matchup[f"user{side}_id"]
+        standing = table.setdefault(member, empty_standing(matchup["league_id"], member))
+        if only_new and matchup["week"] <= standing["last_week"]:
+            continue
+        won = matchup["winner_id"] == member
+        standing["wins" if won else "losses"] += 1
+        standing["total_score"] += float(matchup[f"u{side}_score"] or 0)
+        if won:
+            standing["streak"] = standing["streak"] + 1 if standing["streak"] > 0 else 1
+        else:
+            standing["streak"] = standing["streak"] - 1 if standing["streak"] < 0 else -1
+        standing["last_week"] = max(standing["last_week"], matchup["week"])
+
+"""
+Ranks by wins, then total score
+"""
+def rank(table: Dict[Any, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    rows = sorted(table.values(), key=lambda row: (-row["wins"], -row["total_score"]))
+    for i, row in enumerate(rows):
+        row["rank"] = i + 1
+    return rows
+
+"""
+Standings of every league, materialized in league_standings (supabase/migrations). The matchup jobs record each batch
+of results once it is scored, which only reads and rewrites the members of the leagues involved. Reads are cached for ttl seconds and
+dropped as soon as this worker records a result of the league
+"""
+class Standings:
+    def __init__(self, ttl: float = STANDINGS_TTL):
+        self.ttl = ttl
+        self.entries: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {} # {league_id -> (expiry, ranked rows)}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, client, league_id) -> Dict[Any, Dict[str, Any]]:
+        rows = client.table("league_standings").select("*").eq("league_id", league_id).execute().data or []
+        return {row["league_member_id"]: row for row in rows}
+
+    """
+    Recomputes a league's standings from every scored matchup, for leagues scored before standings existed or
+    whose past results were rewritten (replay.py)
+    """
+    def rebuild(self, client, league_id) -> List[Dict[str, Any]]:
+        matchups = client.table("matchups").select("*").eq("league_id", league_id).order("week").execute().data or []
+        table: Dict[Any, Dict[str, Any]] = {}
+        for matchup in matchups:
+            if matchup.get("winner_id") is not None:
+                apply_result(table, matchup)
+
+        rows = rank(table)
+        if rows:
+            client.table("league_standings").upsert(rows, on_conflict="league_id,league_member_id").execute()
+        self.invalidate(league_id)
+        return rows
+
+    """
+    Adds freshly scored matchups (with winner_id, u1_score and u2_score set) to the standings of their leagues, after
+    the matchups were written. Weeks a member's standing already counts are skipped, so retries are harmless, and a
+    league missing an earlier week (whose recording failed) is rebuilt instead
+    """
+    def record_results(self, client, matchups: List[Dict[str, Any]]):
+        leagues: Dict[Any, List[Dict[str, Any]]] = {}
+        for matchup in matchups:
+            leagues.setdefault(matchup["league_id"], []).append(matchup)
+
+        for league_id, league_matchups in leagues.items():
+            table = self.load(client, league_id)
+            first_week = min(matchup["week"] for matchup in league_matchups)
+            if not table or any(row["last_week"] < first_week - 1 for row in table.values()):
+                # Nothing materialized yet, or an earlier week was never recorded: the matchups just written are part of the full rebuild
+                self.rebuild(client, league_id)
+                continue
+
+            for matchup in sorted(league_matchups, key=lambda m: m["week"]):
+                apply_result(table, matchup, only_new=True)
+            client.table("league_standings").upsert(rank(table), on_conflict="league_id,league_member_id").execute()
+            self.invalidate(league_id)
+
+    """
+    record_results for the matchup jobs: standings can always be rebuilt from the matchups, so a failure is logged
+    and never fails the scoring that already succeeded
+    """
+    def record_scored(self, client, matchups: List[Dict[str, Any]]):
+        if not matchups:
+            return
+        try:
+            self.record_results(client, matchups)
+        except Exception:
+            logger.exception("Could not update the standings of %d scored matchups", len(matchups))
+            for league_id in {matchup["league_id"] for matchup in matchups}:
+                self.invalidate(league_id)
+
+    def rebuild_league(self, league_id) -> List[Dict[str, Any]]:
+        with client_pool.acquire() as client:
+            return self.rebuild(client, league_id)
+
+    """
+    A league's standings ordered by rank
+    """
+    async def get(self, league_id: str) -> List[Dict[str, Any]]:
+        with self.lock:
+            entry = self.entries.get(league_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        async with async_client_pool.acquire() as db_client:
+            response = await db_client.table("league_standings").select("*").eq("league_id", league_id).order("rank").execute()
+        rows = response.data or []
+        if not rows:
+            rows = await asyncio.to_thread(self.rebuild_league, league_id)
+
+        with self.lock:
+            self.entries[league_id] = (time.monotonic() + self.ttl, rows)
+        return rows
+
+    def invalidate(self, league_id):
+        with self.lock:
+            self.entries.pop(str(league_id), None)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "leagues": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+standings = Standings()
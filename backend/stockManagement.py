@@ -1,6 +1,7 @@
 from fastapi import FastAPI
 from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
+import logging
 import os
 from pydantic import BaseModel
 
@@ -12,37 +13,32 @@ API_KEY = os.getenv("ALPACA_API_KEY")
 API_SECRET = os.getenv("ALPACA_API_SECRET")
 
 # Your other imports and constants
-from database import get_client
+from rosters import rosters, RosterBatch, RosterOperation
 
 app = FastAPI()
 
+logger = logging.getLogger(__name__)
+
 class Stock(BaseModel):
     league_member_id: str
     league_id: str
     ticker: str
 
-def add_stock(data: Stock):
-    client = get_client()
-    print("Adding Stock!")
-    existing_stock = client.table("user_stocks").select("*").eq("league_id", data.league_id).eq("Ticker", data.ticker).execute().data
-    
-    if(existing_stock):
-        return JSONResponse(status_code=400, content={"message": "Stock already exists in the league."})
-    response = client.table("user_stocks").insert({
-        "league_id": data.league_id,
-        "Ticker": data.ticker,
-        "league_member_id": data.league_member_id
-    }).execute()
-
-    return {"message": "Stock added successfully.", "data": response.data}
-
-def remove_stock(data: Stock):
-    client = get_client()
-    existing_stock = client.table("user_stocks").select("*").eq("league_member_id", data.league_member_id).eq("Ticker", data.ticker).execute().data
-    
-    if not existing_stock or len(existing_stock) == 0:
-        return JSONResponse(status_code=404, content={"message": "You do not own this stock."})
-    
-    client.table("user_stocks").delete().eq("league_id", data.league_id).eq("Ticker", data.ticker).eq("league_member_id", data.league_member_id).execute()
-
-    return {"message": "Stock removed successfully."}
\ No newline at end of file
+async def apply_one(data: Stock, op: str):
+    batch = RosterBatch(league_member_id=data.league_member_id, league_id=data.league_id, operations=[RosterOperation(op=op, ticker=data.ticker)])
+    return (await rosters.apply(batch))[0]
+
+async def add_stock(data: Stock):
+    logger.debug("Adding %s for %s", data.ticker, data.league_member_id)
+    result = await apply_one(data, "add")
+    if not result["ok"]:
+        return JSONResponse(status_code=400, content={"message": result["message"]})
+
+    return {"message": result["message"], "data": [result["row"]]}
+
+async def remove_stock(data: Stock):
+    result = await apply_one(data, "drop")
+    if not result["ok"]:
+        return JSONResponse(status_code=404, content={"message": result["message"]})
+
+    return {"message": result["message"]}
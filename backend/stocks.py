@@ -1,6 +1,19 @@
 from time_utils import process_time, get_monday_from_processed
-from database import get_client, retrieve_stock, add_entries
+from market_calendar import market_calendar
+from database import (
+    client_pool, async_client_pool, retrieve_stocks_at, retrieve_stocks_at_async, retrieve_latest_stocks,
+    retrieve_latest_stocks_async, add_entries, add_entries_async
+)
+from price_cache import price_cache
+from bar_store import bar_store
+from metrics import span, timed
 from datetime import datetime, timedelta
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+import threading
+import asyncio
+import logging
 from dotenv import load_dotenv
 import os
 
@@ -8,6 +21,7 @@ from alpaca.data.historical import StockHistoricalDataClient
 from alpaca.data.requests import StockBarsRequest
 from alpaca.data.timeframe import TimeFrame
 
+import numpy as np
 import pandas as pd
 
 load_dotenv()
@@ -16,22 +30,75 @@ API_KEY = os.getenv("ALPACA_API_KEY")
 API_SECRET = os.getenv("ALPACA_API_SECRET")
 TIME_CHUNK_SIZE = int(os.getenv("TIME_CHUNK_SIZE"))
 
+logger = logging.getLogger(__name__)
+
+_alpaca_client: Optional[StockHistoricalDataClient] = None
+_in_flight: Dict[Tuple[str, datetime], Future] = {} # {(ticker, chunk) -> pending download}
+_in_flight_lock = threading.Lock()
+_high_water: Dict[str, dict] = {} # {ticker -> latest chunk row this process stored}
+_high_water_lock = threading.Lock()
+
+BAR_COLUMNS = ['symbol', 'timestamp', 'open', 'high', 'low', 'close', 'volume', 'trade_count', 'vwap']
+
 """
-Given a DataFrame with potential gaps in timestamps, returns a dataframe containing only values from time chunk points. 
-Fills forward prices to fill missing values. Index is default. timestamps column is of type pd.Timestamp
+Given stacked bars for several symbols (symbol and timestamp as columns or index levels) with potential gaps in timestamps,
+returns a dataframe containing only values from time chunk points between each symbol's query start and query_end.
+Bars are sorted once on a (symbol, second) key and every chunk point takes the latest bar at or before it with a
+single searchsorted, so no dense 1 minute range is ever built.
+Bars earlier than 30 minutes before a symbol's query start are ignored; if the symbol has a seed (a stored chunk row)
+filling starts from the seed instead. Points before a symbol's first bar are dropped.
+Index is default, rows are ordered by symbol then timestamp. timestamps column is of type pd.Timestamp
 """
-def fill_forward_prices(data: pd.DataFrame, query_start: datetime, query_end: datetime) -> pd.DataFrame:
-    data = data.reset_index().set_index("timestamp")
-    full_range = pd.date_range(start= query_start - timedelta(minutes = 30), end=query_end, freq='1min')
-    data = data.reindex(full_range).ffill()
+@timed("fill_forward")
+def fill_forward_many(bars: pd.DataFrame, query_starts: Dict[str, datetime], query_end: datetime, seeds: Optional[Dict[str, dict]] = None) -> pd.DataFrame:
+    seeds = seeds or {}
+    bars = bars.reset_index().reindex(columns=BAR_COLUMNS)
+    if seeds:
+        bars = pd.concat([pd.DataFrame(list(seeds.values())).reindex(columns=BAR_COLUMNS), bars], ignore_index=True)
+
+    symbols = list(query_starts)
+    codes = bars["symbol"].map({symbol: code for code, symbol in enumerate(symbols)})
+    bars = bars[codes.notna()]
+    codes = codes[codes.notna()].to_numpy(dtype=np.int64)
+    seconds = pd.to_datetime(bars["timestamp"], utc=True).dt.tz_localize(None).to_numpy().astype("datetime64[s]").astype(np.int64)
+
+    lower_bounds = np.array([
+        int((pd.Timestamp(seeds[symbol]["timestamp"]) if symbol in seeds else pd.Timestamp(query_starts[symbol]) - timedelta(minutes = 30)).timestamp())
+        for symbol in symbols
+    ], dtype=np.int64)
+    end = int(pd.Timestamp(query_end).timestamp())
+    keep = (seconds >= lower_bounds[codes]) & (seconds <= end)
+
+    bar_keys = (codes[keep] << 32) | seconds[keep]
+    order = np.argsort(bar_keys, kind="stable")
+    bar_keys = bar_keys[order]
+    bar_values = bars[keep].iloc[order]
 
-    useful_range = pd.date_range(start = query_start, end = query_end, freq = f'{TIME_CHUNK_SIZE}min')
-    data = data.loc[useful_range]
+    step = TIME_CHUNK_SIZE * 60
+    point_seconds = [np.arange(int(pd.Timestamp(query_starts[symbol]).timestamp()), end + 1, step, dtype=np.int64) for symbol in symbols]
+    point_codes = np.repeat(np.arange(len(symbols), dtype=np.int64), [len(points) for points in point_seconds])
+    point_seconds = np.concatenate(point_seconds) if point_seconds else np.array([], dtype=np.int64)
 
-    data = data.reset_index(names="timestamp")
+    positions = np.searchsorted(bar_keys, (point_codes << 32) | point_seconds, side="right") - 1
+    found = positions >= 0
+    found[found] = (bar_keys[positions[found]] >> 32) == point_codes[found]
+
+    data = bar_values.iloc[positions[found]].reset_index(drop=True)
+    data["timestamp"] = pd.to_datetime(point_seconds[found], unit="s", utc=True)
+    data[BAR_COLUMNS[2:]] = data[BAR_COLUMNS[2:]].astype(float)
     data["trade_count"] = data["trade_count"].astype(int)
     return data
 
+"""
+Given a DataFrame with potential gaps in timestamps for a single symbol, returns a dataframe containing only values from time chunk points. 
+Fills forward prices to fill missing values. Index is default. timestamps column is of type pd.Timestamp
+If seed (a stored chunk row) is given, filling starts from it instead of 30 minutes before query_start, and data may be empty
+"""
+def fill_forward_prices(data: pd.DataFrame, query_start: datetime, query_end: datetime, seed: Optional[dict] = None) -> pd.DataFrame:
+    symbol = seed["symbol"] if seed is not None else data.reset_index()["symbol"].iloc[0]
+    seeds = {symbol: seed} if seed is not None else {}
+    return fill_forward_many(data, {symbol: query_start}, query_end, seeds)
+
 """
 Given a dictionary with a timestamp key which has a pd.Timestamp value, converts the value to iso format.
 Returns this dict as well
@@ -40,49 +107,379 @@ def convert_data_to_iso(data: dict) -> dict:
     data['timestamp'] = data['timestamp'].isoformat()
     return data
 
+"""
+Get the shared Alpaca data client, created on first use
+"""
+def get_alpaca_client() -> StockHistoricalDataClient:
+    global _alpaca_client
+    if _alpaca_client is None:
+        _alpaca_client = StockHistoricalDataClient(API_KEY, API_SECRET)
+    return _alpaca_client
+
+"""
+Caches the latest chunk point row of a filled dataframe for one ticker and returns it converted. Earlier rows of a
+fresh download span two weeks and would evict the current rows of other tickers, so they are only stored
+"""
+def cache_latest_row(ticker: str, data: pd.DataFrame) -> dict:
+    record = convert_data_to_iso(data.iloc[-1].to_dict())
+    price_cache.put(ticker, data["timestamp"].iloc[-1].to_pydatetime(), record)
+    return record
+
+"""
+Remembers the latest chunk row stored for each ticker of a filled dataframe. Call only once the rows were written,
+since later downloads start after it. Rows keep their pd.Timestamp timestamp
+"""
+def record_high_water(data: pd.DataFrame):
+    latest = data.groupby("symbol", sort=False).tail(1)
+    with _high_water_lock:
+        for row in latest.to_dict(orient="records"):
+            current = _high_water.get(row["symbol"])
+            if current is None or row["timestamp"] > current["timestamp"]:
+                _high_water[row["symbol"]] = row
+
+"""
+The start of the window a full download covers for the processed time use_time: the previous trading week's open
+"""
+def get_window_start(use_time: datetime) -> datetime:
+    return get_monday_from_processed(use_time - timedelta(days=7))
+
+"""
+Splits tickers into those whose seed (latest stored row before use_time) is still inside the download window
+and those that need a full download. Returns ({ticker -> seed}, [tickers needing a full window])
+"""
+def split_seeds(tickers: List[str], use_time: datetime, seeds: Dict[str, dict]) -> Tuple[Dict[str, dict], List[str]]:
+    window_start = get_window_start(use_time)
+    incremental = {}
+    fresh = []
+    for ticker in tickers:
+        seed = seeds.get(ticker)
+        if seed is not None and window_start <= seed["timestamp"] < use_time:
+            incremental[ticker] = seed
+        else:
+            fresh.append(ticker)
+    return incremental, fresh
+
+"""
+Writes chunk rows through to the local bar store. The store is only a copy of stock_prices, so failures are logged and ignored
+"""
+def store_locally(data: pd.DataFrame):
+    if bar_store is None:
+        return
+    try:
+        bar_store.write(data)
+    except Exception as e:
+        logger.warning("Failed to write bars to the local store: %s", e)
+
+"""
+Given several tickers and a single time chunk point, returns {ticker -> row} for the ones in the local bar store
+"""
+def retrieve_local(tickers: List[str], use_time: datetime) -> Dict[str, dict]:
+    if bar_store is None:
+        return {}
+    return bar_store.read_many_at(tickers, use_time)
+
+"""
+The in-process high-water mark of ticker, or else its latest row in the local bar store, when it is before use_time
+"""
+def get_known_seed(ticker: str, use_time: datetime) -> Optional[dict]:
+    with _high_water_lock:
+        seed = _high_water.get(ticker)
+    if (seed is None or seed["timestamp"] >= use_time) and bar_store is not None:
+        seed = bar_store.latest_before(ticker, use_time)
+    if seed is None or seed["timestamp"] >= use_time:
+        return None
+    return seed
+
+def get_known_seeds(tickers: List[str], use_time: datetime) -> Dict[str, dict]:
+    return {ticker: seed for ticker in tickers if (seed := get_known_seed(ticker, use_time)) is not None}
+
+"""
+Finds the starting point for an incremental download of each ticker: the in-process high-water mark or the local bar store
+when they have a row before use_time, otherwise the latest stored row of the download window before use_time from the
+database, read for all remaining tickers at once
+"""
+def load_seeds(db_client, tickers: List[str], use_time: datetime) -> Dict[str, dict]:
+    seeds = get_known_seeds(tickers, use_time)
+    unknown = [ticker for ticker in tickers if ticker not in seeds]
+    if unknown:
+        seeds.update(retrieve_latest_stocks(db_client, unknown, get_window_start(use_time), use_time))
+    return seeds
+
+"""
+Async version of load_seeds
+"""
+async def load_seeds_async(db_client, tickers: List[str], use_time: datetime) -> Dict[str, dict]:
+    seeds = await asyncio.to_thread(get_known_seeds, tickers, use_time) # may read the local bar store from disk
+    unknown = [ticker for ticker in tickers if ticker not in seeds]
+    if unknown:
+        seeds.update(await retrieve_latest_stocks_async(db_client, unknown, get_window_start(use_time), use_time))
+    return seeds
+
+def request_bars(tickers: List[str], start: datetime, end: datetime):
+    request_params = StockBarsRequest(
+        symbol_or_symbols=tickers,
+        start= start,
+        end= end,
+        timeframe=TimeFrame.Minute, 
+        feed='iex' #defaults to SIP which is paid tier only
+    )
+    with span("alpaca.get_stock_bars"):
+        return get_alpaca_client().get_stock_bars(request_params)
+
+"""
+Queries Alpaca up to the processed time use_time and fills forward every symbol. Tickers with a usable seed only
+request the bars after their seed and only produce the chunk rows after it. Tickers without one download the whole window
+starting at the previous week's open. Each group is a single multi-symbol request.
+Only touches Alpaca and the price cache so it can run on a worker thread.
+Returns ({ticker -> row or the exception explaining why it has no price}, all new filled rows or None)
+"""
+def download_bars(tickers: List[str], use_time: datetime, seeds: Optional[Dict[str, dict]] = None) -> Tuple[Dict[str, dict | Exception], Optional[pd.DataFrame]]:
+    seeds = seeds or {}
+    results: Dict[str, dict | Exception] = {}
+    filled = []
+    incremental, fresh = split_seeds(tickers, use_time, seeds)
+
+    def store(data: pd.DataFrame):
+        filled.append(data)
+        for ticker, ticker_data in data.groupby("symbol", sort=False):
+            results[ticker] = cache_latest_row(ticker, ticker_data)
+
+    if fresh:
+        query_end = use_time
+        query_start = get_window_start(use_time) # Start at the previous week's open to ensure data exists
+        if not market_calendar.has_session_between(query_start - timedelta(minutes = 30), query_end):
+            for ticker in fresh:
+                results[ticker] = ValueError(f"The market was closed between {query_start.isoformat()} and {query_end.isoformat()}.")
+        else:
+            bars = request_bars(fresh, query_start - timedelta(minutes = 30), query_end)
+            valid = []
+            for ticker in fresh:
+                if not ticker in bars.data: 
+                    results[ticker] = ValueError(f"No price data found for ticker '{ticker}'.")
+                elif bars.df.loc[[ticker]].iloc[0].isnull().any():
+                    results[ticker] = ValueError(f"Ticker {ticker} is not traded frequently enough.")
+                else:
+                    valid.append(ticker)
+
+            if valid:
+                store(fill_forward_many(bars.df.loc[valid], {ticker: query_start for ticker in valid}, query_end))
+
+    # Only ask Alpaca for the tail after each seed, and not at all when the market has been closed since
+    if incremental:
+        traded = [ticker for ticker, seed in incremental.items() if market_calendar.has_session_between(seed["timestamp"], use_time)]
+        tail = pd.DataFrame(columns=BAR_COLUMNS)
+        if traded:
+            tail_start = min(incremental[ticker]["timestamp"] for ticker in traded) + timedelta(minutes = 1)
+            bars = request_bars(traded, tail_start, use_time)
+            present = [ticker for ticker in traded if ticker in bars.data]
+            if present:
+                tail = bars.df.loc[present]
+
+        query_starts = {ticker: seed["timestamp"] + timedelta(minutes = TIME_CHUNK_SIZE) for ticker, seed in incremental.items()}
+        store(fill_forward_many(tail, query_starts, use_time, incremental))
+
+    for ticker in tickers:
+        results.setdefault(ticker, ValueError(f"No price data found for ticker '{ticker}'."))
+
+    return results, pd.concat(filled, ignore_index=True) if filled else None
+
+"""
+Yields db_client when the caller already holds one, otherwise a client from client_pool. Callers that hold a pool
+client while pricing pass it down, so they never wait on the pool for a second one
+"""
+@contextmanager
+def use_client(db_client=None) -> Iterator:
+    if db_client is not None:
+        yield db_client
+        return
+    with client_pool.acquire() as pooled:
+        yield pooled
+
+"""
+Downloads the given tickers with download_bars, only fetching the tail after what is already stored,
+and stores every new row with a single upsert and in the local bar store
+"""
+def download_prices(tickers: List[str], use_time: datetime, db_client=None) -> Dict[str, dict | Exception]:
+    with use_client(db_client) as client:
+        seeds = load_seeds(client, tickers, use_time)
+
+    results, filled = download_bars(tickers, use_time, seeds)
+
+    # Insert every symbol into database at once
+    if filled is not None:
+        with use_client(db_client) as client:
+            add_entries(client, filled)
+        record_high_water(filled)
+        store_locally(filled)
+
+    return results
+
+"""
+Splits tickers into ({ticker -> cached row}, [tickers missing from the cache]). Duplicates are dropped
+"""
+def lookup_cached(tickers: List[str], use_time: datetime) -> Tuple[Dict[str, dict], List[str]]:
+    prices: Dict[str, dict] = {}
+    missing = []
+    for ticker in dict.fromkeys(tickers):
+        cached = price_cache.get(ticker, use_time)
+        if cached is not None:
+            prices[ticker] = cached
+        else:
+            missing.append(ticker)
+    return prices, missing
+
+"""
+Caches the rows found in the database or the local bar store, adds them to prices and returns the tickers that are still missing
+"""
+def add_stored_rows(prices: Dict[str, dict], missing: List[str], stored_rows: Dict[str, dict], use_time: datetime) -> List[str]:
+    for ticker, stored in stored_rows.items():
+        row = convert_data_to_iso(stored)
+        price_cache.put(ticker, use_time, row)
+        prices[ticker] = row
+    return [ticker for ticker in missing if ticker not in prices]
+
+"""
+Claims the tickers nobody is downloading yet. Returns ({ticker -> future this caller must settle}, {ticker -> future to wait on})
+"""
+def claim_downloads(missing: List[str], use_time: datetime) -> Tuple[Dict[str, Future], Dict[str, Future]]:
+    owned: Dict[str, Future] = {}
+    waiting: Dict[str, Future] = {}
+    with _in_flight_lock:
+        for ticker in missing:
+            key = (ticker, use_time)
+            if key in _in_flight:
+                waiting[ticker] = _in_flight[key]
+            else:
+                owned[ticker] = _in_flight[key] = Future()
+    return owned, waiting
+
+"""
+Releases the claimed tickers and hands the download results to everyone waiting on them
+"""
+def settle_downloads(owned: Dict[str, Future], results: Dict[str, dict | Exception], use_time: datetime):
+    with _in_flight_lock:
+        for ticker in owned:
+            _in_flight.pop((ticker, use_time), None)
+
+    for ticker, future in owned.items():
+        result = results.get(ticker, RuntimeError(f"Price download for '{ticker}' was interrupted."))
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+"""
+Given several ticker symbols and the current time, gets their stock prices from the most recent time chunk point
+Tries the in-process price cache first, then the local bar store, then a single database query for the rest, then a single Alpaca request for what is still missing.
+Concurrent callers asking for the same ticker and chunk share one Alpaca request.
+Returns {ticker -> dict} with the same keys as fetch_price. Raises ValueError if any ticker has no price.
+A caller holding a pool client passes it as db_client
+"""
+def fetch_prices(tickers: List[str], ts: datetime, db_client=None) -> Dict[str, dict]:
+    use_time = process_time(ts)
+    prices, missing = lookup_cached(tickers, use_time)
+    if not missing:
+        return prices
+
+    missing = add_stored_rows(prices, missing, retrieve_local(missing, use_time), use_time)
+    if not missing:
+        return prices
+
+    # Check if already in database
+    with use_client(db_client) as client:
+        stored_rows = retrieve_stocks_at(client, missing, use_time)
+    if stored_rows:
+        store_locally(pd.DataFrame(list(stored_rows.values())))
+    missing = add_stored_rows(prices, missing, stored_rows, use_time)
+    if not missing:
+        return prices
+
+    owned, waiting = claim_downloads(missing, use_time)
+    if owned:
+        results = {}
+        try:
+            results = download_prices(list(owned), use_time, db_client)
+        except Exception as e:
+            results = {ticker: e for ticker in owned}
+        finally:
+            settle_downloads(owned, results, use_time)
+
+    errors = []
+    for ticker, future in {**owned, **waiting}.items():
+        try:
+            prices[ticker] = dict(future.result())
+        except Exception as e:
+            errors.append(e)
+
+    if errors:
+        raise ValueError(" ".join(str(e) for e in errors))
+
+    return prices
+
 """
 Given a ticker symbol and the current time, gets the stock price from the most recent time chunk point
-Will try to query database first. If data not in database it will query Alpaca and also add data to database 
+Will try the in-process price cache first, then the database. If data not in database it will query Alpaca and also add data to database 
 Returns dict object with keys: ['symbol', 'timestamp', 'open', 'high', 'low', 'close', 'volume', 'trade_count', 'vwap'] 
 """
 def fetch_price(ticker: str, ts: datetime) -> dict:
+    return fetch_prices([ticker], ts)[ticker]
+
+"""
+Async version of fetch_prices for use on the event loop. Database reads and writes use the async client pool,
+while the blocking Alpaca request, the pandas forward fill and local bar store reads and writes run on a worker thread.
+Shares the cache and in-flight downloads with fetch_prices
+"""
+async def fetch_prices_async(tickers: List[str], ts: datetime) -> Dict[str, dict]:
     use_time = process_time(ts)
+    prices, missing = lookup_cached(tickers, use_time)
+    if not missing:
+        return prices
 
-    db_client = get_client()
-    current_data = retrieve_stock(db_client, ticker)
+    missing = add_stored_rows(prices, missing, await asyncio.to_thread(retrieve_local, missing, use_time), use_time)
+    if not missing:
+        return prices
 
     # Check if already in database
-    if current_data is not None:
-        search = current_data['timestamp'].isin([use_time])
-        if search.any(): 
-            return convert_data_to_iso(current_data[search].iloc[0].to_dict())
-
-    # Query Alpaca for data
-    query_end = use_time
-    query_start = get_monday_from_processed(query_end) # Ensure there is enough room to ensure data exists
-    if query_start.weekday() == 0: 
-        query_start = query_start - timedelta(days=7)
-
-    alpaca_client = StockHistoricalDataClient(API_KEY, API_SECRET)
-    request_params = StockBarsRequest(
-        symbol_or_symbols=[ticker],
-        start= query_start - timedelta(minutes = 30),
-        end= query_end,
-        timeframe=TimeFrame.Minute, 
-        feed='iex' #defaults to SIP which is paid tier only
-    )
-    
-    bars = alpaca_client.get_stock_bars(request_params)
-    if not ticker in bars.data: 
-        raise ValueError(f"No price data found for ticker '{ticker}'.")
-    
-    # Insert into database and return data
-    if bars.df.iloc[0].isnull().any():
-        raise ValueError(f"Ticker {ticker} is not traded frequently enough.")
-    data = fill_forward_prices(bars.df, query_start, query_end)
-    add_entries(db_client, data)
+    async with async_client_pool.acquire() as db_client:
+        stored_rows = await retrieve_stocks_at_async(db_client, missing, use_time)
+    if stored_rows:
+        await asyncio.to_thread(store_locally, pd.DataFrame(list(stored_rows.values())))
+    missing = add_stored_rows(prices, missing, stored_rows, use_time)
+    if not missing:
+        return prices
+
+    owned, waiting = claim_downloads(missing, use_time)
+    if owned:
+        results = {}
+        try:
+            async with async_client_pool.acquire() as db_client:
+                seeds = await load_seeds_async(db_client, list(owned), use_time)
+
+            results, filled = await asyncio.to_thread(download_bars, list(owned), use_time, seeds)
+            if filled is not None:
+                async with async_client_pool.acquire() as db_client:
+                    await add_entries_async(db_client, filled)
+                record_high_water(filled)
+                await asyncio.to_thread(store_locally, filled)
+        except Exception as e:
+            results = {ticker: e for ticker in owned}
+        finally:
+            settle_downloads(owned, results, use_time)
 
-    return convert_data_to_iso(data.iloc[-1].to_dict())
+    errors = []
+    for ticker, future in {**owned, **waiting}.items():
+        try:
+            prices[ticker] = dict(await asyncio.wrap_future(future))
+        except Exception as e:
+            errors.append(e)
 
-    
+    if errors:
+        raise ValueError(" ".join(str(e) for e in errors))
 
+    return prices
+
+"""
+Async version of fetch_price
+"""
+async def fetch_price_async(ticker: str, ts: datetime) -> dict:
+    return (await fetch_prices_async([ticker], ts))[ticker]
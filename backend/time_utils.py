@@ -1,41 +1,18 @@
-#TODO: WHAT ABOUT HOLIDAYS!!!!! Probably retrieve from alpaca and store for every other case. 
-
 from dotenv import load_dotenv
 import os
 
 from datetime import datetime, timedelta, timezone as tz
+from market_calendar import market_calendar
 
 load_dotenv()
 TIME_CHUNK_SIZE = int(os.getenv("TIME_CHUNK_SIZE"))
 
 """
-Converts date to previous Friday if Sat/Sun. Expects UTC
-"""
-def adjust_for_weekend(time: datetime) -> datetime: 
-    if time.weekday() == 5: 
-        return (time - timedelta(days = 1)).replace(hour=23, minute=59)
-    elif time.weekday() == 6: 
-        return (time - timedelta(days = 2)).replace(hour=23, minute=59)
-    return time
-
-"""
-Clips down time to a valid trading hours time. Expects UTC
+Clips down time to a valid trading hours time using the market calendar, so weekends, holidays, early closes
+and DST are all accounted for. Expects UTC
 """
 def clip_to_trading_hours(time: datetime) -> datetime: 
-    time = adjust_for_weekend(time)
-    
-    # Start by accounting for behind opening time. Watch out for Mondays. 
-    open_time = time.replace(hour=14, minute=30)    
-    if time < open_time and time.weekday() == 0:
-        time = (time - timedelta(days = 3)).replace(hour=23, minute=59)
-    elif time < open_time: 
-        time = (time - timedelta(days = 1)).replace(hour=23, minute=59)
-    
-    # Then account for the closing time
-    close_time = time.replace(hour=21, minute=0)
-    if time > close_time: 
-        return close_time
-    return time
+    return market_calendar.clip(time)
 
 """
 Rounds time to nearest time point that rests on boundary of a time chunk specified by TIME_CHUNK_SIZE
@@ -45,18 +22,27 @@ def round_to_time_point(time: datetime) -> datetime:
     return time.replace(minute = chunk_minute)
 
 """
-Gets the most recent Monday opening time
+Seconds from now until delay seconds past the next time chunk boundary
+"""
+def seconds_until_next_chunk(now: datetime, delay: float = 0) -> float:
+    chunk = timedelta(minutes = TIME_CHUNK_SIZE)
+    start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    next_boundary = start_of_day + ((now - start_of_day) // chunk + 1) * chunk
+    return (next_boundary - now).total_seconds() + delay
+
+"""
+Gets the opening time of the most recent trading week (Monday's open, or the first session after a Monday holiday)
 """
 def get_monday(time: datetime) -> datetime: 
     time = time.astimezone(tz.utc).replace(second = 0, microsecond = 0)
     time = clip_to_trading_hours(time)    
-    return (time - timedelta(days = time.weekday())).replace(hour=14, minute=30)
+    return market_calendar.week_open(time)
 
 """
-Gets the most recent Monday opening time. ASSUMES time has been processed to a valid trading day. 
+Gets the opening time of the most recent trading week. ASSUMES time has been processed to a valid trading day. 
 """
 def get_monday_from_processed(time: datetime) -> datetime: 
-    return (time - timedelta(days = time.weekday())).replace(hour=14, minute=30) 
+    return market_calendar.week_open(time)
 
 """
 This function takes in the current time and processes it to get a valid trading time point to query
@@ -1,27 +1,243 @@
-from fastapi import WebSocket, WebSocketDisconnect
+from fastapi import WebSocket
 import asyncio
-from typing import List, Dict, Callable, Awaitable, Any, Tuple, Optional
+import json
+import logging
+import time
+from typing import List, Dict, Set, Any, Tuple, Optional, Callable, Awaitable
+from dotenv import load_dotenv
+import os
 
-from database import get_async_client
+from league_members import league_members
+from pubsub import InMemoryPubSub, pubsub as default_pubsub
+from presence import PresenceDebouncer, PRESENCE_DEBOUNCE
+from metrics import span
 from time_utils import get_now_iso
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+load_dotenv()
+
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256")) # messages waiting to be written to one socket
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "disconnect") # "disconnect" or "drop_oldest" when a socket's queue is full
+WS_MEMBERS_HEARTBEAT = float(os.getenv("WS_MEMBERS_HEARTBEAT", "15")) # seconds between re-publishing the members this worker holds; other workers forget them after 3 missed beats
+
+logger = logging.getLogger(__name__)
+
+"""
+Encodes data the same way WebSocket.send_json does, with orjson when it is installed
+"""
+def encode_json(data: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+"""
+Bounded queue of encoded messages for one socket, written in order by its own writer task, so a slow socket only
+ever delays itself. When the queue is full the policy either drops the oldest queued message or reports the socket as too slow.
+memberships holds the (room, member) pairs the socket is registered under
+"""
+class Outbox:
+    def __init__(self, websocket: WebSocket, manager: "ConnectionManager", size: int, policy: str):
+        self.websocket = websocket
+        self.manager = manager
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=size)
+        self.policy = policy
+        self.memberships: Set[Tuple[str, str]] = set()
+        self.dropped = 0
+        self.task = asyncio.create_task(self.run())
+
+    """
+    Queues text without waiting. Returns False if the socket is too slow and should be disconnected
+    """
+    def put(self, text: str) -> bool:
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            if self.policy != "drop_oldest":
+                return False
+            self.queue.get_nowait()
+            self.dropped += 1
+            self.queue.put_nowait(text)
+            return True
+
+    async def run(self):
+        try:
+            while True:
+                text = await self.queue.get()
+                await self.websocket.send_text(text)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.manager.drop_later(self)
+
+    def close(self):
+        if self.task is not asyncio.current_task():
+            self.task.cancel()
+
+"""
+Rooms of websockets. Broadcasts go through pubsub under the topic "<namespace>:<room>", so with a broker backed pubsub
+they reach the room's sockets on every worker. Each worker also shares which members of a room it holds, so
+active users include members connected to other workers. Shares are repeated every heartbeat seconds while started and
+expire after three missed beats, so the members of a worker that crashed stop being listed as online
+"""
 class ConnectionManager: 
-    def __init__(self): 
+    def __init__(self, namespace: str = "rooms", pubsub: InMemoryPubSub = default_pubsub,
+                 queue_size: int = WS_QUEUE_SIZE, slow_consumer_policy: str = WS_SLOW_CONSUMER_POLICY,
+                 heartbeat: float = WS_MEMBERS_HEARTBEAT): 
         self.rooms: Dict[str, Dict[str, WebSocket]] = {} # {league_id -> {user_id -> websocket}}
         self.room_users: Dict[str, List[str]] = {} # {league_id -> [all_users]}
         self.room_info: Dict[str, Any] = {}
         self.locks: Dict[str, asyncio.Lock] = {}
         self.lock_access = asyncio.Lock()
+        self.outboxes: Dict[int, Outbox] = {} # {id(websocket) -> outbox}
+        self.queue_size = queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.drop_tasks: Set[asyncio.Task] = set()
+        self.namespace = namespace
+        self.pubsub = pubsub
+        self.room_handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[None]]] = {} # {room -> pubsub handler}
+        self.remote_members: Dict[str, Dict[str, Tuple[float, List[str]]]] = {} # {room -> {worker -> (expiry, members connected there)}}
+        self.heartbeat = heartbeat
+        self.heartbeat_task: Optional[asyncio.Task] = None
 
-    async def load_league_users(self, league_id: str) -> List[str]:
-        db_client = await get_async_client()
-        response = await db_client.table("league_members").select("user_id").eq("league_id", league_id).execute()
+    def topic(self, room: str) -> str:
+        return f"{self.namespace}:{room}"
+
+    """
+    Starts receiving a room's messages from pubsub and asks other workers which members they hold.
+    Call while holding the room's lock when its first local socket joins
+    """
+    async def join_room(self, room: str):
+        if room in self.room_handlers:
+            return
+        handler = self.room_handlers[room] = lambda message: self.on_message(room, message)
+        await self.pubsub.subscribe(self.topic(room), handler)
+        await self.pubsub.publish(self.topic(room), {"kind": "hello", "origin": self.pubsub.origin})
 
-        if response.data is None:
-            print(f"Error fetching league members: {response.error}")
-            raise ValueError("Could not fetch league members!")
+    """
+    Stops receiving a room's messages once its last local socket left. Call while holding the room's lock
+    """
+    async def leave_room(self, room: str):
+        handler = self.room_handlers.pop(room, None)
+        if handler is None:
+            return
+        await self.publish_members(room)
+        await self.pubsub.unsubscribe(self.topic(room), handler)
+        self.remote_members.pop(room, None)
 
-        return [user["user_id"] for user in response.data]
+    async def publish_members(self, room: str):
+        members = list(self.rooms.get(room, {}).keys())
+        await self.pubsub.publish(self.topic(room), {"kind": "members", "origin": self.pubsub.origin, "members": members})
+
+    async def on_message(self, room: str, message: Dict[str, Any]):
+        kind = message.get("kind")
+        if kind == "broadcast":
+            await self.deliver(room, message["text"])
+        elif message.get("origin") == self.pubsub.origin:
+            return
+        elif kind == "hello":
+            await self.publish_members(room)
+        elif kind == "members":
+            remote = self.remote_members.setdefault(room, {})
+            if message["members"]:
+                remote[message["origin"]] = (time.monotonic() + 3 * self.heartbeat, message["members"])
+            else:
+                remote.pop(message["origin"], None)
+
+    """
+    Members of room connected to this worker followed by those only connected to other workers
+    """
+    def active_members(self, room: str) -> List[str]:
+        members = dict.fromkeys(self.rooms.get(room, {}))
+        now = time.monotonic()
+        for expiry, remote in self.remote_members.get(room, {}).values():
+            if expiry > now:
+                members.update(dict.fromkeys(remote))
+        return list(members)
+
+    """
+    Re-publishes the members of every room this worker holds and forgets other workers' members that were not
+    repeated in time
+    """
+    async def beat(self):
+        for room in list(self.room_handlers):
+            await self.publish_members(room)
+
+        now = time.monotonic()
+        for room, remote in self.remote_members.items():
+            for origin in [origin for origin, (expiry, _) in remote.items() if expiry <= now]:
+                del remote[origin]
+
+    async def run_heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                await self.beat()
+            except Exception:
+                logger.exception("Members heartbeat of %s failed", self.namespace)
+
+    """
+    Starts the members heartbeat. Only needed when the pubsub is shared with other workers
+    """
+    def start(self):
+        if self.heartbeat_task is None and self.pubsub.shared:
+            self.heartbeat_task = asyncio.create_task(self.run_heartbeat())
+
+    async def stop(self):
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            try:
+                await self.heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self.heartbeat_task = None
+
+    """
+    Registers websocket under (room, member), starting its writer the first time. Call while holding the room's lock
+    """
+    def attach(self, websocket: WebSocket, room: str, member: str):
+        outbox = self.outboxes.get(id(websocket))
+        if outbox is None:
+            outbox = self.outboxes[id(websocket)] = Outbox(websocket, self, self.queue_size, self.slow_consumer_policy)
+        outbox.memberships.add((room, member))
+
+    """
+    Removes the (room, member) registration of websocket, stopping its writer once it has none left
+    """
+    def detach(self, websocket: WebSocket, room: str, member: str):
+        outbox = self.outboxes.get(id(websocket))
+        if outbox is None:
+            return
+        outbox.memberships.discard((room, member))
+        if not outbox.memberships:
+            del self.outboxes[id(websocket)]
+            outbox.close()
+
+    """
+    Disconnects every registration of a socket that failed or fell behind, closing it so the client can reconnect
+    """
+    async def drop(self, outbox: Outbox):
+        for room, member in list(outbox.memberships):
+            try:
+                await self.disconnect(room, member)
+            except Exception:
+                pass
+        try:
+            await outbox.websocket.close(code=1013)
+        except Exception:
+            pass
+
+    def drop_later(self, outbox: Outbox):
+        task = asyncio.create_task(self.drop(outbox))
+        self.drop_tasks.add(task)
+        task.add_done_callback(self.drop_tasks.discard)
+
+    async def load_league_users(self, league_id: str) -> List[str]:
+        return await league_members.get(league_id)
 
     async def get_lock(self, league_id: str) -> asyncio.Lock: 
         async with self.lock_access: 
@@ -39,73 +255,128 @@ class ConnectionManager:
     async def get_room_info(self, league_id: str) -> Tuple[List[str], List[str], Dict[str, Any]]: 
         lock = await self.get_lock(league_id)
         async with lock: 
-            return self.room_users.get(league_id, []), list(self.rooms.get(league_id, {}).keys()), self.room_info
+            return self.room_users.get(league_id, []), self.active_members(league_id), self.room_info
 
-    async def connect(self, websocket: WebSocket, league_id: str, user_id: str): 
+    """
+    Adds the socket to the room. Users missing from the league's cached members cause one rate limited refresh of
+    the members; if they are still not members the socket is closed and False is returned
+    """
+    async def connect(self, websocket: WebSocket, league_id: str, user_id: str) -> bool: 
         await websocket.accept()
 
-        all_users: Optional[List[str]] = None
-        if league_id not in self.room_users: 
-            all_users = await self.load_league_users(league_id)
+        all_users = await self.load_league_users(league_id)
+        if user_id not in all_users: # Joined the league after its members were loaded, or not a member
+            all_users = await league_members.refresh(league_id)
+            if user_id not in all_users:
+                await websocket.close(code=1008, reason="Not a member of this league.")
+                return False
         
         lock = await self.get_lock(league_id)
         async with lock:
+            if league_id not in self.rooms:
+                await self.join_room(league_id)
             room = self.rooms.setdefault(league_id, {})
+            if user_id in room and room[user_id] is not websocket:
+                self.detach(room[user_id], league_id, user_id)
             room[user_id] = websocket
+            self.attach(websocket, league_id, user_id)
 
             if league_id not in self.room_users:
-                if all_users is None: # Guard against the enter then last user disconnects case
-                    all_users = await self.load_league_users(league_id) 
                 self.room_users[league_id] = all_users
                 self.room_info[league_id] = dict()
+            elif user_id not in self.room_users[league_id]:
+                self.room_users[league_id] = all_users
 
-    async def disconnect(self, league_id: str, user_id: str):
+            await self.publish_members(league_id)
+        return True
+
+    """
+    Returns whether user_id was connected to the room, since a failed socket may be disconnected more than once
+    """
+    async def disconnect(self, league_id: str, user_id: str) -> bool:
+        removed = False
         lock = await self.get_lock(league_id)
         async with lock:
             if league_id in self.rooms and user_id in self.rooms[league_id]:
-                del self.rooms[league_id][user_id]
+                removed = True
+                self.detach(self.rooms[league_id].pop(user_id), league_id, user_id)
                 if not self.rooms[league_id]: 
                     del self.rooms[league_id]
                     del self.room_users[league_id]
                     del self.room_info[league_id]
+                    await self.leave_room(league_id)
+                else:
+                    await self.publish_members(league_id)
         
         if league_id not in self.room_users:
             await self.delete_lock(league_id)
+        return removed
         
-    async def _broadcast_core(self, league_id: str, content: str | Dict, func: Callable[[WebSocket, Any], Awaitable[None]]):
+    """
+    Publishes an encoded message to the room's sockets on every worker
+    """
+    async def _broadcast_core(self, league_id: str, text: str):
+        with span("ws.broadcast", namespace=self.namespace):
+            await self.pubsub.publish(self.topic(league_id), {"kind": "broadcast", "text": text})
+
+    """
+    Queues an encoded message for every socket of the room on this worker without waiting on any of them.
+    Sockets that are too slow under the slow consumer policy are disconnected
+    """
+    async def deliver(self, league_id: str, text: str):
         lock = await self.get_lock(league_id)
         async with lock: 
             if league_id not in self.rooms or not self.rooms[league_id]:
                 return 
             
-            items = list(self.rooms[league_id].items())
+            slow = []
+            with span("ws.deliver", namespace=self.namespace):
+                for websocket in self.rooms[league_id].values():
+                    outbox = self.outboxes.get(id(websocket))
+                    if outbox is not None and not outbox.put(text):
+                        slow.append(outbox)
 
-        tasks = [func(websocket, content) for _, websocket in items]    
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-
-        for (user_id, _), result in zip(items, results):
-            if isinstance(result, (WebSocketDisconnect, ConnectionError, RuntimeError, Exception)):
-                try: 
-                    await self.disconnect(league_id, user_id)
-                except Exception: 
-                    pass
+        for outbox in slow:
+            await self.drop(outbox)
 
     async def broadcast_message(self, league_id: str, message: str):
-        await self._broadcast_core(league_id, message, self.send_message)
+        await self._broadcast_core(league_id, message)
 
     async def broadcast_json(self, league_id: str, data: Dict):
-        await self._broadcast_core(league_id, data, self.send_json)
+        await self._broadcast_core(league_id, encode_json(data))
 
+    """
+    Sends to a single socket, behind anything already queued for it
+    """
     async def send_message(self, websocket: WebSocket, message: str):
-        await websocket.send_text(message)
+        outbox = self.outboxes.get(id(websocket))
+        if outbox is None:
+            await websocket.send_text(message)
+        elif not outbox.put(message):
+            await self.drop(outbox)
 
     async def send_json(self, websocket: WebSocket, data: Dict): 
-        await websocket.send_json(data)
+        await self.send_message(websocket, encode_json(data))
 
 
+"""
+Rooms of league members that tell the room who is online. Joins and leaves are debounced by a PresenceDebouncer,
+so a burst of reconnects becomes one presence message per room instead of one per socket
+"""
 class UserContextConnectionManager(ConnectionManager):
-    async def connect(self, websocket: WebSocket, league_id: str, user_id: str): 
-        await super().connect(websocket, league_id, user_id)
+    def __init__(self, *args, presence_window: float = PRESENCE_DEBOUNCE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.presence = PresenceDebouncer(self.broadcast_json, presence_window)
+
+    """
+    Sends whatever a joining socket needs right after the state message. Nothing by default
+    """
+    async def after_state(self, websocket: WebSocket, league_id: str):
+        pass
+
+    async def connect(self, websocket: WebSocket, league_id: str, user_id: str) -> bool: 
+        if not await super().connect(websocket, league_id, user_id):
+            return False
 
         all_users, active_users, _ = await self.get_room_info(league_id)
         await self.send_json(websocket, {
@@ -114,21 +385,13 @@ class UserContextConnectionManager(ConnectionManager):
             "activeUsers": active_users, 
             "ts": get_now_iso()
         }) 
+        await self.after_state(websocket, league_id)
 
-        await self.broadcast_json(league_id, {
-            "type": "presence.join", 
-            "userId": user_id, 
-            "ts": get_now_iso()
-        })
-
-    async def disconnect(self, league_id: str, user_id: str):
-        await super().disconnect(league_id, user_id)
-
-        await self.broadcast_json(league_id, {
-            "type": "presence.leave", 
-            "userId": user_id, 
-            "ts": get_now_iso()
-        })
-
-    
+        self.presence.note(league_id, "presence.join", user_id)
+        return True
 
+    async def disconnect(self, league_id: str, user_id: str) -> bool:
+        removed = await super().disconnect(league_id, user_id)
+        if removed:
+            self.presence.note(league_id, "presence.leave", user_id)
+        return removed
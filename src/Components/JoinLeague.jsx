@@ -45,6 +45,7 @@ const JoinLeague = ({ userId, onEdit }) => {
             if (error) {
                 throw error;
             }
+            await fetch(`http://localhost:8000/leagues/${leagueId[0].league_id}/members/changed`, { method: "POST" });
         } catch (error) {
             setError("An error occurred while joining the league.");
             console.error("Error joining league:", error);
@@ -1,56 +1,29 @@
 import React, { useEffect, useState } from "react";
-import { supabase } from "../supabaseClient";
 
 const LeaderboardPage = ({ leagueId }) => {
   const [stats, setStats] = useState([]);
 
   useEffect(() => {
     const fetchLeaderboard = async () => {
-      const { data: members, error: memberError } = await supabase
-        .from("league_members")
-        .select("league_member_id")
-        .eq("league_id", leagueId);
+      try {
+        const res = await fetch(`http://localhost:8000/leagues/${leagueId}/standings`);
+        const data = await res.json();
+        if (!res.ok) return console.error("Error fetching standings:", data);
 
-      if (memberError) return console.error("Error fetching league members:", memberError);
-      if (!members || members.length === 0) return;
+        const leaderboardData = (data.standings ?? []).map((s) => {
+          const total = s.wins + s.losses;
+          return {
+            user_id: s.league_member_id,
+            wins: s.wins,
+            total,
+            winRate: total > 0 ? (s.wins / total) * 100 : 0,
+          };
+        });
 
-      const leagueMemberIds = members.map((m) => m.league_member_id);
-
-      const { data: matchups, error: matchupError } = await supabase
-        .from("matchups")
-        .select("user1_id, user2_id, winner_id")
-        .eq("league_id", leagueId);
-
-      if (matchupError) return console.error("Error fetching matchups:", matchupError);
-      if (!matchups || matchups.length === 0) return;
-
-      const playerStats = {};
-
-      for (const m of matchups) {
-        const players = [m.user1_id, m.user2_id];
-        for (const pid of players) {
-          if (!leagueMemberIds.includes(pid)) continue;
-          if (!playerStats[pid]) playerStats[pid] = { wins: 0, total: 0 };
-          playerStats[pid].total++;
-        }
-
-        if (m.winner_id && leagueMemberIds.includes(m.winner_id)) {
-          if (!playerStats[m.winner_id]) playerStats[m.winner_id] = { wins: 0, total: 0 };
-          playerStats[m.winner_id].wins++;
-        }
+        setStats(leaderboardData);
+      } catch (err) {
+        console.error("Error fetching standings:", err);
       }
-
-      const leaderboardData = Object.entries(playerStats).map(
-        ([user_id, { wins, total }]) => ({
-          user_id,
-          wins,
-          total,
-          winRate: total > 0 ? (wins / total) * 100 : 0,
-        })
-      );
-
-      leaderboardData.sort((a, b) => b.winRate - a.winRate);
-      setStats(leaderboardData);
     };
 
     fetchLeaderboard();
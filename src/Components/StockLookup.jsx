@@ -1,10 +1,49 @@
-import { useState } from 'react';
+import { useState, useEffect, useRef } from 'react';
 
 const StockLookup = () => {
 
   const [symbol, setSymbol] = useState('');
   const [result, setResult] = useState(null);
   const [error, setError] = useState('');
+  const [liveSymbol, setLiveSymbol] = useState(null);
+  const wsRef = useRef(null);
+
+  // After a successful lookup, keep the price current with the updates /prices/ws pushes every new bar
+  useEffect(() => {
+    const ws = new WebSocket(`ws://localhost:8000/prices/ws`);
+    wsRef.current = ws;
+
+    ws.onmessage = (event) => {
+      const data = JSON.parse(event.data);
+      if (data.type === "price.update") {
+        setResult((prev) => prev?.price_data?.symbol === data.ticker
+          ? { price_data: { ...prev.price_data, vwap: data.price, close: data.close, timestamp: data.ts } }
+          : prev);
+      } else if (data.type === "error") {
+        console.error("Price stream error:", data.message);
+      }
+    };
+
+    return () => {
+      ws.close();
+      wsRef.current = null;
+    };
+  }, []);
+
+  useEffect(() => {
+    const ws = wsRef.current;
+    if (!ws || !liveSymbol) return;
+
+    const send = (type) => {
+      if (ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify({ type, tickers: [liveSymbol] }));
+    };
+    if (ws.readyState === WebSocket.CONNECTING) {
+      ws.addEventListener("open", () => send("subscribe"), { once: true });
+    } else {
+      send("subscribe");
+    }
+    return () => send("unsubscribe");
+  }, [liveSymbol]);
 
   const handleSubmit = async (e) => { 
 
@@ -21,6 +60,7 @@ const StockLookup = () => {
             setError(data.detail || "Stock data not found.");
         } else { 
             setResult(data);
+            setLiveSymbol(data.price_data.symbol);
         }
 
         console.log(data);
@@ -13,6 +13,7 @@ export function ChatContextProvider({leagueId, userId, members, children}) {
     const [allUsers, setAllUsers] = useState([]);
     const [messages, setMessages] = useState([]);
     const [activeMap, setActiveMap] = useState(() => new Map());
+    const [liveMatchups, setLiveMatchups] = useState([]);
     const wsRef = useRef(null);
 
     const pendingRef = useRef([]);
@@ -58,6 +59,25 @@ export function ChatContextProvider({leagueId, userId, members, children}) {
                         break;
                     }
 
+                    case "presence.batch": { 
+                        setActiveMap(prev => { 
+                            const newMap = new Map(prev);
+                            (data.events ?? []).forEach(e => newMap.set(e.userId, e.type === "presence.join"));
+                            return newMap; 
+                        });
+                        break;
+                    }
+
+                    case "chat.history": { 
+                        setMessages((data.messages ?? []).map((m) => `${nameById.get(String(m.userId))}: ${m.text}`));
+                        break;
+                    }
+
+                    case "matchup.live": { 
+                        setLiveMatchups(data.matchups ?? []);
+                        break;
+                    }
+
                     case "chat.message": { 
                         const name = nameById.get(String(data.userId));
                         setMessages((prev) => [...prev, `${name}: ${data.text}`]);
@@ -106,7 +126,7 @@ export function ChatContextProvider({leagueId, userId, members, children}) {
         }
     }
 
-    const chatContextValue = useMemo(() => ({allUsers, activeMap, messages, members, sendChat}), [allUsers, activeMap, messages, members]);
+    const chatContextValue = useMemo(() => ({allUsers, activeMap, messages, members, liveMatchups, sendChat}), [allUsers, activeMap, messages, members, liveMatchups]);
 
     return (
         <ChatContext.Provider value = {chatContextValue}>
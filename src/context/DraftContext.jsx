@@ -59,6 +59,15 @@ export function DraftContextProvider({leagueId, userId, members, children}) {
                         break;
                     }
 
+                    case "presence.batch": { 
+                        setActiveMap(prev => { 
+                            const newMap = new Map(prev);
+                            (data.events ?? []).forEach(e => newMap.set(e.userId, e.type === "presence.join"));
+                            return newMap; 
+                        });
+                        break;
+                    }
+
                     case "draft.stateChange": { 
                         setDraftState(data.draftState);
                         break;
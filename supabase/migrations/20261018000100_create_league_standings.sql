@@ -0,0 +1,15 @@
+-- Materialized standings of every league, maintained by backend/standings.py.
+-- The backend upserts on (league_id, league_member_id), which needs the unique constraint below.
+create table if not exists public.league_standings (
+    league_id uuid not null references public.leagues (league_id) on delete cascade,
+    league_member_id uuid not null references public.league_members (league_member_id) on delete cascade,
+    wins integer not null default 0,
+    losses integer not null default 0,
+    total_score double precision not null default 0,
+    streak integer not null default 0, -- latest consecutive wins (positive) or losses (negative)
+    last_week integer not null default 0, -- latest matchup week counted, so recording a week twice is a no-op
+    rank integer,
+    constraint league_standings_league_member_key unique (league_id, league_member_id)
+);
+
+create index if not exists league_standings_league_rank_idx on public.league_standings (league_id, rank);
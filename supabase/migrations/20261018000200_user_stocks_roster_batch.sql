@@ -0,0 +1,29 @@
+-- Each ticker is owned by at most one member of a league. backend/rosters.py checks batches against an in-memory
+-- index, but only this constraint holds across workers: a conflicting insert fails with 23505 and the index is reloaded.
+-- Remove any duplicate (league_id, "Ticker") rows before applying.
+alter table public.user_stocks
+    add constraint user_stocks_league_ticker_key unique (league_id, "Ticker");
+
+-- Applies one member's roster batch in a single transaction: the drops are deleted and the adds inserted, or nothing
+-- changes when any add conflicts. Returns the inserted rows.
+create or replace function public.apply_roster_batch(
+    p_league_id uuid,
+    p_league_member_id uuid,
+    p_added text[],
+    p_dropped text[]
+) returns setof public.user_stocks
+language plpgsql
+as $$
+begin
+    delete from public.user_stocks
+    where league_id = p_league_id
+      and league_member_id = p_league_member_id
+      and "Ticker" = any(p_dropped);
+
+    return query
+    insert into public.user_stocks (league_id, "Ticker", league_member_id)
+    select p_league_id, ticker, p_league_member_id
+    from unnest(p_added) as ticker
+    returning *;
+end;
+$$;
@@ -0,0 +1,16 @@
+-- Persisted state of every draft, written by backend/draft_scheduler.py so drafts resume after a restart.
+-- DraftStore.claim first inserts a bare {league_id} row, so every column but league_id is nullable or has a default.
+create table if not exists public.drafts (
+    league_id uuid primary key references public.leagues (league_id) on delete cascade,
+    pick_order jsonb, -- league member user ids in first round order
+    num_rounds integer,
+    turn_timeout integer, -- seconds per pick
+    pick_index integer not null default 0,
+    deadline timestamptz, -- end of the current turn
+    draft_state text not null default 'NOT_STARTED' check (draft_state in ('NOT_STARTED', 'IN_PROGRESS', 'COMPLETED')),
+    owner text, -- pubsub origin of the worker running the draft
+    lease_until timestamptz -- another worker may adopt the draft once this has passed
+);
+
+-- Workers reload the in progress drafts on start and every lease renewal
+create index if not exists drafts_in_progress_idx on public.drafts (draft_state) where draft_state = 'IN_PROGRESS';
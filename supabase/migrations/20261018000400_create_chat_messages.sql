@@ -0,0 +1,11 @@
+-- Chat messages of every league, written in batches by backend/chat_history.py
+create table if not exists public.chat_messages (
+    id bigint generated always as identity primary key,
+    league_id uuid not null references public.leagues (league_id) on delete cascade,
+    user_id uuid not null,
+    text text not null,
+    ts timestamptz not null default now()
+);
+
+-- A league's ring is loaded with its latest messages: league_id = ? order by ts desc limit CHAT_HISTORY_SIZE
+create index if not exists chat_messages_league_ts_idx on public.chat_messages (league_id, ts desc);
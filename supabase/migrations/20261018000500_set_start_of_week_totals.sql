@@ -0,0 +1,12 @@
+-- Sets start_of_week_total of many portfolios in one statement, for backend/MatchupCalc.py. Only that column is
+-- written, so trades made while a week was being scored keep their current_balance.
+-- p_totals is a json array of {"league_member_id", "start_of_week_total"} objects.
+create or replace function public.set_start_of_week_totals(p_totals jsonb)
+returns void
+language sql
+as $$
+    update public.portfolios as p
+    set start_of_week_total = t.start_of_week_total
+    from jsonb_to_recordset(p_totals) as t(league_member_id uuid, start_of_week_total numeric)
+    where p.league_member_id = t.league_member_id;
+$$;
@@ -0,0 +1,22 @@
+-- Latest stock_prices row of each symbol with p_after <= timestamp <= p_before, for backend/database.py
+-- retrieve_latest_stocks. Each symbol is one probe of the (symbol, timestamp) unique index, so a symbol with nothing
+-- stored costs no more than one with a row. Symbols without such a row are left out.
+create or replace function public.latest_stock_prices(
+    p_symbols text[],
+    p_after timestamptz,
+    p_before timestamptz
+) returns setof public.stock_prices
+language sql
+stable
+as $$
+    select latest.*
+    from unnest(p_symbols) as requested(symbol)
+    cross join lateral (
+        select *
+        from public.stock_prices
+        where stock_prices.symbol = requested.symbol
+          and stock_prices."timestamp" between p_after and p_before
+        order by stock_prices."timestamp" desc
+        limit 1
+    ) as latest;
+$$;
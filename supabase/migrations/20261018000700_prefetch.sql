@@ -0,0 +1,37 @@
+-- Every held or drafted ticker once, upper cased, for backend/prefetch.py. Read in pages ordered by ticker.
+create or replace function public.prefetch_tickers()
+returns table (ticker text)
+language sql
+stable
+as $$
+    select upper(h.ticker) from public.holdings as h where h.ticker is not null and h.ticker <> ''
+    union
+    select upper(s."Ticker") from public.user_stocks as s where s."Ticker" is not null and s."Ticker" <> '';
+$$;
+
+-- One row per prefetched TIME_CHUNK_SIZE chunk, naming the worker that claimed it, so only one worker prefetches
+-- each chunk. Rows older than a day are removed by the next claim.
+create table if not exists public.prefetch_runs (
+    chunk timestamptz primary key,
+    owner text not null,
+    claimed_at timestamptz not null default now()
+);
+
+-- Claims p_chunk for p_owner. Returns whether this call claimed it.
+create or replace function public.claim_prefetch(p_chunk timestamptz, p_owner text)
+returns boolean
+language plpgsql
+as $$
+declare
+    claimed boolean;
+begin
+    delete from public.prefetch_runs where chunk < p_chunk - interval '1 day';
+
+    insert into public.prefetch_runs (chunk, owner)
+    values (p_chunk, p_owner)
+    on conflict (chunk) do nothing
+    returning true into claimed;
+
+    return coalesce(claimed, false);
+end;
+$$;